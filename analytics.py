@@ -0,0 +1,236 @@
+# analytics.py
+"""In-memory, column-oriented snapshot of the catalog for price analytics.
+
+    python analytics.py [--city NAME] [--percentiles 50,90,99] [--bins 20]
+                        [--bands 2000000,5000000,10000000] [--log-bins]
+
+Snapshot.load() reads `_id`, price, city and status of every listing into
+NumPy arrays, kept sorted by `_id`: ids as 12-byte strings, prices as int64,
+cities and statuses as small integer codes into `cities` / STATUSES. A
+million listings take about 25 MB. Grouped percentiles, histograms, price
+bands and the available/sold split are then a few vectorized passes over
+those arrays instead of an aggregation per question.
+
+refresh() applies only what changed since the last load or refresh: listings
+stamped with a newer `updated_at`, tombstones of removed ones, and, for
+listings written without `updated_at`, any `_id` above the largest known one.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, UTC
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from db import properties_col, tombstones_col
+from metrics import tagged
+from raw_reads import iter_docs
+from search import CITY_KEY, city_key
+from store import STATUSES
+
+PROJECTION = {"price": 1, "city": 1, CITY_KEY: 1, "status": 1}
+OTHER_STATUS = len(STATUSES)  # code for any status not in STATUSES
+REFRESH_LAG = 30.0  # seconds; writes stamped this recently are looked at again next refresh
+DEFAULT_BATCH_SIZE = 5000
+
+
+class Snapshot:
+    """Column arrays for every listing; build with Snapshot.load()."""
+
+    def __init__(self, col=properties_col):
+        self.col = col
+        self.ids = np.empty(0, dtype="S12")
+        self.price = np.empty(0, dtype=np.int64)
+        self.city = np.empty(0, dtype=np.int32)
+        self.status = np.empty(0, dtype=np.int8)
+        self.cities = []        # code -> display name
+        self.city_keys = []     # code -> city_key
+        self._codes = {}        # city_key -> code
+        self.watermark = None
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    @tagged("analytics")
+    def load(cls, col=properties_col, batch_size=DEFAULT_BATCH_SIZE):
+        snap = cls(col)
+        snap.watermark = datetime.now(UTC) - timedelta(seconds=REFRESH_LAG)
+        snap._apply(iter_docs(col, {}, PROJECTION, batch_size=batch_size), [])
+        snap.loaded_at = time.time()
+        return snap
+
+    def _code(self, doc):
+        key = doc.get(CITY_KEY) or city_key(doc.get("city"))
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self.city_keys)
+            self.city_keys.append(key)
+            self.cities.append(doc.get("city") or key)
+        return code
+
+    def _columns(self, docs):
+        status_codes = {s: i for i, s in enumerate(STATUSES)}
+        ids, prices, cities, statuses = [], [], [], []
+        for d in docs:
+            ids.append(d["_id"].binary)
+            prices.append(d.get("price") or 0)
+            cities.append(self._code(d))
+            statuses.append(status_codes.get(d.get("status"), OTHER_STATUS))
+        return (np.array(ids, dtype="S12"), np.array(prices, dtype=np.int64),
+                np.array(cities, dtype=np.int32), np.array(statuses, dtype=np.int8))
+
+    def _positions(self, ids):
+        """Index of each of `ids` in self.ids, and a mask of those present."""
+        pos = np.searchsorted(self.ids, ids)
+        found = pos < len(self.ids)
+        found[found] = self.ids[pos[found]] == ids[found]
+        return pos, found
+
+    def _apply(self, docs, removed):
+        """Upsert `docs` and drop the ids in `removed`, keeping the arrays sorted by `_id`."""
+        ids, price, city, status = self._columns(docs)
+        keep = np.ones(len(self.ids), dtype=bool)
+        if removed:
+            pos, found = self._positions(np.array(removed, dtype="S12"))
+            keep[pos[found]] = False
+        if len(ids):
+            pos, found = self._positions(ids)
+            hit = pos[found]
+            self.price[hit], self.city[hit], self.status[hit] = price[found], city[found], status[found]
+            keep[hit] = True
+            new = ~found
+            ids, price, city, status = ids[new], price[new], city[new], status[new]
+        all_ids = np.concatenate([self.ids[keep], ids])
+        order = np.argsort(all_ids, kind="stable")
+        self.ids = all_ids[order]
+        self.price = np.concatenate([self.price[keep], price])[order]
+        self.city = np.concatenate([self.city[keep], city])[order]
+        self.status = np.concatenate([self.status[keep], status])[order]
+
+    @tagged("analytics")
+    def refresh(self, batch_size=DEFAULT_BATCH_SIZE):
+        """Apply the changes since the last load/refresh; return (upserted, removed) counts."""
+        since = self.watermark
+        next_watermark = datetime.now(UTC) - timedelta(seconds=REFRESH_LAG)
+        removed = [t["_id"].binary for t in tombstones_col.find({"deleted_at": {"$gte": since}}, {"_id": 1})]
+        changed = list(iter_docs(self.col, {"updated_at": {"$gte": since}}, PROJECTION, batch_size=batch_size))
+        if len(self.ids):
+            newest = ObjectId(self.ids[-1].ljust(12, b"\0"))  # NumPy drops trailing NUL bytes
+            seen = {d["_id"] for d in changed}
+            changed += [d for d in iter_docs(self.col, {"_id": {"$gt": newest}, "updated_at": {"$exists": False}},
+                                             PROJECTION, batch_size=batch_size) if d["_id"] not in seen]
+        self._apply(changed, removed)
+        self.watermark = next_watermark
+        self.loaded_at = time.time()
+        return len(changed), len(removed)
+
+    def nbytes(self):
+        return self.ids.nbytes + self.price.nbytes + self.city.nbytes + self.status.nbytes
+
+    # --- queries ---------------------------------------------------------------
+
+    def _mask(self, city=None, status=None):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if city:
+            code = self._codes.get(city_key(city))
+            if code is None:
+                return np.zeros(len(self.ids), dtype=bool)
+            mask &= self.city == code
+        if status:
+            mask &= self.status == (STATUSES.index(status) if status in STATUSES else OTHER_STATUS)
+        return mask
+
+    def percentiles(self, qs=(50, 90, 99), status=None):
+        """Nearest-rank price percentiles per city (and "*" for all cities) as a DataFrame."""
+        mask = self._mask(status=status)
+        price, city = self.price[mask], self.city[mask]
+        order = np.lexsort((price, city))
+        price, city = price[order], city[order]
+        codes, starts, counts = np.unique(city, return_index=True, return_counts=True)
+        all_sorted = np.sort(price)
+        data = {"city": [self.cities[c] for c in codes] + ["*"],
+                "count": np.append(counts, len(price))}
+        for q in qs:
+            rank = np.maximum(np.ceil(q / 100.0 * counts).astype(np.int64), 1) - 1
+            overall = all_sorted[max(int(np.ceil(q / 100.0 * len(price))), 1) - 1] if len(price) else 0
+            data[f"p{q:g}"] = np.append(price[starts + rank], overall)
+        return pd.DataFrame(data)
+
+    def histogram(self, bins=20, city=None, status=None, log=False):
+        """Listing counts per price bin as a DataFrame of [low, high) edges."""
+        price = self.price[self._mask(city, status)]
+        if not len(price):
+            return pd.DataFrame({"low": [], "high": [], "count": []})
+        if log:
+            edges = np.geomspace(max(price.min(), 1), max(price.max(), 2), bins + 1)
+        else:
+            edges = np.linspace(price.min(), price.max(), bins + 1)
+        counts, edges = np.histogram(price, bins=edges)
+        return pd.DataFrame({"low": edges[:-1].round().astype(np.int64), "high": edges[1:].round().astype(np.int64),
+                             "count": counts})
+
+    def band_counts(self, edges, status=None):
+        """Listings per city in each price band (-inf, e1), [e1, e2), ..., [en, inf) as a DataFrame."""
+        mask = self._mask(status=status)
+        edges = np.asarray(sorted(edges), dtype=np.int64)
+        band = np.digitize(self.price[mask], edges)
+        nbands = len(edges) + 1
+        counts = np.bincount(self.city[mask].astype(np.int64) * nbands + band,
+                             minlength=len(self.cities) * nbands).reshape(len(self.cities), nbands)
+        labels = [f"<{edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(edges[:-1], edges[1:])] + [f">={edges[-1]}"] \
+            if len(edges) else ["all"]
+        df = pd.DataFrame(counts, columns=labels)
+        df.insert(0, "city", self.cities)
+        return df[df[labels].sum(axis=1) > 0].reset_index(drop=True)
+
+    def status_share(self):
+        """Available/sold counts and the sold share per city as a DataFrame."""
+        nstatus = OTHER_STATUS + 1
+        counts = np.bincount(self.city.astype(np.int64) * nstatus + self.status,
+                             minlength=len(self.cities) * nstatus).reshape(len(self.cities), nstatus)
+        df = pd.DataFrame(counts[:, :len(STATUSES)], columns=list(STATUSES))
+        df.insert(0, "city", self.cities)
+        total = counts.sum(axis=1)
+        df["sold_share"] = np.divide(df["sold"], total, out=np.zeros(len(total)), where=total > 0)
+        return df[total > 0].reset_index(drop=True)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price analytics over an in-memory snapshot of the catalog")
+    parser.add_argument("--city", help="histogram for this city only")
+    parser.add_argument("--percentiles", default="50,90,99")
+    parser.add_argument("--bins", type=int, default=20)
+    parser.add_argument("--log-bins", action="store_true", help="logarithmic histogram bins")
+    parser.add_argument("--bands", default="2000000,5000000,10000000", help="price band edges")
+    args = parser.parse_args()
+    try:
+        qs = [float(q) for q in args.percentiles.split(",") if q.strip()]
+        edges = [int(e) for e in args.bands.split(",") if e.strip()]
+    except ValueError:
+        parser.error("--percentiles and --bands take comma-separated numbers")
+
+    snap, ms = timed(Snapshot.load)
+    print(f"Loaded {len(snap)} listings in {ms:.0f} ms ({snap.nbytes() / 1e6:.1f} MB, {len(snap.cities)} cities)")
+    if not len(snap):
+        return
+    with pd.option_context("display.max_rows", 100, "display.width", 160):
+        for title, (df, ms) in [
+            ("Price percentiles", timed(snap.percentiles, qs)),
+            (f"Histogram{' for ' + args.city if args.city else ''}",
+             timed(snap.histogram, args.bins, args.city, log=args.log_bins)),
+            ("Price bands", timed(snap.band_counts, edges)),
+            ("Available vs sold", timed(snap.status_share)),
+        ]:
+            print(f"\n{title} ({ms:.1f} ms):")
+            print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,141 @@
 # app.py
-from db import properties_col, owners_col, transactions_col, client
+from db import properties_col, mark, startup_report, STARTUP_TIMING
 from bson import ObjectId
 from bson.errors import InvalidId
-from datetime import datetime, UTC
 import json
-import csv
-from pymongo.errors import OperationFailure
-import re
+from pagination import InvalidToken, find_docs
+from archive import ARCHIVE_COLLECTION
+from export_csv import export_properties, EXPORT_PATH
+import store
+from store import build_property, PropertyError, AlreadySold, PropertyNotFound, PartialWrite, STATUSES
+import city_stats
+import facets
+import local_replica
+import owners
+import sales_stats
+from search import GRAMS_FIELD, MIN_TITLE_SEARCH, TITLE_FOLD, city_filter, city_key, fold, title_filter
+from indexes import ensure_indexes
+from cache import cached, cached_page, query_cache, start_invalidation
+import metrics
+from metrics import tagged
+
+# Derived search fields are not shown when printing documents.
+HIDDEN = {GRAMS_FIELD: 0, TITLE_FOLD: 0}
 
 def insert_property():
-    ti = input("title: ").strip()
+    title = input("title: ").strip()
     city = input("city: ").strip()
     if not title or not city:
         print("Title and city are required.")
         return
     try:
-        price = int(input("price: "))
-        if price < 0:
-            print("Price cannot be negative.")
+        doc = build_property(title, city, input("price: "), owner_id=input("owner id (blank for none): ").strip())
+        print("Inserted id:", store.insert_property(doc))
+    except (PropertyError, owners.OwnerNotFound) as e:
+        print(e)
+
+def ask_include_archived():
+    return input("include archived listings? [y/N]: ").strip().lower() == "y"
+
+@tagged("list")
+def list_properties(token=None, per_page=5, include_archived=False):
+    # Keyset pagination on (price, _id): every page is an index seek, however deep.
+    union = ARCHIVE_COLLECTION if include_archived else None
+    while True:
+        try:
+            page = cached_page(properties_col, token=token, per_page=per_page, projection=HIDDEN, union_with=union)
+        except InvalidToken as e:
+            print(e)
+            return
+        if not page.docs:
+            print("No properties found.")
+            return
+        for d in page.docs:
+            print(json.dumps(d, default=str, indent=2))
+        if page.next_token:
+            print("Next page token:", page.next_token)
+        choices = []
+        if page.next_token:
+            choices.append("n) next")
+        if page.prev_token:
+            choices.append("p) prev")
+        choices.append("q) back")
+        nav = input("  ".join(choices) + ": ").strip().lower()
+        if nav == "n" and page.next_token:
+            token = page.next_token
+        elif nav == "p" and page.prev_token:
+            token = page.prev_token
+        else:
             return
-    except ValueError:
-        print("Price must be a number.")
-        return
-    doc = {"title": title, "city": city, "price": price, "status": "available", "created_at": datetime.now(UTC)}
-    res = properties_col.insert_one(doc)
-    print("Inserted id:", res.inserted_id)
 
-def list_properties(page=1, per_page=5):
-    skip = (page-1)*per_page
-    docs = list(properties_col.find({}).sort("price", 1).skip(skip).limit(per_page))
-    if not docs:
-        print("No properties found.")
-        return
-    for d in docs:
-        print(json.dumps(d, default=str, indent=2))
+def search_docs(namespace, params, query, sort=None, limit=0, union=None, scope=None):
+    # Answered by the local replica when it holds everything the query needs, else cached MongoDB reads
+    if local_replica.serves(properties_col, query, union, sort):
+        return local_replica.find_docs(query, HIDDEN, sort, limit)
+    return cached(namespace, params, lambda: find_docs(properties_col, query, HIDDEN, sort, limit, union), scope=scope)
 
+@tagged("search")
 def find_by_city():
     city = input("city: ").strip()
     if not city:
         print("City cannot be empty.")
         return
-    # Case-insensitive partial match
-    pattern = re.escape(city)
-    docs = list(properties_col.find({"city": {"$regex": pattern, "$options": "i"}}))
+    union = ARCHIVE_COLLECTION if ask_include_archived() else None
+    # Case/accent-insensitive prefix match: an index range on the normalized city_key
+    key = city_key(city)
+    docs = search_docs("city", {"k": key, "u": union}, city_filter(city), union=union, scope=key)
     if not docs:
         print("No properties in", city)
         return
     for d in docs:
         print(json.dumps(d, default=str, indent=2))
 
+@tagged("search")
+def find_by_title():
+    text = input("title contains: ").strip()
+    if len(fold(text)) < MIN_TITLE_SEARCH:
+        print(f"Enter at least {MIN_TITLE_SEARCH} characters of the title.")
+        return
+    union = ARCHIVE_COLLECTION if ask_include_archived() else None
+    # Case-insensitive partial match served by the title_grams index
+    docs = search_docs("title", {"t": fold(text), "u": union}, title_filter(text), [("price", 1)], 50, union)
+    if not docs:
+        print("No properties matching", text)
+        return
+    for d in docs:
+        print(json.dumps(d, default=str, indent=2))
+
+@tagged("search")
+def advanced_search(per_page=5):
+    # Every criterion is optional; one aggregation returns the first page and the facet counts
+    try:
+        query = facets.build_filter(
+            city=input("city (prefix, blank for any): "),
+            title=input("title contains (blank for any): "),
+            min_price=input("min price: ").strip(),
+            max_price=input("max price: ").strip(),
+            status=input(f"status ({'/'.join(STATUSES)}, blank for any): ").strip() or None,
+            listed_from=input("listed from (YYYY-MM-DD, blank for any): ").strip(),
+            listed_before=input("listed before (YYYY-MM-DD, blank for any): ").strip())
+    except PropertyError as e:
+        print(e)
+        return
+    union = ARCHIVE_COLLECTION if ask_include_archived() else None
+    page, counts = facets.search(query, None, per_page, HIDDEN, union)
+    print("\n".join(facets.summary_lines(counts)))
+    while page.docs:
+        for d in page.docs:
+            print(json.dumps(d, default=str, indent=2))
+        choices = (["n) next"] if page.next_token else []) + (["p) prev"] if page.prev_token else []) + ["q) back"]
+        nav = input("  ".join(choices) + ": ").strip().lower()
+        token = page.next_token if nav == "n" else page.prev_token if nav == "p" else None
+        if not token:
+            return
+        # Later pages are plain keyset pages; the counts above still hold
+        page = cached_page(properties_col, query=query, token=token, per_page=per_page, projection=HIDDEN,
+                           union_with=union)
+    print("No properties match.")
+
 def update_price():
     pid = input("property id: ").strip()
     try:
@@ -65,8 +152,7 @@ def update_price():
         print("Invalid property id format.")
         return
     try:
-        r = properties_col.update_one({"_id": obj_id}, {"$set": {"price": newp}})
-        print("Modified count:", r.modified_count)
+        print("Modified count:", store.update_price(obj_id, newp))
     except Exception as e:
         print("Error updating:", e)
 
@@ -78,54 +164,63 @@ def delete_property():
         print("Invalid property id format.")
         return
     try:
-        r = properties_col.delete_one({"_id": obj_id})
-        print("Deleted count:", r.deleted_count)
+        print("Deleted count:", store.delete_property(obj_id))
     except Exception as e:
         print("Error deleting:", e)
 
 def create_index():
-    i1 = properties_col.create_index([("city", 1)])
-    i2 = properties_col.create_index([("price", 1)])
-    print("Created indexes:", i1, i2)
+    # Idempotent: only indexes missing from the spec in indexes.py are built
+    for coll_name, created in ensure_indexes().items():
+        print(f"{coll_name}:", ", ".join(created) if created else "up to date")
     print("Indexes:", properties_col.index_information())
 
+@tagged("stats")
 def avg_price_per_city():
-    pipeline = [{"$group": {"_id": "$city", "avgPrice": {"$avg": "$price"}, "count": {"$sum": 1}}}]
-    res = list(properties_col.aggregate(pipeline))
+    # Served from the materialized city_stats collection (keyed by normalized city), not a $group scan
+    res = cached("city_stats", {}, city_stats.read_stats)
     if not res:
         print("No aggregate results.")
         return
     for r in res:
-        print(r)
+        print({"_id": r["_id"], "city": r.get("city"), "avgPrice": r["avgPrice"], "count": r.get("count"),
+               "min": r.get("min"), "max": r.get("max"), "available": r.get("available"), "sold": r.get("sold")})
 
-def export_csv():
-    docs = list(properties_col.find({}))
-    if not docs:
-        print("No documents to export.")
+@tagged("stats")
+def sales_report():
+    # Read from the daily/monthly rollups maintained at purchase time, never from transactions
+    by = "day" if input("by day or month? [d/M]: ").strip().lower() == "d" else "month"
+    city = input("city (blank for all cities): ").strip()
+    try:
+        last = int(input("periods to show [12]: ").strip() or 12)
+    except ValueError:
+        print("Periods must be a number.")
         return
-    # Gather all field names
-    fieldnames = set()
-    rows = []
-    for d in docs:
-        row = {}
-        for k, v in d.items():
-            if k == "_id":
-                row[k] = str(v)
-            else:
-                row[k] = v
-            fieldnames.add(k)
-        rows.append(row)
-    fieldnames = list(fieldnames)
-    path = "properties_export.csv"
+    key = city_key(city) if city else None
+    rows = cached("sales", {"by": by, "k": key, "n": last},
+                  lambda: sales_stats.read_sales(by, city or None, last=last), scope=key)
+    if not rows:
+        print("No sales recorded.")
+        return
+    for r in rows:
+        print(f"{r['period']}: {r['count']} sales, revenue {r['revenue']}, avg {r['avgPrice']:.0f}, "
+              f"min {r['min']}, max {r['max']}")
+    if not city:
+        latest = rows[0]["period"]
+        print(f"By city, {latest}:")
+        for r in cached("sales_cities", {"by": by, "p": latest}, lambda: sales_stats.read_city_totals(by, latest)):
+            print(f"  {r.get('city') or '(unknown)'}: {r['count']} sales, revenue {r['revenue']}, "
+                  f"avg {r['avgPrice']:.0f}")
+
+def export_csv():
     try:
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for r in rows:
-                writer.writerow(r)
-        print("Exported to", path)
+        stats = export_properties(EXPORT_PATH, progress=lambda n, t: print(f"  {n} rows ({n / t:.0f} rows/s)"))
     except Exception as e:
         print("Failed to export:", e)
+        return
+    if not stats.rows:
+        print("No documents to export.")
+        return
+    print(f"Exported {stats.rows} rows to {stats.path} ({stats.rows_per_sec:.0f} rows/s)")
 
 def purchase_transaction():
     print("NOTE: Transactions require a replica set or Atlas. If you're running local MongoDB without a replica set this may fail.")
@@ -150,32 +245,74 @@ def purchase_transaction():
         return
 
     try:
-        # First attempt transactional flow
-        try:
-            with client.start_session() as session:
-                with session.start_transaction():
-                    r = properties_col.update_one({"_id": obj_id, "status": "available"}, {"$set": {"status": "sold"}}, session=session)
-                    if r.modified_count == 0:
-                        raise Exception("Not available")
-                    transactions_col.insert_one({"property_id": obj_id, "buyer_name": buyer, "price": price, "date": datetime.now(UTC)}, session=session)
-            print("Purchase success (transaction)")
+        # Transactional when the server supports it, conditional update + insert otherwise
+        transactional = store.purchase_property(obj_id, buyer, price)
+        print("Purchase success (transaction)" if transactional else "Purchase success (no transactions available on this server)")
+    except AlreadySold:
+        print("Already sold")
+    except PropertyNotFound:
+        print("Property not found")
+    except PartialWrite as e:
+        print(e)
+    except Exception as e:
+        print("Transaction failed:", e)
+
+def show_portfolio(owner_id, per_page=5):
+    # Owner and summary by _id, then keyset pages on (owner_id, price, _id): no $lookup, no scan
+    token = None
+    while True:
+        owner, page = owners.portfolio_page(owner_id, token, per_page)
+        if token is None:
+            print(owners.summary_line(owner))
+        for d in page.docs:
+            print(json.dumps(d, default=str, indent=2))
+        choices = (["n) next"] if page.next_token else []) + (["p) prev"] if page.prev_token else []) + ["q) back"]
+        if len(choices) == 1:
             return
-        except OperationFailure:
-            # server doesn't support transactions, fall back
-            pass
-
-        # Non-transactional fallback
-        r = properties_col.update_one({"_id": obj_id, "status": "available"}, {"$set": {"status": "sold"}})
-        if r.modified_count == 0:
-            print("Not available")
+        nav = input("  ".join(choices) + ": ").strip().lower()
+        token = page.next_token if nav == "n" else page.prev_token if nav == "p" else None
+        if not token:
             return
+
+def manage_owners():
+    print("a) add owner  f) find owners  s) show portfolio  g) give a property to an owner  d) delete owner")
+    c = input("Choose: ").strip().lower()
+    try:
+        if c == "a":
+            print("Owner id:", owners.create_owner(input("name: "), input("email: "), input("phone: ")))
+        elif c == "f":
+            found = owners.find_owners(input("name starts with (blank for all): "))
+            for owner in found:
+                print(owners.summary_line(owner))
+            if not found:
+                print("No owners found.")
+        elif c == "s":
+            show_portfolio(owners.parse_owner_id(input("owner id: ")))
+        elif c == "g":
+            try:
+                obj_id = ObjectId(input("property id: ").strip())
+            except InvalidId:
+                print("Invalid property id format.")
+                return
+            oid = input("owner id (blank to remove the owner): ").strip()
+            print("Modified count:", store.assign_owner(obj_id, owners.parse_owner_id(oid) if oid else None))
+        elif c == "d":
+            owners.delete_owner(owners.parse_owner_id(input("owner id: ")))
+            print("Owner deleted.")
+    except (owners.OwnerError, owners.OwnerNotFound, PropertyNotFound) as e:
+        print(e)
+
+def show_cache_stats():
+    for k, v in query_cache.stats().items():
+        print(f"{k}: {v:.1%}" if k == "hit_ratio" else f"{k}: {v}")
+
+def show_metrics():
+    print("\n".join(metrics.summary_lines()))
+    if input("write Prometheus metrics file? [y/N]: ").strip().lower() == "y":
         try:
-            transactions_col.insert_one({"property_id": obj_id, "buyer_name": buyer, "price": price, "date": datetime.now(UTC)})
-            print("Purchase success (no transactions available on this server)")
-        except Exception as ie:
-            print("Property marked sold but failed to record transaction:", ie)
-    except Exception as e:
-        print("Transaction failed:", e)
+            print("Wrote", metrics.write_prometheus())
+        except OSError as e:
+            print("Could not write metrics:", e)
 
 MENU = """
 1) Insert property
@@ -187,21 +324,36 @@ MENU = """
 7) Avg price per city (aggregate)
 8) Export CSV (backup)
 9) Purchase (transaction demo)
+10) Find by title
+11) Cache statistics
+12) Command metrics
+13) Sales report
+14) Search by city, title, price, status and listing date (with counts)
+15) Owners and portfolios
 0) Exit
 """
 
 def main():
+    mark("imports")
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print("Could not ensure indexes:", e)
+    mark("indexes ensured (first server round trips)")
+    start_invalidation()
+    local_replica.start_sync()
+    metrics.serve_from_env()
+    mark("menu ready")
+    if STARTUP_TIMING:
+        print("\n".join(["Startup timing:"] + startup_report()))
     while True:
         print(MENU)
         c = input("Choose: ").strip()
         if c == "1":
             insert_property()
         elif c == "2":
-            try:
-                p = int(input("page (1): ") or 1)
-            except ValueError:
-                p = 1
-            list_properties(page=p)
+            tok = input("continuation token (blank for first page): ").strip()
+            list_properties(token=tok or None, include_archived=ask_include_archived())
         elif c == "3":
             find_by_city()
         elif c == "4":
@@ -216,6 +368,18 @@ def main():
             export_csv()
         elif c == "9":
             purchase_transaction()
+        elif c == "10":
+            find_by_title()
+        elif c == "11":
+            show_cache_stats()
+        elif c == "12":
+            show_metrics()
+        elif c == "13":
+            sales_report()
+        elif c == "14":
+            advanced_search()
+        elif c == "15":
+            manage_owners()
         elif c == "0":
             break
         else:
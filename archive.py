@@ -0,0 +1,186 @@
+# archive.py
+"""Move sold (and optionally stale) listings out of the hot `properties` collection.
+
+    python archive.py [--stale-days N] [--min-age-days N] [--chunk-size 500]
+                      [--rate DOCS_PER_SEC] [--pause SECONDS] [--limit N] [--dry-run]
+
+Matching listings are copied to `properties_archive`, their sales to
+`transactions_archive`, and both are deleted from the hot collections, one
+chunk at a time. Each chunk runs in a transaction where the server supports
+one. Otherwise the chunk's ids are recorded in `meta` first, so an interrupted
+run finishes that chunk when restarted; every step is idempotent. The job
+resumes by itself, since archived listings no longer match the query.
+--rate and --pause throttle it so it can run next to live traffic.
+
+city_stats and the owners' portfolio summaries keep describing the hot
+collection: archived listings are subtracted from them. Owners keep a count
+of their archived sales (`sold_archived`), so their sales total does not drop. Reads include the archive only when asked (the
+"include archived" options in app.py, ui.py, service.py and export_csv.py),
+via $unionWith on ARCHIVE_COLLECTION.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, UTC
+from pymongo import ReplaceOne
+import city_stats
+import owners
+import store
+from db import (meta_col, properties_archive_col, properties_col, tombstones_col, transactions_archive_col,
+                transactions_col)
+from metrics import tagged
+from search import CITY_KEY
+
+ARCHIVE_COLLECTION = "properties_archive"
+PENDING_ID = "archive_pending"
+DEFAULT_CHUNK_SIZE = 500
+MAX_CITY_INVALIDATIONS = 50
+
+
+def archive_filter(sold=True, stale_days=None, min_age_days=0, now=None):
+    """Listings to archive: sold ones (older than `min_age_days`), plus available ones older than `stale_days`."""
+    now = now or datetime.now(UTC)
+    clauses = []
+    if sold:
+        clause = {"status": "sold"}
+        if min_age_days:
+            clause["created_at"] = {"$lt": now - timedelta(days=min_age_days)}
+        clauses.append(clause)
+    if stale_days is not None:
+        clauses.append({"status": "available", "created_at": {"$lt": now - timedelta(days=stale_days)}})
+    if not clauses:
+        raise ValueError("Nothing selected to archive")
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _move(ids, query, session=None):
+    """Archive the listings among `ids` that still match `query`, with their sales; return the removed docs."""
+    selected = {"$and": [{"_id": {"$in": ids}}, query]}
+    docs = list(properties_col.find(selected, session=session))
+    if docs:
+        now = datetime.now(UTC)
+        properties_archive_col.bulk_write([ReplaceOne({"_id": d["_id"]}, dict(d, archived_at=now), upsert=True)
+                                           for d in docs], ordered=False, session=session)
+        properties_col.delete_many(selected, session=session)
+        tombstones_col.bulk_write([ReplaceOne({"_id": d["_id"]}, {"deleted_at": now, "reason": "archived"}, upsert=True)
+                                   for d in docs], ordered=False, session=session)
+    # A listing that changed between the copy and the delete stays hot; drop its stray archive copy.
+    still_hot = {d["_id"] for d in properties_col.find({"_id": {"$in": ids}}, {"_id": 1}, session=session)}
+    if still_hot:
+        properties_archive_col.delete_many({"_id": {"$in": list(still_hot)}}, session=session)
+        tombstones_col.delete_many({"_id": {"$in": list(still_hot)}}, session=session)
+    moved = [i for i in ids if i not in still_hot]
+    sales = list(transactions_col.find({"property_id": {"$in": moved}}, session=session))
+    if sales:
+        transactions_archive_col.bulk_write([ReplaceOne({"_id": s["_id"]}, s, upsert=True) for s in sales],
+                                            ordered=False, session=session)
+        transactions_col.delete_many({"_id": {"$in": [s["_id"] for s in sales]}}, session=session)
+    return [d for d in docs if d["_id"] not in still_hot]
+
+
+def _invalidate(keys):
+    if len(keys) > MAX_CITY_INVALIDATIONS:
+        store.changed(None)
+        return
+    for key in keys:
+        store.changed({CITY_KEY: key})
+
+
+def resume_pending():
+    """Finish a chunk left half-done by an interrupted non-transactional run; return its size."""
+    pending = meta_col.find_one({"_id": PENDING_ID})
+    if not pending:
+        return 0
+    _move(pending["ids"], pending["query"])
+    # Some of the chunk may have been deleted before the stats were updated: recount those cities and owners.
+    city_stats.rebuild(pending["cities"])
+    owners.rebuild(pending.get("owners", []))
+    _invalidate(pending["cities"])
+    meta_col.delete_one({"_id": PENDING_ID})
+    return len(pending["ids"])
+
+
+def archive_chunk(query, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Archive up to `chunk_size` matching listings; return (docs archived, transactional)."""
+    def write(session):
+        ids = [d["_id"] for d in properties_col.find(query, {"_id": 1}, session=session).limit(chunk_size)]
+        if not ids:
+            return []
+        if session is None:
+            current = list(properties_col.find({"_id": {"$in": ids}}, {"city": 1, CITY_KEY: 1, "owner_id": 1}))
+            cities = sorted({city_stats.key_of(d) for d in current})
+            owner_ids = list({d["owner_id"] for d in current if d.get("owner_id") is not None})
+            meta_col.replace_one({"_id": PENDING_ID},
+                                 {"ids": ids, "query": query, "cities": cities, "owners": owner_ids}, upsert=True)
+        docs = _move(ids, query, session)
+        city_stats.record_removals(docs, session)
+        owners.record_removals(docs, session, archived=True)
+        if session is None:
+            meta_col.delete_one({"_id": PENDING_ID})
+        return docs
+    docs, transactional = store.run_in_transaction(write)
+    _invalidate({city_stats.key_of(d) for d in docs})
+    return docs, transactional
+
+
+@tagged("archive")
+def archive(query, chunk_size=DEFAULT_CHUNK_SIZE, rate=None, pause=0.0, limit=None, progress=None):
+    """Archive matching listings chunk by chunk; return a report dict.
+
+    `rate` caps the documents archived per second and `pause` sleeps between
+    chunks; `limit` stops after about that many listings. `progress(report)`
+    is called after each chunk.
+    """
+    report = {"archived": 0, "chunks": 0, "resumed": resume_pending(), "seconds": 0.0, "transactional": None}
+    start = time.perf_counter()
+    while limit is None or report["archived"] < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - report["archived"])
+        docs, transactional = archive_chunk(query, size)
+        if not docs:
+            break
+        report["archived"] += len(docs)
+        report["chunks"] += 1
+        report["transactional"] = transactional
+        report["seconds"] = time.perf_counter() - start
+        if progress:
+            progress(report)
+        delay = pause
+        if rate:
+            delay = max(delay, report["archived"] / rate - (time.perf_counter() - start))
+        if delay > 0:
+            time.sleep(delay)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive sold or stale listings out of the hot collection")
+    parser.add_argument("--no-sold", action="store_true", help="do not archive sold listings")
+    parser.add_argument("--min-age-days", type=int, default=0, help="only sold listings created this long ago")
+    parser.add_argument("--stale-days", type=int, help="also archive available listings older than this")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--rate", type=float, help="maximum listings archived per second")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between chunks")
+    parser.add_argument("--limit", type=int, help="stop after this many listings")
+    parser.add_argument("--dry-run", action="store_true", help="only count matching listings")
+    args = parser.parse_args()
+
+    try:
+        query = archive_filter(not args.no_sold, args.stale_days, args.min_age_days)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.dry_run:
+        print(f"{properties_col.count_documents(query)} listings would be archived")
+        return
+
+    def show(r):
+        print(f"  {r['archived']} archived in {r['chunks']} chunks ({r['archived'] / max(r['seconds'], 1e-9):.0f}/s)")
+
+    report = archive(query, args.chunk_size, args.rate, args.pause, args.limit, progress=show)
+    if report["resumed"]:
+        print(f"Finished an interrupted chunk of {report['resumed']} listings")
+    mode = {True: "transactions", False: "no transactions", None: "nothing to do"}[report["transactional"]]
+    print(f"Archived {report['archived']} listings in {report['seconds']:.1f}s ({mode})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+# benchmark.py
+"""Synthetic data generator and operation benchmark.
+
+    python benchmark.py run [--size 100000] [--seed 42] [--iterations 200] [--out FILE]
+                            [--standin] [--reload]
+    python benchmark.py compare OLD.json NEW.json [--threshold 0.2]
+
+`run` loads a deterministic synthetic catalog (listings across many cities,
+skewed so a few cities are large, plus a transaction for every sold listing)
+into a separate database, then times the operations the CLI and UI perform:
+listing pages, city and title search, price updates, purchases, deletes, the
+average-per-city and sales reports, the analytics snapshot and a full CSV
+export. The report is written as JSON
+with p50/p95/p99 latencies per operation. The same --size/--seed always
+produces the same documents, so a dataset left from an earlier run is reused
+unless --reload is given.
+
+The database defaults to MONGO_DB=real_estate_bench (the collections there are
+dropped and rebuilt), and the query cache is disabled so every call reaches
+the server. --standin runs against an in-process mongomock server instead of
+MONGO_URI; it needs the `mongomock` package and has no transactions.
+
+`compare` prints the change per operation and exits non-zero if any p50 or p95
+latency grew by more than --threshold (and by at least --min-ms).
+"""
+import os
+
+# Before the project modules read them: never benchmark the real database or the cache.
+os.environ.setdefault("MONGO_DB", "real_estate_bench")
+os.environ.setdefault("CACHE_DISABLED", "1")
+
+import argparse
+import json
+import math
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, UTC
+from bson import ObjectId
+import analytics
+import city_stats
+import db
+import raw_reads
+import sales_stats
+import store
+from bulk_insert import load_records
+from export_csv import export_properties
+from indexes import ensure_indexes
+from pagination import fetch_page
+from search import CITY_KEY, GRAMS_FIELD, MIN_TITLE_SEARCH, TITLE_FOLD, city_filter, city_key, title_filter
+
+DEFAULT_SIZE = 100000
+DEFAULT_SEED = 42
+DEFAULT_CITIES = 500
+DEFAULT_ITERATIONS = 200
+PAGE_SIZE = 200
+DATASET_ID = "benchmark_dataset"
+START = datetime(2020, 1, 1, tzinfo=UTC)
+SPAN_SECONDS = 5 * 365 * 24 * 3600
+SOLD_SHARE = 0.15
+HIDDEN = {GRAMS_FIELD: 0, TITLE_FOLD: 0}
+
+CITIES = ["Mumbai", "Delhi", "Bengaluru", "Hyderabad", "Chennai", "Kolkata", "Pune", "Ahmedabad", "Jaipur",
+          "Surat", "Lucknow", "Kanpur", "Nagpur", "Indore", "Thane", "Bhopal", "Visakhapatnam", "Patna",
+          "Vadodara", "Ghaziabad", "Ludhiana", "Agra", "Nashik", "Faridabad", "Meerut", "Rajkot", "Varanasi",
+          "Srinagar", "Aurangabad", "Dhanbad", "Amritsar", "Ranchi", "Coimbatore", "Kochi", "Goa", "Mysuru"]
+SYLLABLES = ["ra", "pur", "na", "ga", "bad", "nag", "ko", "li", "sha", "vi", "dur", "gaon", "ma", "tan", "de"]
+ADJECTIVES = ["Ocean View", "Skyline", "Green Valley", "Royal", "Sunshine", "Hillcrest", "Lake Side", "Silver Oak",
+              "Palm Grove", "Golden", "Riverfront", "Maple", "Orchid", "Lotus", "Emerald", "Harbour"]
+KINDS = ["Apartment", "Residency", "Villa", "Towers", "Heights", "Home", "Flat", "Enclave", "Court", "Plaza"]
+BUYERS = ["Aarav", "Diya", "Kabir", "Meera", "Rohan", "Sara", "Vivaan", "Anaya", "Ishaan", "Zara"]
+
+
+# --- deterministic data ------------------------------------------------------
+
+def city_names(count, seed=DEFAULT_SEED):
+    """`count` distinct city names: the real ones first, then generated ones."""
+    rng = random.Random(seed)
+    names = list(CITIES[:count])
+    seen = set(names)
+    while len(names) < count:
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def listing_id(i, size):
+    """The `_id` of listing `i`: creation time spread over SPAN_SECONDS, then the index."""
+    ts = int(START.timestamp()) + i * SPAN_SECONDS // max(size, 1)
+    return ObjectId(struct.pack(">IQ", ts, i))
+
+
+def generate_listings(size, seed=DEFAULT_SEED, cities=DEFAULT_CITIES):
+    """Yield `size` raw listing records (bulk_insert.load_records() input), the same for the same arguments.
+
+    City sizes follow a Zipf-like curve, prices depend on the city's rank, and
+    SOLD_SHARE of listings are sold.
+    """
+    rng = random.Random(seed)
+    names = city_names(cities, seed)
+    weights, total = [], 0.0
+    for rank in range(1, len(names) + 1):
+        total += 1.0 / rank
+        weights.append(total)
+    for i in range(size):
+        rank = rng.choices(range(len(names)), cum_weights=weights)[0]
+        base = 9000000 - 6000000 * rank // len(names)
+        _id = listing_id(i, size)
+        yield {
+            "_id": _id,
+            "title": f"{rng.choice(ADJECTIVES)} {rng.choice(KINDS)} {rng.randint(1, 999)}",
+            "city": names[rank],
+            "price": int(base * rng.uniform(0.5, 1.8)) // 1000 * 1000,
+            "status": "sold" if rng.random() < SOLD_SHARE else "available",
+            "created_at": _id.generation_time,
+        }
+
+
+def generate_transactions(size, seed=DEFAULT_SEED, cities=DEFAULT_CITIES):
+    """Yield one sale for every sold listing from generate_listings()."""
+    rng = random.Random(seed + 1)
+    for doc in generate_listings(size, seed, cities):
+        if doc["status"] == "sold":
+            yield {
+                "property_id": doc["_id"],
+                "buyer_name": rng.choice(BUYERS),
+                "price": doc["price"],
+                "date": doc["created_at"],
+                "city": doc["city"],
+                CITY_KEY: city_key(doc["city"]),
+            }
+
+
+# --- setup -------------------------------------------------------------------
+
+def load_dataset(size, seed, cities, reload=False, chunk_size=5000, workers=4):
+    """Load the synthetic catalog unless the same one is already present; return load stats."""
+    spec = {"size": size, "seed": seed, "cities": cities}
+    marker = db.meta_col.find_one({"_id": DATASET_ID})
+    if not reload and marker and marker.get("spec") == spec \
+            and db.properties_col.estimated_document_count() == size:
+        return {"reused": True}
+    for name in ("properties", "transactions", "city_stats", "sales_daily", "sales_monthly", "meta"):
+        db.db[name].drop()
+    report = load_records(generate_listings(size, seed, cities), db.properties_col,
+                          chunk_size=chunk_size, workers=workers)
+    start = time.perf_counter()
+    sales, chunk = 0, []
+    for t in generate_transactions(size, seed, cities):
+        chunk.append(t)
+        if len(chunk) >= chunk_size:
+            db.transactions_col.insert_many(chunk, ordered=False)
+            sales, chunk = sales + len(chunk), []
+    if chunk:
+        db.transactions_col.insert_many(chunk, ordered=False)
+        sales += len(chunk)
+    tx_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    buckets = sales_stats.rebuild()
+    rollup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    ensure_indexes()
+    index_seconds = time.perf_counter() - start
+    db.meta_col.replace_one({"_id": DATASET_ID}, {"spec": spec}, upsert=True)
+    return {
+        "reused": False,
+        "listings": report["inserted"],
+        "listings_per_sec": report["inserted"] / report["seconds"] if report["seconds"] else 0.0,
+        "transactions": sales,
+        "transactions_seconds": tx_seconds,
+        "sales_buckets": buckets,
+        "rollup_seconds": rollup_seconds,
+        "index_seconds": index_seconds,
+    }
+
+
+# --- timing ------------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    k = math.ceil(p / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(ms),
+        "mean_ms": sum(ms) / len(ms) if ms else None,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": ms[-1] if ms else None,
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def run_operations(size, seed, cities, iterations):
+    """Time each operation `iterations` times (export once); return {name: summary}."""
+    rng = random.Random(seed + 2)
+    names = city_names(cities, seed)
+    ops = {}
+
+    # Walk the catalog in keyset order (wrapping at the end); with keyset
+    # pagination page N should cost the same as page 1.
+    samples, token, page_no, deepest = [], None, 0, 0
+    while len(samples) < iterations:
+        start = time.perf_counter()
+        page = fetch_page(db.properties_col, {}, token, PAGE_SIZE, HIDDEN)
+        samples.append(time.perf_counter() - start)
+        page_no = page_no + 1 if token else 1
+        deepest = max(deepest, page_no)
+        token = page.next_token
+    ops["list_page"] = dict(summarize(samples), deepest_page=deepest)
+
+    def city_search():
+        name = rng.choice(names[:50])
+        fetch_page(db.properties_col, city_filter(name[:rng.randint(2, len(name))]), None, PAGE_SIZE, HIDDEN)
+    ops["city_search"] = summarize([timed(city_search) for _ in range(iterations)])
+
+    def title_search():
+        text = rng.choice(ADJECTIVES + KINDS)
+        list(db.properties_col.find(title_filter(text[:rng.randint(MIN_TITLE_SEARCH, len(text))]), HIDDEN).sort("price", 1).limit(50))
+    ops["title_search"] = summarize([timed(title_search) for _ in range(iterations)])
+
+    ops["avg_per_city"] = summarize([timed(city_stats.read_stats) for _ in range(iterations)])
+
+    def sales_report():
+        # Every month of history for all cities, then a year of days for one city.
+        sales_stats.read_sales("month")
+        sales_stats.read_sales("day", rng.choice(names[:50]), last=365)
+    ops["sales_report"] = summarize([timed(sales_report) for _ in range(iterations)])
+
+    snap, ms = analytics.timed(analytics.Snapshot.load)
+    ops["analytics_load"] = dict(summarize([ms / 1000]), rows=len(snap), mb=snap.nbytes() / 1e6)
+
+    def analytics_queries():
+        snap.percentiles()
+        snap.histogram(city=rng.choice(names[:50]))
+        snap.band_counts([2000000, 5000000, 10000000])
+        snap.status_share()
+    ops["analytics_query"] = summarize([timed(analytics_queries) for _ in range(iterations)])
+
+    # Write paths work on distinct listings so each call does real work.
+    picks = rng.sample(range(size), min(size, iterations * 4))
+    update_ids = [listing_id(i, size) for i in picks[:iterations]]
+    ops["update_price"] = summarize([timed(store.update_price, oid, rng.randint(1000000, 20000000))
+                                     for oid in update_ids])
+
+    candidates = [listing_id(i, size) for i in picks[iterations:]]
+    available = [d["_id"] for d in db.properties_col.find({"_id": {"$in": candidates}, "status": "available"}, {"_id": 1})]
+    purchase_ids, delete_ids = available[:iterations], available[iterations:2 * iterations]
+    ops["purchase"] = summarize([timed(store.purchase_property, oid, rng.choice(BUYERS), 5000000)
+                                 for oid in purchase_ids])
+    ops["delete"] = summarize([timed(store.delete_property, oid) for oid in delete_ids])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = export_properties(os.path.join(tmp, "export.csv"))
+    ops["export"] = dict(summarize([stats.seconds]), rows=stats.rows, rows_per_sec=stats.rows_per_sec)
+    return ops
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def use_standin():
+    """Point db.py at an in-process mongomock server; must run before the first query."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("--standin needs the mongomock package (pip install mongomock)")
+    import pymongo
+    from mongomock.collection import BulkOperationBuilder
+    pymongo.MongoClient = mongomock.MongoClient
+    store._supports_transactions = False  # mongomock has no sessions
+    raw_reads.RAW_READS = False  # nor find_raw_batches()
+    # pymongo >= 4.11 passes UpdateOne/ReplaceOne's `sort` to bulk builders that predate it.
+    for name in ("add_update", "add_replace"):
+        setattr(BulkOperationBuilder, name, _without_sort(getattr(BulkOperationBuilder, name)))
+
+
+def _without_sort(add):
+    def wrapper(self, *args, sort=None, **kwargs):
+        if sort:
+            raise NotImplementedError("mongomock bulk writes cannot sort")
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+def run(args):
+    if args.standin:
+        use_standin()
+    elif db.DB_NAME == "real_estate_db":
+        raise SystemExit("Refusing to benchmark the application database; set MONGO_DB to another name")
+    backend = "mongomock" if args.standin else db.MONGO_URI.split("@")[-1]
+    print(f"Loading {args.size} listings (seed {args.seed}) into {db.DB_NAME} on {backend}...")
+    load = load_dataset(args.size, args.seed, args.cities, reload=args.reload)
+    print("reused existing dataset" if load["reused"] else
+          f"{load['listings']} listings at {load['listings_per_sec']:.0f}/s, {load['transactions']} transactions, "
+          f"{load['sales_buckets']} sales buckets")
+    ops = run_operations(args.size, args.seed, args.cities, args.iterations)
+    server = None if args.standin else db.client.server_info().get("version")
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(UTC).isoformat(),
+            "size": args.size,
+            "seed": args.seed,
+            "cities": args.cities,
+            "iterations": args.iterations,
+            "backend": "mongomock" if args.standin else "mongod",
+            "server_version": server,
+            "python": platform.python_version(),
+        },
+        "load": load,
+        "operations": ops,
+    }
+    out = args.out or f"benchmark-{report['meta']['commit'] or 'local'}-{args.size}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"{'operation':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in ops.items():
+        print(f"{name:<14}{s['count']:>7}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+    print("Report written to", out)
+
+
+def compare(old, new, threshold=0.2, min_ms=0.5):
+    """Compare two reports; return (lines, regressions)."""
+    lines, regressions = [], []
+    for name, n in new["operations"].items():
+        o = old["operations"].get(name)
+        if o is None:
+            lines.append(f"{name:<14} new operation")
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms"):
+            before, after = o.get(key), n.get(key)
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            parts.append(f"{key[:3]} {before:.2f} -> {after:.2f} ms ({change:+.0%})")
+            if change > threshold and after - before >= min_ms:
+                regressions.append(f"{name} {key[:3]}")
+        lines.append(f"{name:<14} " + ", ".join(parts))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic data generator and operation benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="load synthetic data and time every operation")
+    r.add_argument("--size", type=int, default=DEFAULT_SIZE, help="number of listings (10k to 10M)")
+    r.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    r.add_argument("--cities", type=int, default=DEFAULT_CITIES)
+    r.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    r.add_argument("--out", help="report path (default benchmark-<commit>-<size>.json)")
+    r.add_argument("--standin", action="store_true", help="use an in-process mongomock server")
+    r.add_argument("--reload", action="store_true", help="regenerate the dataset even if it is present")
+    c = sub.add_parser("compare", help="flag regressions between two reports")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown (0.2 = 20%%)")
+    c.add_argument("--min-ms", type=float, default=0.5, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+        return
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    lines, regressions = compare(old, new, args.threshold, args.min_ms)
+    print("\n".join(lines))
+    if regressions:
+        print("REGRESSIONS:", ", ".join(regressions))
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
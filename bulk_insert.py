@@ -1,8 +1,46 @@
 # bulk_insert.py
-from db import properties_col
+"""Streaming bulk loader for the properties collection.
+
+    python bulk_insert.py                  # seed the 50 sample properties below
+    python bulk_insert.py FEED [--format csv|jsonl] [--chunk-size N] [--workers N]
+                               [--checkpoint PATH] [--rejects PATH] [--restart]
+
+FEED is read as a stream (CSV with a header row, e.g. properties_export.csv, or
+JSON Lines in MongoDB extended JSON). Every record is validated and coerced
+with store.build_property(), the same rules the CLI and UI apply, and written
+in unordered insert_many chunks by a pool of worker threads while the main
+thread keeps parsing. After each chunk the number of consumed records is saved
+to a checkpoint file, so an interrupted load resumes where it stopped;
+duplicate `_id`s from a re-run are counted rather than failing the load.
+Rejected records go to a JSON Lines file together with their error.
+
+An optional `owner_id` column assigns each listing to an owner; records naming
+an unknown owner are rejected, as store.insert_property() refuses them. The
+portfolios of the owners a load touched are recounted when it finishes, so a
+load that is killed leaves them for `python owners.py --rebuild`.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, UTC
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+import city_stats
+import owners
+from cache import bump_version
+from db import properties_col
+from store import build_property, PropertyError
 
-properties = [
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_WORKERS = 4
+DUPLICATE_KEY = 11000
+
+SAMPLE_PROPERTIES = [
     ("Ocean View Apartment", "Mumbai", 4500000),
     ("Skyline Residency", "Mumbai", 5200000),
     ("Blue Orchid Flat", "Mumbai", 6100000),
@@ -64,17 +102,220 @@ properties = [
     ("Sunrise Enclave", "Ahmedabad", 4700000)
 ]
 
-docs = []
+def _text(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def parse_created_at(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            raise PropertyError(f"Invalid created_at: {value!r}") from None
+    return dt if dt.tzinfo else dt.replace(tzinfo=UTC)
+
+
+def parse_object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(str(value).strip())
+    except (InvalidId, TypeError):
+        raise PropertyError(f"Invalid _id: {value!r}") from None
+
+
+def coerce_record(raw):
+    """Turn one raw feed record (CSV row or JSON object) into a property document."""
+    doc = build_property(_text(raw.get("title")), _text(raw.get("city")), raw.get("price"),
+                         status=raw.get("status") or "available",
+                         created_at=parse_created_at(raw.get("created_at")), owner_id=_text(raw.get("owner_id")))
+    if raw.get("_id") not in (None, ""):
+        doc["_id"] = parse_object_id(raw["_id"])
+    return doc
+
+
+def read_records(path, fmt):
+    """Yield raw records from `path`; unparseable JSON lines are yielded as ValueError instances."""
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json_util.loads(line)
+            except ValueError as e:
+                yield e
+                continue
+            yield raw if isinstance(raw, dict) else ValueError("Record is not a JSON object")
+
+
+def write_chunk(docs, col=properties_col):
+    """Insert one chunk unordered; return (inserted, duplicates, [(index in docs, error), ...]).
+
+    The city_stats of the inserted documents are updated afterwards, per chunk
+    rather than per transaction; `city_stats.py --verify` reconciles drift if a
+    load is killed between the two writes. Documents naming an unknown owner
+    are not inserted and come back as failed.
+    """
+    unknown = owners.missing(d["owner_id"] for d in docs if d.get("owner_id") is not None)
+    orphans = [(i, owners.OwnerNotFound("Owner not found")) for i, d in enumerate(docs) if d.get("owner_id") in unknown]
+    # Positions in `docs` of what is sent, since write errors index the documents actually inserted.
+    sent = [i for i, d in enumerate(docs) if d.get("owner_id") not in unknown]
+    errors = []
+    if sent:
+        try:
+            col.insert_many([docs[i] for i in sent], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+    failed_at = {sent[w["index"]] for w in errors}
+    city_stats.record_inserts([docs[i] for i in sent if i not in failed_at])
+    bump_version()
+    dups = sum(1 for w in errors if w.get("code") == DUPLICATE_KEY)
+    failed = orphans + [(sent[w["index"]], w.get("errmsg")) for w in errors if w.get("code") != DUPLICATE_KEY]
+    return len(sent) - len(failed_at), dups, sorted(failed, key=lambda f: f[0])
+
+
+def load_checkpoint(path, source):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        cp = json.load(f)
+    return cp["records"] if cp.get("source") == source else 0
+
+
+def save_checkpoint(path, source, records):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "records": records, "saved_at": datetime.now(UTC).isoformat()}, f)
+    os.replace(tmp, path)
+
+
+def load_records(records, col=properties_col, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+                 skip=0, checkpoint=None, source=None, rejects=None, progress=None):
+    """Validate and insert `records`, overlapping parsing with chunked writes.
+
+    The first `skip` records are passed over (they were loaded by an earlier
+    run). `checkpoint` is saved after every chunk that finishes in order,
+    `rejects` is an open text file receiving rejected records, and
+    `progress(report)` is called after each chunk. Returns the report dict.
+    """
+    report = {"read": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "skipped": skip, "seconds": 0.0}
+    start = time.perf_counter()
+    pending = deque()
+
+    def reject(record_no, raw, error):
+        report["rejected"] += 1
+        if rejects:
+            rejects.write(json.dumps({"record": record_no, "error": str(error), "data": raw}, default=str) + "\n")
+
+    def finish_oldest():
+        future, end_no, docs, record_nos = pending.popleft()
+        inserted, dups, failed = future.result()
+        report["inserted"] += inserted
+        report["duplicates"] += dups
+        for i, error in failed:
+            reject(record_nos[i], docs[i], error)
+        if checkpoint:
+            save_checkpoint(checkpoint, source, end_no)
+        report["seconds"] = time.perf_counter() - start
+        if progress:
+            progress(report)
+
+    record_no = 0
+    chunk, chunk_nos = [], []
+    owner_ids = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for raw in records:
+            record_no += 1
+            if record_no <= skip:
+                continue
+            report["read"] += 1
+            if isinstance(raw, Exception):
+                reject(record_no, None, raw)
+                continue
+            try:
+                doc = coerce_record(raw)
+            except PropertyError as e:
+                reject(record_no, raw, e)
+                continue
+            chunk.append(doc)
+            chunk_nos.append(record_no)
+            if doc.get("owner_id") is not None:
+                owner_ids.add(doc["owner_id"])
+            if len(chunk) >= chunk_size:
+                pending.append((pool.submit(write_chunk, chunk, col), record_no, chunk, chunk_nos))
+                chunk, chunk_nos = [], []
+                # Bound the documents held in memory while workers catch up.
+                while len(pending) >= workers * 2:
+                    finish_oldest()
+        if chunk:
+            pending.append((pool.submit(write_chunk, chunk, col), record_no, chunk, chunk_nos))
+        while pending:
+            finish_oldest()
+    if owner_ids:
+        owners.rebuild(owner_ids)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def format_report(report):
+    secs = report["seconds"]
+    rate = report["inserted"] / secs if secs > 0 else 0.0
+    return (f"read {report['read']}, inserted {report['inserted']}, duplicates {report['duplicates']}, "
+            f"rejected {report['rejected']}, resumed past {report['skipped']} "
+            f"in {secs:.2f}s ({rate:.0f} docs/s)")
+
+
+def seed_samples():
+    records = ({"title": t, "city": c, "price": p} for t, c, p in SAMPLE_PROPERTIES)
+    report = load_records(records)
+    print(f"Inserted {report['inserted']} properties successfully.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load properties from a CSV or JSON Lines feed")
+    parser.add_argument("feed", nargs="?", help="CSV or JSONL file; omit to seed the sample properties")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--checkpoint", help="default: FEED.checkpoint.json")
+    parser.add_argument("--rejects", help="default: FEED.rejects.jsonl")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    if not args.feed:
+        seed_samples()
+        return
+
+    fmt = args.format or ("csv" if args.feed.lower().endswith(".csv") else "jsonl")
+    source = os.path.abspath(args.feed)
+    checkpoint = args.checkpoint or args.feed + ".checkpoint.json"
+    skip = 0 if args.restart else load_checkpoint(checkpoint, source)
+    if skip:
+        print(f"Resuming after record {skip} (checkpoint {checkpoint})")
+
+    def show(report):
+        print("  " + format_report(report))
 
-for title, city, price in properties:
-    docs.append({
-        "title": title,
-        "city": city,
-        "price": price,
-        "status": "available",
-        "created_at": datetime.now(UTC)
-    })
+    with open(args.rejects or args.feed + ".rejects.jsonl", "a", encoding="utf-8") as rejects:
+        report = load_records(read_records(args.feed, fmt), chunk_size=args.chunk_size, workers=args.workers,
+                              skip=skip, checkpoint=checkpoint, source=source, rejects=rejects, progress=show)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print("Done:", format_report(report))
+    if report["rejected"]:
+        print("Rejected records written to", rejects.name)
+    elif os.path.getsize(rejects.name) == 0:
+        os.remove(rejects.name)
 
-properties_col.insert_many(docs)
 
-print("Inserted 50 properties successfully.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# cache.py
+"""Read-through cache for the listing, search and aggregate queries.
+
+Entries are keyed by a namespace plus the normalized query parameters, evicted
+LRU-first once the cache exceeds its entry or byte budget, and expire after a
+TTL. Each entry has a scope: a city_key prefix for city searches, or None for
+results any change can affect (listing pages, title search, city stats).
+
+Invalidation is precise where possible:
+  * store.py drops the entries for a city as soon as it writes to it;
+  * a change stream on `properties` does the same for writes made by other
+    processes (start_invalidation());
+  * standalone servers have no change streams, so a poller watches a version
+    counter that every write path bumps and clears the cache when it moves.
+
+Settings come from the environment: CACHE_MAX_MB (64), CACHE_MAX_ENTRIES
+(10000), CACHE_TTL_SECONDS (60), CACHE_POLL_SECONDS (2); CACHE_DISABLED=1
+turns caching off.
+"""
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pymongo.errors import OperationFailure, PyMongoError
+import local_replica
+from db import properties_col, meta_col
+from metrics import tagged
+from pagination import fetch_page
+
+VERSION_ID = "properties_version"
+
+
+class QueryCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=10000, ttl=60.0, enabled=True):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> (value, size, expires_at, scope)
+        self._bytes = 0
+        self._epoch = 0  # bumped by every invalidation, so a load that raced one is not stored
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    @staticmethod
+    def make_key(namespace, params):
+        return namespace + ":" + json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+
+    def get_or_load(self, namespace, params, loader, scope=None):
+        """Return the cached result for (namespace, params), calling loader() on a miss."""
+        if not self.enabled:
+            return loader()
+        key = self.make_key(namespace, params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._drop(key)
+                self.expirations += 1
+            self.misses += 1
+            epoch = self._epoch
+        value = loader()
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if epoch == self._epoch and size <= self.max_bytes:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (value, size, time.monotonic() + self.ttl, scope)
+                self._bytes += size
+                while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def invalidate_city(self, city_key=None):
+        """Drop entries a change to `city_key` can affect; None (unknown city) drops everything."""
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            if city_key is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [k for k, e in self._entries.items() if e[3] is None or city_key.startswith(e[3])]:
+                self._drop(key)
+
+    def clear(self):
+        self.invalidate_city(None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "mode": _mode,
+            }
+
+
+query_cache = QueryCache(
+    max_bytes=int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024),
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("CACHE_TTL_SECONDS", "60")),
+    enabled=os.getenv("CACHE_DISABLED", "") not in ("1", "true", "yes"),
+)
+
+_mode = "local"  # "change-stream" or "version-poll" once start_invalidation() has run
+_started = False
+_start_lock = threading.Lock()
+
+
+def bump_version():
+    """Record that `properties` changed, for processes that cannot use change streams."""
+    meta_col.update_one({"_id": VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def _current_version():
+    doc = meta_col.find_one({"_id": VERSION_ID})
+    return doc["version"] if doc else 0
+
+
+def _changed_city(change):
+    doc = change.get("fullDocument") or {}
+    return doc.get("city_key")
+
+
+@tagged("cache")
+def _watch_changes(cache):
+    global _mode
+    try:
+        with properties_col.watch(full_document="updateLookup") as stream:
+            _mode = "change-stream"
+            cache.clear()  # anything cached before the stream opened may have missed a change
+            for change in stream:
+                # Deletes carry no document, so the city is unknown and everything goes.
+                cache.invalidate_city(_changed_city(change))
+    except OperationFailure:
+        pass  # standalone server: no change streams
+    except PyMongoError:
+        pass  # stream broke; fall through to polling rather than serve stale data
+    cache.clear()
+    _poll_version(cache, float(os.getenv("CACHE_POLL_SECONDS", "2")))
+
+
+def _poll_version(cache, interval):
+    global _mode
+    _mode = "version-poll"
+    last = None
+    while True:
+        try:
+            version = _current_version()
+            if last is not None and version != last:
+                cache.clear()
+            last = version
+        except PyMongoError:
+            cache.clear()
+        time.sleep(interval)
+
+
+def start_invalidation(cache=query_cache):
+    """Start the background invalidation thread once per process (no-op when caching is off)."""
+    global _started
+    if not cache.enabled:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_watch_changes, args=(cache,), name="cache-invalidation", daemon=True).start()
+
+
+def cached(namespace, params, loader, scope=None):
+    return query_cache.get_or_load(namespace, params, loader, scope)
+
+
+def cached_page(col, query=None, token=None, per_page=5, projection=None, union_with=None):
+    """pagination.fetch_page() through the cache, or straight from the local replica when it can answer."""
+    if local_replica.serves(col, query, union_with):
+        return local_replica.fetch_page(query, token, per_page, projection)
+    params = {"q": query, "t": token, "n": per_page, "p": projection, "u": union_with}
+    return cached("page:" + col.name, params,
+                  lambda: fetch_page(col, query, token, per_page, projection, union_with))
@@ -0,0 +1,178 @@
+# city_stats.py
+"""Materialized per-city price statistics.
+
+`city_stats` holds one document per city_key with the listing count, price
+sum/min/max and available/sold counts. The write paths in store.py update it
+incrementally in the same transaction as the property change, so reading the
+stats never scans `properties`. min/max cannot be decremented, so after a price
+change or delete they are re-read from the (city_key, price) index.
+
+    python city_stats.py --verify     # report drift against a full recount
+    python city_stats.py --rebuild    # recompute everything from properties
+"""
+import argparse
+from collections import defaultdict
+from pymongo import UpdateOne
+from db import properties_col, city_stats_col
+from search import CITY_KEY, city_key
+
+FIELDS = ("count", "sum", "min", "max", "available", "sold")
+
+
+def key_of(doc):
+    return doc.get(CITY_KEY) or city_key(doc.get("city"))
+
+
+def _status_inc(status, n):
+    return {status: n} if status in ("available", "sold") else {}
+
+
+def record_insert(doc, session=None):
+    record_inserts([doc], session=session)
+
+
+def record_inserts(docs, session=None):
+    """Add newly inserted listings, one upsert per city."""
+    groups = defaultdict(lambda: {"city": None, "inc": defaultdict(int), "min": None, "max": None})
+    for d in docs:
+        g = groups[key_of(d)]
+        price = d.get("price") or 0
+        g["city"] = g["city"] or d.get("city")
+        g["inc"]["count"] += 1
+        g["inc"]["available"] += 0  # always present, so a new city starts with both counters
+        g["inc"]["sold"] += 0
+        g["inc"]["sum"] += price
+        for k, v in _status_inc(d.get("status"), 1).items():
+            g["inc"][k] += v
+        g["min"] = price if g["min"] is None else min(g["min"], price)
+        g["max"] = price if g["max"] is None else max(g["max"], price)
+    ops = [
+        UpdateOne({"_id": key},
+                  {"$inc": dict(g["inc"]), "$min": {"min": g["min"]}, "$max": {"max": g["max"]},
+                   "$setOnInsert": {"city": g["city"]}},
+                  upsert=True)
+        for key, g in groups.items()
+    ]
+    if ops:
+        city_stats_col.bulk_write(ops, ordered=False, session=session)
+
+
+def refresh_extremes(key, session=None):
+    """Re-read min/max price for one city from the (city_key, price) index."""
+    q = {CITY_KEY: key}
+    lo = properties_col.find_one(q, {"price": 1}, sort=[("price", 1)], session=session)
+    hi = properties_col.find_one(q, {"price": 1}, sort=[("price", -1)], session=session)
+    if lo is None:
+        city_stats_col.delete_one({"_id": key}, session=session)
+        return
+    city_stats_col.update_one({"_id": key}, {"$set": {"min": lo.get("price"), "max": hi.get("price")}}, session=session)
+
+
+def record_price_change(old_doc, new_price, session=None):
+    key = key_of(old_doc)
+    delta = new_price - (old_doc.get("price") or 0)
+    city_stats_col.update_one({"_id": key}, {"$inc": {"sum": delta}}, session=session)
+    refresh_extremes(key, session)
+
+
+def record_delete(old_doc, session=None):
+    key = key_of(old_doc)
+    inc = {"count": -1, "sum": -(old_doc.get("price") or 0)}
+    inc.update(_status_inc(old_doc.get("status"), -1))
+    city_stats_col.update_one({"_id": key}, {"$inc": inc}, session=session)
+    refresh_extremes(key, session)
+
+
+def record_removals(docs, session=None):
+    """Take listings that left `properties` in bulk (e.g. archived) out of the stats, one update per city."""
+    groups = defaultdict(lambda: defaultdict(int))
+    for d in docs:
+        inc = groups[key_of(d)]
+        inc["count"] -= 1
+        inc["sum"] -= d.get("price") or 0
+        for k, v in _status_inc(d.get("status"), -1).items():
+            inc[k] += v
+    ops = [UpdateOne({"_id": key}, {"$inc": dict(inc)}) for key, inc in groups.items()]
+    if ops:
+        city_stats_col.bulk_write(ops, ordered=False, session=session)
+    for key in groups:
+        refresh_extremes(key, session)
+    return set(groups)
+
+
+def record_sale(doc, session=None):
+    city_stats_col.update_one({"_id": key_of(doc)}, {"$inc": {"available": -1, "sold": 1}}, session=session)
+
+
+def _recount_pipeline(keys=None):
+    pipeline = [{"$match": {CITY_KEY: {"$in": list(keys)}}}] if keys is not None else []
+    pipeline.append({"$group": {
+        "_id": f"${CITY_KEY}",
+        "city": {"$first": "$city"},
+        "count": {"$sum": 1},
+        "sum": {"$sum": "$price"},
+        "min": {"$min": "$price"},
+        "max": {"$max": "$price"},
+        "available": {"$sum": {"$cond": [{"$eq": ["$status", "available"]}, 1, 0]}},
+        "sold": {"$sum": {"$cond": [{"$eq": ["$status", "sold"]}, 1, 0]}},
+    }})
+    return pipeline
+
+
+def rebuild(keys=None):
+    """Recompute stats from properties, for every city or just `keys`; return the cities written."""
+    if keys is None:
+        properties_col.aggregate(_recount_pipeline() + [{"$out": city_stats_col.name}])
+        return city_stats_col.count_documents({})
+    keys = set(keys)
+    fresh = list(properties_col.aggregate(_recount_pipeline(keys)))
+    ops = [UpdateOne({"_id": d["_id"]}, {"$set": {f: d[f] for f in ("city",) + FIELDS}}, upsert=True) for d in fresh]
+    if ops:
+        city_stats_col.bulk_write(ops, ordered=False)
+    gone = keys - {d["_id"] for d in fresh}
+    if gone:
+        city_stats_col.delete_many({"_id": {"$in": list(gone)}})
+    return len(fresh)
+
+
+def verify():
+    """Compare the materialized stats with a full recount; return a list of drift descriptions."""
+    expected = {d["_id"]: d for d in properties_col.aggregate(_recount_pipeline())}
+    actual = {d["_id"]: d for d in city_stats_col.find({})}
+    drift = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        e, a = expected.get(key), actual.get(key)
+        if e is None or a is None:
+            drift.append(f"{key!r}: {'missing from city_stats' if a is None else 'no listings but stats present'}")
+            continue
+        for f in FIELDS:
+            if e.get(f) != a.get(f):
+                drift.append(f"{key!r}.{f}: expected {e.get(f)}, found {a.get(f)}")
+    return drift
+
+
+def read_stats():
+    """All city stats with the average price filled in, ordered by city key."""
+    rows = list(city_stats_col.find({}).sort("_id", 1))
+    for r in rows:
+        r["avgPrice"] = r["sum"] / r["count"] if r.get("count") else None
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify or rebuild the materialized city_stats collection")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--verify", action="store_true")
+    group.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt stats for {rebuild()} cities")
+        return
+    drift = verify()
+    for line in drift:
+        print(line)
+    print("city_stats is consistent" if not drift else f"{len(drift)} differences; run with --rebuild to fix")
+
+
+if __name__ == "__main__":
+    main()
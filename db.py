@@ -1,14 +1,176 @@
+"""MongoDB connection and collection handles.
+
+The client is created on first use, not at import, so scripts (and the UI
+window) start without waiting on it. `client`, `db` and the `*_col` names are
+stand-ins that create the client the first time one of their attributes is
+used; get_client() / get_db() return the real objects.
+
+Connection settings come from the environment (or a .env file):
+
+    MONGO_URI                          mongodb://localhost:27017
+    MONGO_DB                           real_estate_db
+    MONGO_MAX_POOL_SIZE                100
+    MONGO_MIN_POOL_SIZE                0      connections kept open (and opened early)
+    MONGO_MAX_IDLE_MS                  unset  close pooled connections idle this long
+    MONGO_CONNECT_TIMEOUT_MS           5000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS  5000
+    MONGO_SOCKET_TIMEOUT_MS            unset  (no timeout)
+    MONGO_COMPRESSORS                  unset  e.g. "zstd,snappy,zlib"; ones whose
+                                              Python package is missing are skipped
+    MONGO_READ_CONCERN                 unset  local / majority / ...
+    MONGO_WRITE_CONCERN                unset  majority or a number of nodes
+    MONGO_RETRY_WRITES                 1
+    MONGO_WARMUP                       0      1: ping the server in the background
+                                              as soon as the client is created
+    STARTUP_TIMING                     0      1: record startup marks (startup_report())
+"""
 import os
-from pymongo import MongoClient
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+STARTUP_TIMING = os.getenv("STARTUP_TIMING", "") in ("1", "true", "yes")
+_marks = [("import db", time.perf_counter())]
+
+
+def mark(label):
+    """Record a startup milestone when STARTUP_TIMING is on."""
+    if STARTUP_TIMING:
+        _marks.append((label, time.perf_counter()))
+
+
+def startup_report():
+    """Lines describing the time between consecutive startup marks."""
+    lines = []
+    marks = sorted(_marks, key=lambda m: m[1])
+    for (_, prev), (label, at) in zip(marks, marks[1:]):
+        lines.append(f"{(at - prev) * 1000:8.1f} ms  {label}")
+    lines.append(f"{(marks[-1][1] - marks[0][1]) * 1000:8.1f} ms  total since {marks[0][0]}")
+    return lines
+
+
 # Default: local MongoDB; or put your Atlas URI in a .env file as MONGO_URI
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-client = MongoClient(MONGO_URI)
-db = client["real_estate_db"]
+DB_NAME = os.getenv("MONGO_DB", "real_estate_db")
+
+_client = None
+_lock = threading.Lock()
+
+
+def _int_env(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _available_compressors(names):
+    available = []
+    for name in names:
+        module = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}.get(name)
+        if module is None:
+            continue
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def client_options():
+    """MongoClient keyword arguments built from the environment."""
+    opts = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE", 0),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS", 5000),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "retryWrites": os.getenv("MONGO_RETRY_WRITES", "1") not in ("0", "false", "no"),
+    }
+    if _int_env("MONGO_MAX_IDLE_MS") is not None:
+        opts["maxIdleTimeMS"] = _int_env("MONGO_MAX_IDLE_MS")
+    if _int_env("MONGO_SOCKET_TIMEOUT_MS") is not None:
+        opts["socketTimeoutMS"] = _int_env("MONGO_SOCKET_TIMEOUT_MS")
+    compressors = _available_compressors(c.strip() for c in os.getenv("MONGO_COMPRESSORS", "").split(",") if c.strip())
+    if compressors:
+        opts["compressors"] = compressors
+    if os.getenv("MONGO_READ_CONCERN"):
+        opts["readConcernLevel"] = os.getenv("MONGO_READ_CONCERN")
+    w = os.getenv("MONGO_WRITE_CONCERN")
+    if w:
+        opts["w"] = int(w) if w.isdigit() else w
+    return opts
+
+
+def get_client():
+    """The shared MongoClient, created on first call (thread-safe)."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from pymongo import MongoClient
+                _client = MongoClient(MONGO_URI, **client_options())
+                mark("MongoClient created")
+                if os.getenv("MONGO_WARMUP", "") in ("1", "true", "yes"):
+                    threading.Thread(target=warm_up, name="mongo-warmup", daemon=True).start()
+    return _client
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+def async_client():
+    """A new pymongo AsyncMongoClient with the same settings, for use inside one event loop."""
+    from pymongo import AsyncMongoClient
+    return AsyncMongoClient(MONGO_URI, **client_options())
+
+
+def warm_up():
+    """Select a server and open a pooled connection now rather than on the first query."""
+    try:
+        get_client().admin.command("ping")
+        mark("first server round trip (warm-up)")
+    except Exception:
+        pass  # the first real query reports the error
+
+
+class _Lazy:
+    """Forwards attribute and item access to the object factory() returns, created on first use."""
+
+    def __init__(self, factory, label):
+        self._factory = factory
+        self._label = label
+        self._target = None
+
+    def _get(self):
+        if self._target is None:
+            self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __repr__(self):
+        return f"<lazy {self._label}>" if self._target is None else repr(self._target)
+
+
+client = _Lazy(get_client, "MongoClient")
+db = _Lazy(get_db, DB_NAME)
 
-properties_col = db["properties"]
-owners_col = db["owners"]
-transactions_col = db["transactions"]
+properties_col = _Lazy(lambda: get_db()["properties"], "properties")
+owners_col = _Lazy(lambda: get_db()["owners"], "owners")
+transactions_col = _Lazy(lambda: get_db()["transactions"], "transactions")
+city_stats_col = _Lazy(lambda: get_db()["city_stats"], "city_stats")
+meta_col = _Lazy(lambda: get_db()["meta"], "meta")
+# Ids of listings removed from properties, read by export_delta.py.
+tombstones_col = _Lazy(lambda: get_db()["tombstones"], "tombstones")
+# Sales rollups maintained by sales_stats.py.
+sales_daily_col = _Lazy(lambda: get_db()["sales_daily"], "sales_daily")
+sales_monthly_col = _Lazy(lambda: get_db()["sales_monthly"], "sales_monthly")
+# Cold tier written by archive.py; read only when a caller asks for archived listings.
+properties_archive_col = _Lazy(lambda: get_db()["properties_archive"], "properties_archive")
+transactions_archive_col = _Lazy(lambda: get_db()["transactions_archive"], "transactions_archive")
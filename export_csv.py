@@ -1,23 +1,129 @@
-﻿from db import properties_col
-import csv
-
-docs = list(properties_col.find({}))
-
-keys = set()
-rows = []
-
-for d in docs:
-    row = {}
-    for k, v in d.items():
-        row[k] = str(v)
-        keys.add(k)
-    rows.append(row)
-
-keys = list(keys)
-
-with open("properties_export.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.DictWriter(f, fieldnames=keys)
-    writer.writeheader()
-    writer.writerows(rows)
-
-print("Exported", len(rows), "rows to properties_export.csv")
+# export_csv.py
+"""Streaming CSV export of the properties collection.
+
+Used by app.py (menu option 8), ui.py (Export CSV button) and as a standalone
+script. Rows are written straight from raw_reads batches of `batch_size`
+documents, so memory stays flat regardless of collection size; the header comes from a
+declared field list (or a small sample of documents) instead of a full scan.
+
+    python export_csv.py [--out PATH] [--batch-size N] [--fields a,b,c | --sample N]
+"""
+import argparse
+import csv
+import os
+import time
+from collections import namedtuple
+from bson import ObjectId
+from db import properties_col, properties_archive_col
+from metrics import tagged
+from raw_reads import iter_batches
+
+EXPORT_PATH = "properties_export.csv"
+DEFAULT_FIELDS = ["_id", "title", "city", "price", "status", "created_at"]
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_SAMPLE_SIZE = 100
+
+ExportStats = namedtuple("ExportStats", ["path", "rows", "seconds", "rows_per_sec"])
+
+
+def sample_fields(col=properties_col, sample_size=DEFAULT_SAMPLE_SIZE):
+    """Discover field names from the first `sample_size` documents, `_id` first."""
+    fields = ["_id"]
+    for d in col.find({}).limit(sample_size):
+        for k in d:
+            if k not in fields:
+                fields.append(k)
+    return fields
+
+
+def _cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, ObjectId):
+        return str(v)
+    return v
+
+
+def projection_for(fields):
+    projection = {f: 1 for f in fields}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    return projection
+
+
+def to_row(doc, fields):
+    return [_cell(doc.get(f)) for f in fields]
+
+
+def iter_rows(col=properties_col, fields=DEFAULT_FIELDS, query=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield one list of cell values per document, projected to `fields`."""
+    for batch in iter_batches(col, query, projection_for(fields), batch_size=batch_size):
+        for d in batch:
+            yield to_row(d, fields)
+
+
+@tagged("export")
+def export_properties(path=EXPORT_PATH, fields=DEFAULT_FIELDS, col=properties_col, query=None,
+                      batch_size=DEFAULT_BATCH_SIZE, sample_size=DEFAULT_SAMPLE_SIZE,
+                      progress=None, progress_every=10000, include_archived=False):
+    """Stream `col` into a CSV file at `path` and return an ExportStats.
+
+    `fields=None` samples the schema from the collection instead of using the
+    declared field list. `progress(rows, elapsed_seconds)` is called every
+    `progress_every` rows. `include_archived` appends the rows of
+    properties_archive after those of `col`. The file is written to a temporary path and moved
+    into place when complete; if nothing matched, no file is written.
+    """
+    if fields is None:
+        fields = sample_fields(col, sample_size)
+    tmp_path = path + ".tmp"
+    start = time.perf_counter()
+    rows = 0
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for source in [col, properties_archive_col] if include_archived else [col]:
+                for row in iter_rows(source, fields, query, batch_size):
+                    writer.writerow(row)
+                    rows += 1
+                    if progress and rows % progress_every == 0:
+                        progress(rows, time.perf_counter() - start)
+        if rows:
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    seconds = time.perf_counter() - start
+    return ExportStats(path, rows, seconds, rows / seconds if seconds > 0 else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the properties collection to CSV")
+    parser.add_argument("--out", default=EXPORT_PATH)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--fields", help="comma-separated field list (default: %s)" % ",".join(DEFAULT_FIELDS))
+    parser.add_argument("--sample", type=int, metavar="N", help="derive the header from the first N documents instead")
+    parser.add_argument("--include-archived", action="store_true", help="also export archived listings")
+    args = parser.parse_args()
+
+    fields = DEFAULT_FIELDS
+    if args.fields:
+        fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    elif args.sample:
+        fields = None
+
+    def report(rows, elapsed):
+        print(f"  {rows} rows ({rows / elapsed:.0f} rows/s)")
+
+    stats = export_properties(args.out, fields=fields, batch_size=args.batch_size,
+                              sample_size=args.sample or DEFAULT_SAMPLE_SIZE, progress=report,
+                              include_archived=args.include_archived)
+    if not stats.rows:
+        print("No documents to export.")
+        return
+    print(f"Exported {stats.rows} rows to {stats.path} in {stats.seconds:.2f}s ({stats.rows_per_sec:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
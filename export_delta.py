@@ -0,0 +1,227 @@
+# export_delta.py
+"""Incremental CSV export: one base snapshot, then delta files of what changed.
+
+    python export_delta.py [--dir DIR] [--lag SECONDS]   # base on the first run, a delta afterwards
+    python export_delta.py --compact [--dir DIR] [--keep]
+    python export_delta.py --full [--dir DIR]            # start over with a fresh base
+    python export_delta.py --prune-tombstones DAYS
+
+Every write path stamps `updated_at` on the listing, and deletes (and
+archive.py) leave a tombstone in `tombstones`. A delta run reads only the
+listings and tombstones stamped since the watermark stored in the
+directory's _manifest.json, through the (updated_at, _id) and
+(deleted_at, _id) indexes, so its cost follows the churn rather than the
+collection size. Delta rows start with an `_op` column, "upsert" or
+"delete", in the order the changes were made; applying base then deltas in
+manifest order reproduces the collection. Each run stops `lag` seconds in
+the past, so a write stamped just before the run but committed just after it
+is picked up by the next delta rather than lost.
+
+--compact merges the deltas into a new base file without reading MongoDB,
+holding only the changed rows in memory.
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+from datetime import datetime, timedelta, UTC
+from db import properties_col, tombstones_col
+from export_csv import DEFAULT_BATCH_SIZE, DEFAULT_FIELDS, iter_rows, projection_for, to_row
+from metrics import tagged
+from raw_reads import iter_docs
+
+DELTA_DIR = "properties_delta"
+MANIFEST = "_manifest.json"
+FIELDS = DEFAULT_FIELDS + ["updated_at"]
+DEFAULT_LAG = 30.0  # seconds
+
+
+def _stamp(ts):
+    return ts.strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _write_csv(path, header, rows):
+    """Write rows to `path` via a temporary file; return the row count."""
+    count = 0
+    with open(path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    os.replace(path + ".tmp", path)
+    return count
+
+
+@tagged("export")
+def export_base(out_dir=DELTA_DIR, lag=DEFAULT_LAG, batch_size=DEFAULT_BATCH_SIZE):
+    """Write a full snapshot and start a new manifest, replacing any earlier files; return the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    previous = load_manifest(out_dir)
+    until = datetime.now(UTC) - timedelta(seconds=lag)
+    name = f"base-{_stamp(until)}.csv"
+    rows = _write_csv(os.path.join(out_dir, name), FIELDS, iter_rows(properties_col, FIELDS, None, batch_size))
+    manifest = {"fields": FIELDS, "base": name, "base_rows": rows, "watermark": until.isoformat(), "deltas": []}
+    save_manifest(out_dir, manifest)
+    if previous:
+        _remove(out_dir, [previous["base"]] + [d["file"] for d in previous["deltas"]], keep=name)
+    return manifest
+
+
+def _remove(out_dir, names, keep):
+    for name in names:
+        if name != keep and os.path.exists(os.path.join(out_dir, name)):
+            os.remove(os.path.join(out_dir, name))
+
+
+def changes_between(since, until, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield delta rows (`_op` first) for listings changed and removed in [since, until), oldest first."""
+    upserts = iter_docs(properties_col, {"updated_at": {"$gte": since, "$lt": until}}, projection_for(FIELDS),
+                        [("updated_at", 1), ("_id", 1)], batch_size=batch_size)
+    deletes = iter_docs(tombstones_col, {"deleted_at": {"$gte": since, "$lt": until}}, None,
+                        [("deleted_at", 1), ("_id", 1)], batch_size=batch_size)
+    stamp_at = FIELDS.index("updated_at")
+    merged = heapq.merge(
+        ((d["updated_at"], 0, ["upsert"] + to_row(d, FIELDS)) for d in upserts),
+        ((t["deleted_at"], 1, ["delete", str(t["_id"])] + [""] * (len(FIELDS) - 1)) for t in deletes),
+        key=lambda item: (item[0], item[1]))
+    try:
+        for ts, _, row in merged:
+            row[1 + stamp_at] = row[1 + stamp_at] or ts
+            yield row
+    finally:
+        upserts.close()
+        deletes.close()
+
+
+@tagged("export")
+def export_delta(out_dir=DELTA_DIR, lag=DEFAULT_LAG, batch_size=DEFAULT_BATCH_SIZE):
+    """Append a delta of the changes since the watermark (a base on the first run); return the run's entry."""
+    manifest = load_manifest(out_dir)
+    if manifest is None:
+        manifest = export_base(out_dir, lag, batch_size)
+        return {"file": manifest["base"], "base": True, "rows": manifest["base_rows"]}
+    since = datetime.fromisoformat(manifest["watermark"])
+    until = datetime.now(UTC) - timedelta(seconds=lag)
+    entry = {"file": None, "since": since.isoformat(), "until": until.isoformat(), "upserts": 0, "deletes": 0}
+    if until <= since:
+        return entry
+    name = f"delta-{_stamp(since)}-{_stamp(until)}.csv"
+    ops = {"upsert": 0, "delete": 0}
+
+    def counted(rows):
+        for row in rows:
+            ops[row[0]] += 1
+            yield row
+
+    path = os.path.join(out_dir, name)
+    _write_csv(path, ["_op"] + FIELDS, counted(changes_between(since, until, batch_size)))
+    entry.update(upserts=ops["upsert"], deletes=ops["delete"])
+    if ops["upsert"] or ops["delete"]:
+        entry["file"] = name
+        manifest["deltas"].append(entry)
+    else:
+        os.remove(path)
+    manifest["watermark"] = until.isoformat()
+    save_manifest(out_dir, manifest)
+    return entry
+
+
+def compact(out_dir=DELTA_DIR, keep=False):
+    """Merge the base and its deltas into a new base file; return the new manifest."""
+    manifest = load_manifest(out_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No {MANIFEST} in {out_dir}")
+    if not manifest["deltas"]:
+        return manifest
+    changes = {}  # _id -> latest row, or None when deleted
+    for delta in manifest["deltas"]:
+        with open(os.path.join(out_dir, delta["file"]), newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                changes[row[1]] = row[1:] if row[0] == "upsert" else None
+
+    def merged():
+        with open(os.path.join(out_dir, manifest["base"]), newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if row[0] not in changes:
+                    yield row
+                    continue
+                current = changes.pop(row[0])
+                if current is not None:
+                    yield current
+        yield from (row for row in changes.values() if row is not None)
+
+    old_files = [manifest["base"]] + [d["file"] for d in manifest["deltas"]]
+    name = f"base-{_stamp(datetime.fromisoformat(manifest['watermark']))}.csv"
+    rows = _write_csv(os.path.join(out_dir, name), FIELDS, merged())
+    compacted = {"fields": FIELDS, "base": name, "base_rows": rows, "watermark": manifest["watermark"], "deltas": []}
+    save_manifest(out_dir, compacted)
+    if not keep:
+        _remove(out_dir, old_files, keep=name)
+    return compacted
+
+
+def prune_tombstones(days):
+    """Drop tombstones older than `days`; every delta directory must have exported past them."""
+    cutoff = datetime.now(UTC) - timedelta(days=days)
+    return tombstones_col.delete_many({"deleted_at": {"$lt": cutoff}}).deleted_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental (delta) CSV export of the properties collection")
+    parser.add_argument("--dir", default=DELTA_DIR)
+    parser.add_argument("--lag", type=float, default=DEFAULT_LAG,
+                        help="seconds to stay behind the clock (longest expected write)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--compact", action="store_true", help="merge the deltas into a new base file")
+    group.add_argument("--full", action="store_true", help="write a fresh base and drop the deltas")
+    group.add_argument("--prune-tombstones", type=int, metavar="DAYS", help="delete tombstones older than DAYS")
+    parser.add_argument("--keep", action="store_true", help="with --compact, keep the merged files")
+    args = parser.parse_args()
+
+    if args.prune_tombstones is not None:
+        print(f"Deleted {prune_tombstones(args.prune_tombstones)} tombstones")
+        return
+    if args.compact:
+        try:
+            manifest = compact(args.dir, args.keep)
+        except FileNotFoundError as e:
+            raise SystemExit(str(e))
+        print(f"Base {manifest['base']}: {manifest['base_rows']} rows up to {manifest['watermark']}")
+        return
+    if args.full:
+        manifest = export_base(args.dir, args.lag, args.batch_size)
+        print(f"Wrote base {manifest['base']} ({manifest['base_rows']} rows)")
+        return
+    entry = export_delta(args.dir, args.lag, args.batch_size)
+    if entry.get("base"):
+        print(f"No previous export: wrote base {entry['file']} ({entry['rows']} rows)")
+    elif entry["file"]:
+        print(f"Wrote {entry['file']}: {entry['upserts']} changed, {entry['deletes']} removed")
+    else:
+        print(f"No changes up to {entry['until']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# facets.py
+"""Structured listing search: a page of results plus facet counts in one round trip.
+
+    python facets.py [--text TEXT] [--city Pune] [--title view] [--min-price N] [--max-price N]
+                     [--status sold] [--listed-from 2024-01-01] [--listed-before 2024-07-01]
+                     [--per-page 20] [--token T] [--include-archived]
+
+build_filter() compiles the criteria into index-friendly predicates: city as
+a city_key range, title through the gram index, price and listing date as
+ranges and status as an equality, so the $match runs on city_key_price_id,
+status_price_id, price_id, created_at_id or title_grams. search() then runs
+[$match, $facet] once and gets back the first keyset page (same tokens as
+pagination.py), the total, and counts per city, status and price band. Later
+pages of the same search are plain keyset pages; the facets do not change.
+
+Two cases skip the aggregation. The unfiltered catalog takes its totals,
+city and status counts from city_stats instead of a collection scan (no
+price bands there). Searches the local replica can answer are counted in
+SQLite. estimated_total() gives a count without any scan where one exists:
+collection metadata for no filter, city_stats for city/status filters.
+"""
+import argparse
+import json
+from datetime import date, datetime
+import city_stats
+import local_replica
+from archive import ARCHIVE_COLLECTION
+from cache import cached
+from db import city_stats_col, properties_col
+from pagination import fetch_page, make_page, page_query
+from search import CITY_KEY, GRAMS_FIELD, TITLE_FOLD, city_filter, text_filter, title_filter
+from store import PropertyError, STATUSES, parse_price
+
+PRICE_BANDS = (2000000, 5000000, 10000000)  # band edges, as in analytics.py
+TOP_CITIES = 20
+HIDDEN = {GRAMS_FIELD: 0, TITLE_FOLD: 0}
+
+
+def parse_date(value, label="Date"):
+    """A datetime from a date, datetime or "YYYY-MM-DD" string."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d")
+    except ValueError:
+        raise PropertyError(f"{label} must be a date (YYYY-MM-DD).") from None
+
+
+def build_filter(text=None, city=None, title=None, min_price=None, max_price=None, status=None,
+                 listed_from=None, listed_before=None):
+    """Compile search criteria into one MongoDB filter ({} when none is set).
+
+    `text` matches a city prefix or a title substring, like the GUI filter box;
+    `city` is a city prefix and `title` a title substring (ignored below
+    MIN_TITLE_SEARCH characters). Prices are inclusive,
+    `listed_from` is inclusive and `listed_before` exclusive. Raises PropertyError.
+    """
+    clauses = []
+    if text and text.strip():
+        clauses.append(text_filter(text))
+    if city and city.strip():
+        clauses.append(city_filter(city))
+    if title and title_filter(title):
+        clauses.append(title_filter(title))
+    price = {}
+    if min_price not in (None, ""):
+        price["$gte"] = parse_price(min_price, "Minimum price")
+    if max_price not in (None, ""):
+        price["$lte"] = parse_price(max_price, "Maximum price")
+    if len(price) == 2 and price["$gte"] > price["$lte"]:
+        raise PropertyError("Minimum price is above the maximum price.")
+    if price:
+        clauses.append({"price": price})
+    if status:
+        if status not in STATUSES:
+            raise PropertyError(f"Status must be one of: {', '.join(STATUSES)}.")
+        clauses.append({"status": status})
+    listed = {}
+    if listed_from not in (None, ""):
+        listed["$gte"] = parse_date(listed_from, "Listed from")
+    if listed_before not in (None, ""):
+        listed["$lt"] = parse_date(listed_before, "Listed before")
+    if listed:
+        clauses.append({"created_at": listed})
+    query = {}
+    for clause in clauses:
+        if query.keys() & clause.keys():
+            return {"$and": clauses}
+        query.update(clause)
+    return query
+
+
+def band_labels(edges=PRICE_BANDS):
+    return [f"<{edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(edges[:-1], edges[1:])] + [f">={edges[-1]}"]
+
+
+def search_pipeline(query=None, token=None, per_page=20, projection=HIDDEN, union_with=None,
+                    edges=PRICE_BANDS, top_cities=TOP_CITIES):
+    """Return (pipeline, direction): one $facet with the page, total, and city/status/band counts."""
+    seek, sort, direction = page_query(None, token)
+    page = ([{"$match": seek}] if seek else []) + [{"$sort": dict(sort)}, {"$limit": per_page + 1}]
+    if projection:
+        page.append({"$project": projection})
+    pipeline = [{"$match": query or {}}]
+    if union_with:
+        pipeline.append({"$unionWith": {"coll": union_with, "pipeline": [{"$match": query or {}}]}})
+    band = {"$switch": {"branches": [{"case": {"$lt": ["$price", e]}, "then": i} for i, e in enumerate(edges)],
+                        "default": len(edges)}}
+    pipeline.append({"$facet": {
+        "page": page,
+        "total": [{"$count": "n"}],
+        "cities": [{"$group": {"_id": f"${CITY_KEY}", "city": {"$first": "$city"}, "count": {"$sum": 1}}},
+                   {"$sort": {"count": -1, "_id": 1}}, {"$limit": top_cities}],
+        "statuses": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+        "price_bands": [{"$group": {"_id": band, "count": {"$sum": 1}}}],
+    }})
+    return pipeline, direction
+
+
+def read_facets(result, edges=PRICE_BANDS):
+    """Facet counts from a $facet result (or local_replica.facet_counts()) as plain dicts."""
+    total = result.get("total") or [{"n": 0}]
+    bands = {r["_id"]: r["count"] for r in result.get("price_bands") or []}
+    return {
+        "total": total[0]["n"],
+        "cities": [{"city_key": r["_id"], "city": r.get("city"), "count": r["count"]} for r in result["cities"]],
+        "statuses": {r["_id"]: r["count"] for r in result["statuses"]},
+        "price_bands": [{"band": label, "count": bands.get(i, 0)} for i, label in enumerate(band_labels(edges))],
+    }
+
+
+def read_result(result, per_page, direction, token, edges=PRICE_BANDS):
+    """(Page, facets) from the single document search_pipeline() returns."""
+    facets = result[0] if result else {}
+    page = make_page(facets.get("page", []), per_page, direction, token)
+    return page, read_facets({"cities": [], "statuses": [], **facets}, edges)
+
+
+def stats_facets(rows, top_cities=TOP_CITIES):
+    """Facets of the whole catalog from city_stats rows; price bands are not kept there."""
+    top = sorted(rows, key=lambda r: (-r.get("count", 0), r["_id"]))[:top_cities]
+    total = sum(r.get("count", 0) for r in rows)
+    statuses = {s: sum(r.get(s, 0) for r in rows) for s in STATUSES}
+    other = total - sum(statuses.values())
+    if other:
+        statuses[None] = other
+    return {"total": total, "statuses": statuses, "price_bands": None,
+            "cities": [{"city_key": r["_id"], "city": r.get("city"), "count": r.get("count", 0)} for r in top]}
+
+
+def search(query=None, token=None, per_page=20, projection=HIDDEN, union_with=None, col=properties_col):
+    """The page of `query` at `token` with its facets, in one round trip; return (Page, facets)."""
+    if local_replica.serves(col, query, union_with):
+        page = local_replica.fetch_page(query, token, per_page, projection)
+        return page, read_facets(local_replica.facet_counts(query, PRICE_BANDS, TOP_CITIES))
+    if not query and not union_with:
+        page = fetch_page(col, None, token, per_page, projection)
+        return page, stats_facets(cached("city_stats", {}, city_stats.read_stats))
+    pipeline, direction = search_pipeline(query, token, per_page, projection, union_with)
+    params = {"q": query, "t": token, "n": per_page, "p": projection, "u": union_with}
+    result = cached("facets:" + col.name, params, lambda: list(col.aggregate(pipeline)))
+    return read_result(result, per_page, direction, token)
+
+
+def estimated_total(query=None, col=properties_col):
+    """Count of `query` without scanning listings, or None when no cheap source exists."""
+    if not query:
+        return col.estimated_document_count()
+    if not set(query) <= {CITY_KEY, "status"}:
+        return None
+    status = query.get("status")
+    if status is not None and status not in STATUSES:
+        return None
+    stats_filter = {"_id": query[CITY_KEY]} if CITY_KEY in query else {}
+    rows = city_stats_col.find(stats_filter, {"count": 1, "available": 1, "sold": 1})
+    return sum(r.get(status or "count", 0) for r in rows)
+
+
+def summary_lines(facets):
+    """Human-readable facet lines for the CLI."""
+    lines = [f"{facets['total']} matching listings"]
+    lines.append("By status: " + ", ".join(f"{s or 'other'} {n}" for s, n in facets["statuses"].items()))
+    lines.append("By city: " + ", ".join(f"{c['city'] or c['city_key']} {c['count']}" for c in facets["cities"]))
+    if facets["price_bands"] is not None:
+        lines.append("By price: " + ", ".join(f"{b['band']} {b['count']}" for b in facets["price_bands"]))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search listings by several criteria, with facet counts")
+    parser.add_argument("--text", help="city prefix or title substring")
+    parser.add_argument("--city")
+    parser.add_argument("--title")
+    parser.add_argument("--min-price")
+    parser.add_argument("--max-price")
+    parser.add_argument("--status", choices=STATUSES)
+    parser.add_argument("--listed-from", help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--listed-before", help="YYYY-MM-DD, exclusive")
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--token")
+    parser.add_argument("--include-archived", action="store_true")
+    args = parser.parse_args()
+    try:
+        query = build_filter(args.text, args.city, args.title, args.min_price, args.max_price, args.status,
+                             args.listed_from, args.listed_before)
+    except PropertyError as e:
+        parser.error(str(e))
+    union = ARCHIVE_COLLECTION if args.include_archived else None
+    page, facets = search(query, args.token, args.per_page, union_with=union)
+    for d in page.docs:
+        print(json.dumps(d, default=str))
+    print("\n".join(summary_lines(facets)))
+    if page.next_token:
+        print("Next page token:", page.next_token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# indexes.py
+"""Declared indexes for every collection, and a query-plan check against them.
+
+    python indexes.py              # create any missing indexes (idempotent)
+    python indexes.py --verify     # explain() each canonical query, flag COLLSCAN / in-memory SORT
+    python indexes.py --prune      # also drop indexes that are not declared below
+
+app.py ensures the indexes at startup; the CLI "Create indexes" option and the
+UI "Create Index" button run the same ensure_indexes().
+"""
+import argparse
+from datetime import datetime
+from bson import ObjectId
+from pymongo import IndexModel
+from db import db, owners_col, properties_col, sales_monthly_col, tombstones_col, transactions_col
+from metrics import tagged
+from owners import NAME_SORT, name_filter
+from pagination import SORT_KEYS, seek_filter
+from sales_stats import ALL_CITIES
+from search import CITY_KEY, GRAMS_FIELD, city_filter, city_key, text_filter, title_filter
+
+# collection name -> list of (name, keys)
+INDEXES = {
+    "properties": [
+        # Keyset paging over the whole catalog.
+        ("price_id", [("price", 1), ("_id", 1)]),
+        # City filter sorted by price (and paged); also serves city_stats min/max lookups.
+        ("city_key_price_id", [(CITY_KEY, 1), ("price", 1), ("_id", 1)]),
+        # status="available" (or "sold") filter sorted by price.
+        ("status_price_id", [("status", 1), ("price", 1), ("_id", 1)]),
+        # Multikey n-gram index for partial title search.
+        ("title_grams", [(GRAMS_FIELD, 1)]),
+        # archive.py candidates: sold listings, and stale ones by age.
+        ("status_created_at", [("status", 1), ("created_at", 1)]),
+        # facets.py: listing-date range searches.
+        ("created_at_id", [("created_at", 1), ("_id", 1)]),
+        # export_delta.py: listings changed since the watermark, in a stable order.
+        ("updated_at_id", [("updated_at", 1), ("_id", 1)]),
+        # owners.py: an owner's listings paged by price, and portfolio recounts.
+        ("owner_id_price_id", [("owner_id", 1), ("price", 1), ("_id", 1)]),
+    ],
+    "owners": [
+        ("name_key_id", [("name_key", 1), ("_id", 1)]),
+    ],
+    "tombstones": [
+        ("deleted_at_id", [("deleted_at", 1), ("_id", 1)]),
+    ],
+    "transactions": [
+        ("property_id", [("property_id", 1)]),
+        # Sales in a date range (sales_stats.py backfills and recounts), in a stable order.
+        ("date_property_id", [("date", 1), ("property_id", 1)]),
+    ],
+    # The cold tier serves the same reads when archived listings are requested.
+    "properties_archive": [
+        ("price_id", [("price", 1), ("_id", 1)]),
+        ("city_key_price_id", [(CITY_KEY, 1), ("price", 1), ("_id", 1)]),
+        ("title_grams", [(GRAMS_FIELD, 1)]),
+        # owners.py recounts of archived sales.
+        ("owner_id_status", [("owner_id", 1), ("status", 1)]),
+    ],
+    "transactions_archive": [
+        ("property_id", [("property_id", 1)]),
+        ("date_property_id", [("date", 1), ("property_id", 1)]),
+    ],
+    # Reports read one city over a period range, or every city over it for
+    # the all-cities $group; the city breakdown reads every city for one period.
+    "sales_daily": [
+        ("city_key_period", [(CITY_KEY, 1), ("period", 1)]),
+        ("period_revenue", [("period", 1), ("revenue", -1)]),
+    ],
+    "sales_monthly": [
+        ("city_key_period", [(CITY_KEY, 1), ("period", 1)]),
+        ("period_revenue", [("period", 1), ("revenue", -1)]),
+    ],
+}
+
+# Plan stages that mean the query is not fully served by an index.
+BAD_STAGES = {"COLLSCAN", "SORT"}
+
+
+@tagged("indexes")
+def ensure_indexes(prune=False):
+    """Create declared indexes that are missing; return {collection: [created or dropped names]}."""
+    changes = {}
+    for coll_name, specs in INDEXES.items():
+        col = db[coll_name]
+        existing = col.index_information()
+        have_keys = {tuple(tuple(k) for k in info["key"]) for info in existing.values()}
+        missing = [IndexModel(keys, name=name) for name, keys in specs
+                   if name not in existing and tuple(keys) not in have_keys]
+        done = col.create_indexes(missing) if missing else []
+        if prune:
+            declared = {name for name, _ in specs} | {"_id_"}
+            declared_keys = {tuple(keys) for _, keys in specs}
+            for name, info in existing.items():
+                if name not in declared and tuple(tuple(k) for k in info["key"]) not in declared_keys:
+                    col.drop_index(name)
+                    done.append(f"dropped {name}")
+        changes[coll_name] = done
+    return changes
+
+
+# The queries app.py, ui.py, store.py and city_stats.py actually run:
+# (label, collection, filter, sort, limit, stages allowed despite BAD_STAGES)
+CANONICAL_QUERIES = [
+    ("list first page", properties_col, {}, list(SORT_KEYS), 5, set()),
+    ("list next page", properties_col, seek_filter(4500000, ObjectId("0" * 24), "next"), list(SORT_KEYS), 5, set()),
+    ("find by city (prefix)", properties_col, city_filter("mum"), None, 0, set()),
+    ("city page sorted by price", properties_col, city_filter("mumbai", exact=True), list(SORT_KEYS), 200, set()),
+    ("city_stats min price", properties_col, city_filter("mumbai", exact=True), [("price", 1)], 1, set()),
+    ("available sorted by price", properties_col, {"status": "available"}, list(SORT_KEYS), 200, set()),
+    # Title matches come from the gram index; ordering that bounded candidate set is a top-k sort.
+    ("find by title", properties_col, title_filter("resid"), [("price", 1)], 50, {"SORT"}),
+    ("UI filter (city or title)", properties_col,
+     text_filter("mum"), list(SORT_KEYS), 200, {"SORT"}),
+    ("sales for a property", transactions_col, {"property_id": ObjectId("0" * 24)}, None, 0, set()),
+    ("sales in a date range", transactions_col,
+     {"date": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)}}, [("date", 1), ("property_id", 1)], 0, set()),
+    ("monthly sales report", sales_monthly_col,
+     {CITY_KEY: city_key("Pune"), "period": {"$gte": "2015-01"}}, [("period", -1)], 12, set()),
+    ("monthly sales report, all cities", sales_monthly_col,
+     {CITY_KEY: {"$ne": ALL_CITIES}, "period": {"$gte": "2015-01"}}, None, 0, set()),
+    ("city sales for a month", sales_monthly_col,
+     {"period": "2024-05", CITY_KEY: {"$ne": ALL_CITIES}}, [("revenue", -1)], 0, set()),
+    ("changed since watermark", properties_col,
+     {"updated_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 2)}}, [("updated_at", 1), ("_id", 1)], 0,
+     set()),
+    ("deleted since watermark", tombstones_col,
+     {"deleted_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 2)}}, [("deleted_at", 1), ("_id", 1)], 0,
+     set()),
+    # facets.py $match stages; the page is a top-k sort inside $facet.
+    ("search: city and price range", properties_col,
+     {**city_filter("mum"), "price": {"$gte": 1000000, "$lte": 5000000}}, None, 0, set()),
+    ("search: status and price range", properties_col,
+     {"status": "available", "price": {"$gte": 1000000, "$lte": 5000000}}, None, 0, set()),
+    ("search: listing date range", properties_col,
+     {"created_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 7, 1)}}, None, 0, set()),
+    ("owner listings page", properties_col, {"owner_id": ObjectId("0" * 24)}, list(SORT_KEYS), 20, set()),
+    ("owners by name prefix", owners_col, name_filter("sha"), NAME_SORT, 50, set()),
+    ("archive candidates", properties_col, {"status": "available", "created_at": {"$lt": datetime(2020, 1, 1)}},
+     None, 500, set()),
+]
+
+
+def plan_stages(plan):
+    """Collect every `stage` name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for v in plan.values():
+            stages.extend(plan_stages(v))
+    elif isinstance(plan, list):
+        for v in plan:
+            stages.extend(plan_stages(v))
+    return stages
+
+
+def verify():
+    """Explain each canonical query; return [(label, stages, problems)]."""
+    results = []
+    for label, col, q, sort, limit, allowed in CANONICAL_QUERIES:
+        cursor = col.find(q)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        winning = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = plan_stages(winning)
+        problems = sorted((set(stages) & BAD_STAGES) - allowed)
+        results.append((label, stages, problems))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ensure declared indexes and verify query plans")
+    parser.add_argument("--verify", action="store_true", help="explain canonical queries after ensuring indexes")
+    parser.add_argument("--prune", action="store_true", help="drop indexes that are not declared")
+    args = parser.parse_args()
+
+    for coll_name, done in ensure_indexes(prune=args.prune).items():
+        print(f"{coll_name}: {', '.join(done) if done else 'up to date'}")
+    if not args.verify:
+        return
+    failed = 0
+    for label, stages, problems in verify():
+        flag = "OK  " if not problems else "FAIL"
+        failed += bool(problems)
+        print(f"{flag} {label}: {' <- '.join(stages)}" + (f"  [{', '.join(problems)}]" if problems else ""))
+    if failed:
+        raise SystemExit(f"{failed} canonical queries are not fully index-backed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# local_replica.py
+"""Optional on-disk SQLite copy of the catalog for the GUI and CLI read paths.
+
+    python local_replica.py --sync      # first run copies everything, later runs the changes
+    python local_replica.py --rebuild   # drop the copy and load it again
+    python local_replica.py --status
+
+Set LOCAL_REPLICA to a file path (e.g. catalog.sqlite) to turn it on. Each
+listing is stored as its BSON document (without `title_grams`) next to the
+columns the listing and search filters use, indexed on (price, _id) and
+(city_key, price, _id) with the other filter columns alongside. Once the file
+has been synced, cache.cached_page(), the CLI searches and facets.search()
+read from it: listing pages, city prefix, title substring, price and status
+filters (with the same continuation tokens) and their facet counts are
+answered locally, so the first page of the GUI and every filter keystroke
+cost no network round trip, and browsing keeps working while MongoDB is
+unreachable. Writes still go to MongoDB through store.py. Queries the copy
+cannot express (other fields, the archive union) go to MongoDB as before.
+
+sync() works like analytics.Snapshot.refresh(): it reads listings stamped
+with a newer `updated_at`, tombstones of removed ones, and unstamped
+listings above the largest known `_id`, then applies them in one SQLite
+transaction together with the new watermark. start_sync() runs it every
+LOCAL_REPLICA_SYNC_SECONDS (5) on a background thread; store.py wakes that
+thread after each of its own writes.
+
+A process reads from the copy only while it keeps it current itself (its
+sync thread is running, or it has just run sync()) and only while the last
+successful sync is at most LOCAL_REPLICA_MAX_STALE_SECONDS (300) old; after
+that, e.g. with MongoDB unreachable, reads go back to MongoDB. 0 removes the
+limit, for browsing offline.
+"""
+import argparse
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+import bson
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from db import properties_col, tombstones_col
+from pagination import make_page, page_query
+from raw_reads import iter_docs
+from search import CITY_KEY, GRAMS_FIELD, TITLE_FOLD, fold
+
+REPLICA_PATH = os.getenv("LOCAL_REPLICA", "")
+SYNC_SECONDS = float(os.getenv("LOCAL_REPLICA_SYNC_SECONDS", "5"))
+MAX_STALE = float(os.getenv("LOCAL_REPLICA_MAX_STALE_SECONDS", "300"))  # 0: serve however old
+SYNC_LAG = 30.0  # seconds; writes stamped this recently are read again on the next sync
+PROJECTION = {GRAMS_FIELD: 0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS properties (
+    id TEXT PRIMARY KEY,
+    price INTEGER,
+    city TEXT,
+    city_key TEXT,
+    title TEXT,
+    title_fold TEXT,
+    status TEXT,
+    doc BLOB NOT NULL
+);
+-- Every filter and facet column rides along in both indexes, so filtered pages read the table only for
+-- matching rows and facet counts never read it.
+DROP INDEX IF EXISTS price_id_filters;
+DROP INDEX IF EXISTS city_key_price_id;
+CREATE INDEX IF NOT EXISTS price_id_covering ON properties (price, id, title_fold, city_key, status);
+CREATE INDEX IF NOT EXISTS city_key_price_id_covering ON properties (city_key, price, id, status, title_fold);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+# Filter fields the copy can answer, and their columns.
+COLUMNS = {"_id": "id", "price": "price", "city": "city", CITY_KEY: "city_key", "title": "title",
+           TITLE_FOLD: "title_fold", "status": "status"}
+OPERATORS = {"$eq": "=", "$ne": "IS NOT", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+class Unsupported(ValueError):
+    """The query uses something the local copy does not store."""
+
+
+_local = threading.local()
+_sync_lock = threading.Lock()
+_wake = threading.Event()
+_synced_at = None  # time.time() the copy at REPLICA_PATH was last known current
+_started = False
+_start_lock = threading.Lock()
+last_sync = {"at": None, "upserted": 0, "removed": 0, "seconds": 0.0, "error": None}
+
+
+@functools.lru_cache(maxsize=256)
+def _pattern(pattern, options):
+    return re.compile(pattern, re.IGNORECASE if "i" in (options or "") else 0)
+
+
+def _regexp(pattern, options, value):
+    return value is not None and _pattern(pattern, options).search(value) is not None
+
+
+def connection(path=None):
+    """This thread's connection to the replica file, created with the schema on first use."""
+    path = path or REPLICA_PATH
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.create_function("regexp", 3, _regexp, deterministic=True)
+    return conn
+
+
+def enabled():
+    return bool(REPLICA_PATH)
+
+
+def watermark(conn=None):
+    row = (conn or connection()).execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+def ready():
+    """True when this process keeps the replica current and its last sync is recent enough to serve."""
+    global _synced_at
+    if not enabled():
+        return False
+    if _synced_at is None:
+        # A copy synced by an earlier run is served once this process's sync thread is running.
+        if not _started:
+            return False
+        mark = watermark()
+        if mark is None:
+            return False
+        _synced_at = mark.timestamp() + SYNC_LAG
+    return not MAX_STALE or time.time() - _synced_at <= MAX_STALE
+
+
+# --- sync ----------------------------------------------------------------------
+
+def _row(doc):
+    return (str(doc["_id"]), doc.get("price"), doc.get("city"), doc.get(CITY_KEY),
+            doc.get("title"), fold(doc.get("title") or ""), doc.get("status"), bson.encode(doc))
+
+
+def _newest_id(conn):
+    row = conn.execute("SELECT max(id) FROM properties").fetchone()
+    try:
+        return ObjectId(row[0]) if row and row[0] else None
+    except InvalidId:
+        return None
+
+
+def sync(full=False, path=None):
+    """Bring the replica up to date (a full copy the first time or with `full`); return (upserted, removed)."""
+    global _synced_at
+    with _sync_lock:
+        start = time.perf_counter()
+        conn = connection(path)
+        since = None if full else watermark(conn)
+        until = datetime.now(UTC) - timedelta(seconds=SYNC_LAG)
+        if since is None:
+            # Streamed straight into the open SQLite transaction; readers keep the old copy until commit.
+            changed, removed = iter_docs(properties_col, {}, PROJECTION), []
+        else:
+            changed = list(iter_docs(properties_col, {"updated_at": {"$gte": since}}, PROJECTION))
+            newest = _newest_id(conn)
+            if newest is not None:
+                seen = {d["_id"] for d in changed}
+                changed += [d for d in iter_docs(properties_col, {"_id": {"$gt": newest},
+                                                                  "updated_at": {"$exists": False}}, PROJECTION)
+                            if d["_id"] not in seen]
+            removed = [(str(t["_id"]),) for t in tombstones_col.find({"deleted_at": {"$gte": since}}, {"_id": 1})]
+        with conn:
+            if since is None:
+                conn.execute("DELETE FROM properties")
+            upserted = conn.executemany(
+                "INSERT OR REPLACE INTO properties (id, price, city, city_key, title, title_fold, status, doc) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", map(_row, changed)).rowcount
+            conn.executemany("DELETE FROM properties WHERE id = ?", removed)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (until.isoformat(),))
+        last_sync.update(at=time.time(), upserted=upserted, removed=len(removed),
+                         seconds=time.perf_counter() - start, error=None)
+        if (path or REPLICA_PATH) == REPLICA_PATH:
+            _synced_at = until.timestamp() + SYNC_LAG
+        return upserted, len(removed)
+
+
+def _sync_loop(interval):
+    while True:
+        try:
+            sync()
+        except (PyMongoError, sqlite3.Error) as e:
+            last_sync["error"] = f"{type(e).__name__}: {e}"  # offline: keep serving the last copy
+        _wake.wait(interval)
+        _wake.clear()
+
+
+def start_sync(interval=SYNC_SECONDS):
+    """Start the background sync thread once per process (no-op when LOCAL_REPLICA is unset)."""
+    global _started
+    if not enabled():
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_sync_loop, args=(interval,), name="local-replica-sync", daemon=True).start()
+
+
+def sync_soon():
+    """Ask the sync thread, if running, to sync now rather than at its next interval."""
+    _wake.set()
+
+
+# --- reads ---------------------------------------------------------------------
+
+def _value(value):
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def _where(query):
+    """SQL condition and parameters equivalent to the MongoDB filter `query`; raises Unsupported."""
+    parts, params = [], []
+    for field, cond in query.items():
+        if field in ("$and", "$or"):
+            subs = [_where(q) for q in cond]
+            if not subs:
+                raise Unsupported(f"empty {field}")
+            parts.append("(" + f" {field[1:].upper()} ".join(f"({s})" for s, _ in subs) + ")")
+            for _, p in subs:
+                params += p
+        elif field == GRAMS_FIELD:
+            if isinstance(cond, str):
+                grams = [cond]
+            elif isinstance(cond, dict) and list(cond) == ["$all"]:
+                grams = cond["$all"]
+            else:
+                raise Unsupported(f"{field}: {cond!r}")
+            parts += ["instr(title_fold, ?) > 0"] * len(grams)
+            params += grams
+        elif field in COLUMNS:
+            column = COLUMNS[field]
+            if not isinstance(cond, dict) or not any(k.startswith("$") for k in cond):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                if op == "$options":
+                    continue
+                if op == "$regex":
+                    parts.append(f"regexp(?, ?, {column})")
+                    params += [value, cond.get("$options", "")]
+                elif op == "$in":
+                    parts.append(f"{column} IN ({', '.join('?' * len(value))})" if value else "0")
+                    params += [_value(v) for v in value]
+                elif op in ("$eq", "$ne") and value is None:
+                    parts.append(f"{column} IS {'NOT ' if op == '$ne' else ''}NULL")
+                elif op in OPERATORS:
+                    parts.append(f"{column} {OPERATORS[op]} ?")
+                    params.append(_value(value))
+                else:
+                    raise Unsupported(f"{field}: {op}")
+        else:
+            raise Unsupported(field)
+    return " AND ".join(parts) or "1", params
+
+
+def _order(sort):
+    if not sort:
+        return " ORDER BY price, id"
+    try:
+        return " ORDER BY " + ", ".join(f"{COLUMNS[f]} {'DESC' if d == -1 else 'ASC'}" for f, d in sort)
+    except KeyError as e:
+        raise Unsupported(f"sort on {e}") from e
+
+
+def _project(doc, projection):
+    if not projection:
+        return doc
+    others = [f for f in projection if f != "_id"]
+    if projection[others[0]] if others else projection["_id"]:
+        keep = set(others) | ({"_id"} if projection.get("_id", 1) else set())
+        return {k: v for k, v in doc.items() if k in keep}
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def serves(col, query=None, union_with=None, sort=None):
+    """True when a read of `query` on `col` can be answered from the replica."""
+    if col is not properties_col or union_with or not ready():
+        return False
+    try:
+        _where(query or {})
+        _order(sort)
+    except Unsupported:
+        return False
+    return True
+
+
+def find_docs(query=None, projection=None, sort=None, limit=0):
+    """pagination.find_docs() on the local copy of `properties`."""
+    where, params = _where(query or {})
+    sql = f"SELECT doc FROM properties WHERE {where}{_order(sort)}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return [_project(bson.decode(row[0]), projection) for row in connection().execute(sql, params)]
+
+
+def fetch_page(query=None, token=None, per_page=5, projection=None):
+    """pagination.fetch_page() on the local copy; tokens are interchangeable with MongoDB pages."""
+    query, sort, direction = page_query(query, token)
+    docs = find_docs(query, projection, sort, per_page + 1)
+    return make_page(docs, per_page, direction, token)
+
+
+def facet_counts(query=None, edges=(), top_cities=20):
+    """The $facet counts of facets.search_pipeline() (total, cities, statuses, price bands) for `query`."""
+    where, params = _where(query or {})
+    conn = connection()
+    band = "CASE " + " ".join(f"WHEN price IS NULL OR price < {int(e)} THEN {i}" for i, e in enumerate(edges)) + \
+        f" ELSE {len(edges)} END" if edges else "0"
+    cities = conn.execute(f"SELECT city_key, count(*) FROM properties WHERE {where} GROUP BY city_key "
+                          f"ORDER BY count(*) DESC, city_key LIMIT {int(top_cities)}", params).fetchall()
+    # Names are looked up per key afterwards, so the counts above only read the indexes.
+    names = {k: conn.execute("SELECT city FROM properties WHERE city_key IS ? LIMIT 1", (k,)).fetchone()[0]
+             for k, _ in cities}
+    statuses = conn.execute(f"SELECT status, count(*) FROM properties WHERE {where} GROUP BY status", params).fetchall()
+    bands = conn.execute(f"SELECT {band}, count(*) FROM properties WHERE {where} GROUP BY 1", params)
+    return {"total": [{"n": sum(n for _, n in statuses)}],
+            "cities": [{"_id": k, "city": names[k], "count": n} for k, n in cities],
+            "statuses": [{"_id": st, "count": n} for st, n in statuses],
+            "price_bands": [{"_id": b, "count": n} for b, n in bands]}
+
+
+def status(path=None):
+    conn = connection(path)
+    count = conn.execute("SELECT count(*) FROM properties").fetchone()[0]
+    mark = watermark(conn)
+    path = path or REPLICA_PATH
+    return {"path": path, "listings": count, "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+            "watermark": mark.isoformat() if mark else None, **{f"last_sync_{k}": v for k, v in last_sync.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the local SQLite copy of the catalog")
+    parser.add_argument("--path", default=REPLICA_PATH or "catalog.sqlite",
+                        help="replica file (default: $LOCAL_REPLICA or catalog.sqlite)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--sync", action="store_true")
+    group.add_argument("--rebuild", action="store_true")
+    group.add_argument("--status", action="store_true")
+    args = parser.parse_args()
+    if args.status:
+        for k, v in status(args.path).items():
+            print(f"{k}: {v}")
+        return
+    upserted, removed = sync(full=args.rebuild, path=args.path)
+    print(f"{args.path}: {upserted} listings copied, {removed} removed in {last_sync['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
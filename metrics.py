@@ -0,0 +1,373 @@
+# metrics.py
+"""Per-command MongoDB metrics from pymongo's command monitoring.
+
+Every command sent by this process is recorded by a CommandListener under the
+operation that issued it (list, search, export, purchase, ...), set with
+`with operation("list"):` or the @tagged decorator; untagged calls count as
+"other". For each (operation, command) pair it keeps a latency histogram, the
+number of documents returned, bytes sent and received, and failures.
+
+Commands slower than METRICS_SLOW_MS (100) are written as JSON lines to
+METRICS_SLOW_LOG (slow_ops.log) with their filter and, for reads and writes
+that support it, a summary of the query plan. The explain runs on a
+background thread, so the slow call itself is not delayed further.
+
+    summary_lines()       # table shown by CLI option 12 and the GUI "Metrics" window
+    prometheus_text()     # Prometheus exposition format
+    write_prometheus()    # ... to METRICS_PROM_FILE (metrics.prom), e.g. for a textfile collector
+    serve(port)           # ... over HTTP at /metrics (serve_from_env(): if METRICS_PORT is set)
+
+METRICS_DISABLED=1 skips registering the listener; METRICS_SIZES=0 skips the
+BSON size accounting, which re-encodes each command and reply.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bson
+from pymongo import monitoring
+
+# Upper bounds of the latency buckets, in milliseconds.
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+SLOW_MS = float(os.getenv("METRICS_SLOW_MS", "100"))
+SLOW_LOG = os.getenv("METRICS_SLOW_LOG", "slow_ops.log")
+PROM_FILE = os.getenv("METRICS_PROM_FILE", "metrics.prom")
+SIZES = os.getenv("METRICS_SIZES", "1") not in ("0", "false", "no")
+
+# Commands whose plan explain() can describe, and where their filter lives.
+EXPLAINABLE = {"find": "filter", "aggregate": "pipeline", "count": "query", "distinct": "query",
+               "findAndModify": "query", "update": "updates", "delete": "deletes"}
+# Session and transaction fields that cannot be sent with an explain.
+_NOT_EXPLAINED = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+# Operations never reported as slow: the explains themselves, and the change
+# stream, whose getMore waits on the server by design.
+NOT_SLOW = {"explain", "cache"}
+
+_operation = contextvars.ContextVar("mongo_operation", default="other")
+
+
+@contextmanager
+def operation(name):
+    """Attribute the MongoDB commands issued inside the block to `name`."""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def tagged(name):
+    """Decorator form of operation()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with operation(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def current_operation():
+    return _operation.get()
+
+
+class _Series:
+    __slots__ = ("buckets", "count", "seconds", "max_ms", "docs", "bytes_out", "bytes_in", "failures")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.seconds = 0.0
+        self.max_ms = 0.0
+        self.docs = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.failures = 0
+
+    def observe(self, ms):
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.seconds += ms / 1000
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        """Estimate the q-quantile in ms by interpolating within its bucket (never above the max seen)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lo = BUCKETS_MS[i - 1] if i else 0.0
+                hi = BUCKETS_MS[i] if BUCKETS_MS[i] != float("inf") else max(lo * 2, lo + 1)
+                return min(self.max_ms, lo + (hi - lo) * (rank - seen) / n)
+            seen += n
+        return self.max_ms
+
+
+def _docs_returned(name, reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return 0
+
+
+def _size(doc):
+    try:
+        return len(bson.encode(doc))
+    except Exception:
+        return 0
+
+
+def _filter_of(name, command):
+    value = command.get(EXPLAINABLE.get(name, ""))
+    if name in ("update", "delete") and isinstance(value, list) and value:
+        value = value[0].get("q")
+    return value
+
+
+def plan_summary(explain):
+    """One line describing the winning plan: stages from leaf to root, with index names."""
+    planner = explain.get("queryPlanner")
+    if planner is None:  # aggregate: the plan of the first ($cursor) stage
+        for stage in explain.get("stages") or []:
+            planner = (stage.get("$cursor") or {}).get("queryPlanner")
+            if planner:
+                break
+    plan = (planner or {}).get("winningPlan") or {}
+    plan = plan.get("queryPlan", plan)  # slot-based engine nests the classic-looking plan
+    parts = []
+    while isinstance(plan, dict) and plan.get("stage"):
+        parts.append(f"{plan['stage']}({plan['indexName']})" if plan.get("indexName") else plan["stage"])
+        children = plan.get("inputStages") or ([plan["inputStage"]] if plan.get("inputStage") else [])
+        plan = children[0] if children else None
+    return " <- ".join(reversed(parts)) or None
+
+
+class MetricsListener(monitoring.CommandListener):
+    def __init__(self, slow_ms=SLOW_MS, sizes=SIZES):
+        self.slow_ms = slow_ms
+        self.sizes = sizes
+        self.series = {}    # (operation, command) -> _Series
+        self._inflight = {}  # (request_id, connection_id) -> (operation, bytes_out, command, database)
+        self._lock = threading.Lock()
+        self._explains = queue.Queue(maxsize=100)
+        self._explainer = None
+        self.started_at = time.time()
+
+    def _get(self, key):
+        s = self.series.get(key)
+        if s is None:
+            s = self.series[key] = _Series()
+        return s
+
+    def started(self, event):
+        op = current_operation()
+        command = event.command if event.command_name in EXPLAINABLE and op not in NOT_SLOW else None
+        info = (op, _size(event.command) if self.sizes else 0, command, event.database_name)
+        with self._lock:
+            self._inflight[(event.request_id, event.connection_id)] = info
+
+    def succeeded(self, event):
+        ms = event.duration_micros / 1000
+        docs = _docs_returned(event.command_name, event.reply)
+        bytes_in = _size(event.reply) if self.sizes else 0
+        with self._lock:
+            info = self._inflight.pop((event.request_id, event.connection_id), None)
+            if info is None:
+                return
+            op, bytes_out, command, database = info
+            s = self._get((op, event.command_name))
+            s.observe(ms)
+            s.docs += docs
+            s.bytes_out += bytes_out
+            s.bytes_in += bytes_in
+        if ms >= self.slow_ms and op not in NOT_SLOW:
+            self._slow(op, event.command_name, ms, command, database)
+
+    def failed(self, event):
+        with self._lock:
+            info = self._inflight.pop((event.request_id, event.connection_id), None)
+            if info is None:
+                return
+            s = self._get((info[0], event.command_name))
+            s.observe(event.duration_micros / 1000)
+            s.failures += 1
+            s.bytes_out += info[1]
+
+    def _slow(self, op, name, ms, command, database):
+        entry = {"time": datetime.now(UTC).isoformat(), "operation": op, "command": name,
+                 "ms": round(ms, 2), "database": database}
+        if command is not None:
+            entry["collection"] = command.get(name)
+            entry["filter"] = _filter_of(name, command)
+        try:
+            self._explains.put_nowait((entry, command))
+        except queue.Full:
+            _log_slow(entry)  # too many to explain; log without a plan
+            return
+        with self._lock:
+            if self._explainer is None:
+                self._explainer = threading.Thread(target=self._explain_loop, name="slow-op-explain", daemon=True)
+                self._explainer.start()
+
+    def _explain_loop(self):
+        from db import get_client
+        while True:
+            entry, command = self._explains.get()
+            if command is not None:
+                cmd = {k: v for k, v in command.items() if not k.startswith("$") and k not in _NOT_EXPLAINED}
+                try:
+                    with operation("explain"):
+                        explain = get_client()[entry["database"]].command(
+                            {"explain": cmd, "verbosity": "queryPlanner"})
+                    entry["plan"] = plan_summary(explain)
+                except Exception as e:
+                    entry["plan_error"] = str(e)
+            _log_slow(entry)
+
+    def snapshot(self):
+        """{(operation, command): copy of its series}."""
+        with self._lock:
+            out = {}
+            for key, s in self.series.items():
+                c = _Series()
+                for f in _Series.__slots__:
+                    v = getattr(s, f)
+                    setattr(c, f, list(v) if isinstance(v, list) else v)
+                out[key] = c
+            return out
+
+    def reset(self):
+        with self._lock:
+            self.series.clear()
+
+
+_slow_logger = logging.getLogger("slow_ops")
+_slow_logger.propagate = False
+
+
+def _log_slow(entry):
+    if not _slow_logger.handlers:
+        handler = logging.FileHandler(SLOW_LOG, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _slow_logger.addHandler(handler)
+        _slow_logger.setLevel(logging.INFO)
+    _slow_logger.info(json.dumps(entry, default=str))
+
+
+listener = MetricsListener()
+if os.getenv("METRICS_DISABLED", "") not in ("1", "true", "yes"):
+    # Applies to clients created afterwards; db.py creates its client on first use.
+    monitoring.register(listener)
+
+
+def totals(snapshot=None):
+    """Aggregate over every operation: (commands, p95 ms) for the status bar."""
+    snapshot = snapshot if snapshot is not None else listener.snapshot()
+    merged = _Series()
+    for s in snapshot.values():
+        merged.count += s.count
+        merged.max_ms = max(merged.max_ms, s.max_ms)
+        merged.buckets = [a + b for a, b in zip(merged.buckets, s.buckets)]
+    return merged.count, merged.quantile(0.95)
+
+
+def summary_lines():
+    snapshot = listener.snapshot()
+    lines = [f"{'operation':<10} {'command':<14} {'calls':>7} {'avg ms':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+             f"{'docs':>8} {'KB out':>8} {'KB in':>9} {'fail':>5}"]
+    for (op, name), s in sorted(snapshot.items()):
+        lines.append(f"{op:<10} {name:<14} {s.count:>7} {s.seconds * 1000 / s.count:>8.2f} "
+                     f"{s.quantile(0.5):>8.2f} {s.quantile(0.95):>8.2f} {s.quantile(0.99):>8.2f} "
+                     f"{s.docs:>8} {s.bytes_out / 1024:>8.1f} {s.bytes_in / 1024:>9.1f} {s.failures:>5}")
+    if len(lines) == 1:
+        lines.append("(no commands recorded yet)")
+    lines.append(f"slow threshold {listener.slow_ms:g} ms; slow operations are logged to {SLOW_LOG}")
+    return lines
+
+
+def _labels(op, name, **extra):
+    pairs = {"operation": op, "command": name, **extra}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+
+def prometheus_text():
+    snapshot = listener.snapshot()
+    out = [
+        "# HELP mongo_command_duration_seconds MongoDB command latency by calling operation.",
+        "# TYPE mongo_command_duration_seconds histogram",
+    ]
+    for (op, name), s in sorted(snapshot.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, s.buckets):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else f"{bound / 1000:g}"
+            out.append(f"mongo_command_duration_seconds_bucket{_labels(op, name, le=le)} {cumulative}")
+        out.append(f"mongo_command_duration_seconds_sum{_labels(op, name)} {s.seconds:.6f}")
+        out.append(f"mongo_command_duration_seconds_count{_labels(op, name)} {s.count}")
+    for metric, attr, help_text in (
+            ("mongo_command_documents_returned_total", "docs", "Documents returned to the client."),
+            ("mongo_command_bytes_sent_total", "bytes_out", "BSON bytes of commands sent."),
+            ("mongo_command_bytes_received_total", "bytes_in", "BSON bytes of replies received."),
+            ("mongo_command_failures_total", "failures", "Commands that returned an error.")):
+        out.append(f"# HELP {metric} {help_text}")
+        out.append(f"# TYPE {metric} counter")
+        for (op, name), s in sorted(snapshot.items()):
+            out.append(f"{metric}{_labels(op, name)} {getattr(s, attr)}")
+    return "\n".join(out) + "\n"
+
+
+def write_prometheus(path=PROM_FILE):
+    """Write prometheus_text() atomically to `path`; return the path."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics on a background thread; return the server."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+_server = None
+
+
+def serve_from_env():
+    """Start serve() once if METRICS_PORT is set (called by app.py and ui.py at startup)."""
+    global _server
+    if _server is None and os.getenv("METRICS_PORT"):
+        _server = serve(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+    return _server
@@ -0,0 +1,77 @@
+# migrate.py
+"""Backfill derived fields on property documents written before the field existed.
+
+    python migrate.py [--batch-size N]
+
+Each migration walks only the documents missing its field, in `_id` order and
+in batches of bulk updates, so it is safe to re-run or interrupt.
+"""
+import argparse
+from datetime import datetime, UTC
+from pymongo import UpdateOne
+import city_stats
+import owners
+from db import properties_archive_col, properties_col
+from search import CITY_KEY, GRAMS_FIELD, TITLE_FOLD, city_key, fold, title_grams
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _backfill(col, field, projection, compute, batch_size):
+    """Set `field` to compute(doc) on every document that lacks it; return the count."""
+    updated = 0
+    last_id = None
+    while True:
+        q = {field: {"$exists": False}}
+        if last_id is not None:
+            q["_id"] = {"$gt": last_id}
+        docs = list(col.find(q, projection).sort("_id", 1).limit(batch_size))
+        if not docs:
+            return updated
+        ops = [UpdateOne({"_id": d["_id"]}, {"$set": {field: compute(d)}}) for d in docs]
+        col.bulk_write(ops, ordered=False)
+        updated += len(ops)
+        last_id = docs[-1]["_id"]
+
+
+def backfill_title_grams(col=properties_col, batch_size=DEFAULT_BATCH_SIZE):
+    return _backfill(col, GRAMS_FIELD, {"title": 1}, lambda d: title_grams(d.get("title")), batch_size)
+
+
+def backfill_title_fold(col=properties_col, batch_size=DEFAULT_BATCH_SIZE):
+    return _backfill(col, TITLE_FOLD, {"title": 1}, lambda d: fold(d.get("title") or ""), batch_size)
+
+
+def backfill_city_key(col=properties_col, batch_size=DEFAULT_BATCH_SIZE):
+    return _backfill(col, CITY_KEY, {"city": 1}, lambda d: city_key(d.get("city")), batch_size)
+
+
+def backfill_updated_at(col=properties_col, batch_size=DEFAULT_BATCH_SIZE):
+    # The last change is unknown; the creation time keeps old listings out of the next delta export.
+    return _backfill(col, "updated_at", {"created_at": 1}, lambda d: d.get("created_at") or datetime.now(UTC),
+                     batch_size)
+
+
+MIGRATIONS = [
+    (GRAMS_FIELD, backfill_title_grams),
+    # Title searches longer than a trigram check title_fold, also in the archive union.
+    (TITLE_FOLD, backfill_title_fold),
+    (f"archive {TITLE_FOLD}", lambda batch_size: backfill_title_fold(properties_archive_col, batch_size)),
+    (CITY_KEY, backfill_city_key),
+    ("updated_at", backfill_updated_at),
+    # city_stats is keyed by city_key, so recount it once the keys are in place.
+    ("city_stats", lambda batch_size: city_stats.rebuild()),
+    ("owners", lambda batch_size: owners.rebuild()),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill derived property fields")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    for name, migrate in MIGRATIONS:
+        print(f"{name}: {migrate(batch_size=args.batch_size)} documents updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# owners.py
+"""Property owners and their materialized portfolio summaries.
+
+    python owners.py create NAME [--email E] [--phone P]
+    python owners.py find [NAME_PREFIX]
+    python owners.py show OWNER_ID [--per-page 20] [--token T]
+    python owners.py assign PROPERTY_ID [OWNER_ID]     # no OWNER_ID: unassign
+    python owners.py delete OWNER_ID
+    python owners.py --verify | --rebuild
+
+A listing belongs to at most one owner through its `owner_id` field, indexed
+as (owner_id, price, _id). Each owner document embeds a `portfolio` summary
+(listing count, price sum, available/sold counts) that the write paths in
+store.py adjust with $inc in the same transaction as the listing change, like
+city_stats. An owner's page is then two index seeks and no $lookup: the owner
+by `_id`, with the summary, and a keyset page of listings on owner_id_price_id
+(same tokens as pagination.py), however many listings the owner has.
+
+As with city_stats, the counts describe the hot `properties` collection. Sold
+listings that archive.py moves out are kept in `sold_archived`, so the
+`soldTotal` filled in on read still counts every sale the owner has made.
+
+Bulk price updates (reprice.py) and bulk loads (bulk_insert.py) recount the
+owners they touched; --verify reports drift against a full recount,
+including listings whose owner is gone.
+"""
+import argparse
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, UTC
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from db import owners_col, properties_archive_col, properties_col
+from metrics import tagged
+from pagination import fetch_page
+from search import GRAMS_FIELD, TITLE_FOLD, city_key, prefix_range
+
+FIELDS = ("count", "sum", "available", "sold", "sold_archived")
+EMPTY = {f: 0 for f in FIELDS}
+HIDDEN = {GRAMS_FIELD: 0, TITLE_FOLD: 0}
+MAX_FOUND = 50
+NAME_SORT = [("name_key", 1), ("_id", 1)]
+RECOUNT_CHUNK = 1000  # owners recounted per aggregation
+
+
+class OwnerError(ValueError):
+    """An owner failed validation or cannot be changed; the message is meant for the user."""
+
+
+class OwnerNotFound(Exception):
+    """No owner has the given id."""
+
+
+def name_key(name):
+    """Canonical form of an owner name for prefix search (same folding as city names)."""
+    return city_key(name)
+
+
+def parse_owner_id(value):
+    try:
+        return ObjectId(str(value).strip()) if not isinstance(value, ObjectId) else value
+    except (InvalidId, TypeError):
+        raise OwnerError("Invalid owner id.") from None
+
+
+def _contact(name, email, phone):
+    name = (name or "").strip()
+    if not name:
+        raise OwnerError("Owner name is required.")
+    email = (email or "").strip() or None
+    if email and not re.fullmatch(r"[^@\s]+@[^@\s]+", email):
+        raise OwnerError("Email address is not valid.")
+    return {"name": name, "name_key": name_key(name), "email": email, "phone": (phone or "").strip() or None}
+
+
+def build_owner(name, email=None, phone=None):
+    """Validate the fields of a new owner and return the document to insert."""
+    now = datetime.now(UTC)
+    return {**_contact(name, email, phone), "created_at": now, "updated_at": now, "portfolio": dict(EMPTY)}
+
+
+def create_owner(name, email=None, phone=None):
+    return owners_col.insert_one(build_owner(name, email, phone)).inserted_id
+
+
+def missing(owner_ids):
+    """The ids among `owner_ids` that name no owner, in one $in query."""
+    ids = set(owner_ids)
+    if not ids:
+        return set()
+    return ids - {o["_id"] for o in owners_col.find({"_id": {"$in": list(ids)}}, {"_id": 1})}
+
+
+def update_owner(owner_id, name, email=None, phone=None):
+    """Replace an owner's contact fields; the portfolio is left alone. Raises OwnerNotFound."""
+    fields = dict(_contact(name, email, phone), updated_at=datetime.now(UTC))
+    if not owners_col.update_one({"_id": owner_id}, {"$set": fields}).matched_count:
+        raise OwnerNotFound("Owner not found")
+
+
+def delete_owner(owner_id):
+    """Delete an owner without listings; raises OwnerError while any listing still points at it.
+
+    The check reads the embedded count rather than the listings. An insert or
+    assignment racing the delete fails with OwnerNotFound inside its transaction.
+    """
+    if owners_col.delete_one({"_id": owner_id, "portfolio.count": {"$lte": 0}}).deleted_count:
+        return
+    owner = owners_col.find_one({"_id": owner_id}, {"portfolio": 1})
+    if owner is None:
+        raise OwnerNotFound("Owner not found")
+    raise OwnerError(f"Owner still has {owner['portfolio'].get('count', 0)} listings; reassign or delete them first.")
+
+
+def summary(owner):
+    """The owner document with the average listing price and the sales including archived ones filled in."""
+    p = owner.setdefault("portfolio", dict(EMPTY))
+    p["avgPrice"] = p["sum"] / p["count"] if p.get("count") else None
+    p["soldTotal"] = p.get("sold", 0) + p.get("sold_archived", 0)
+    return owner
+
+
+def get_owner(owner_id):
+    """One owner with its portfolio summary (a single _id seek); raises OwnerNotFound."""
+    owner = owners_col.find_one({"_id": owner_id})
+    if owner is None:
+        raise OwnerNotFound("Owner not found")
+    return summary(owner)
+
+
+def name_filter(prefix):
+    """Filter on names starting with `prefix` (case- and accent-insensitive), a range on name_key_id."""
+    key = name_key(prefix or "")
+    return {"name_key": prefix_range(key)} if key else {}
+
+
+def find_owners(prefix="", limit=MAX_FOUND):
+    return [summary(o) for o in owners_col.find(name_filter(prefix)).sort(NAME_SORT).limit(limit)]
+
+
+def listings(owner_id, token=None, per_page=20, projection=HIDDEN):
+    """A keyset page of the owner's listings by price, served by the owner_id_price_id index."""
+    return fetch_page(properties_col, {"owner_id": owner_id}, token, per_page, projection)
+
+
+@tagged("owners")
+def portfolio_page(owner_id, token=None, per_page=20, projection=HIDDEN):
+    """(owner with summary, Page of listings): two index seeks, whatever the portfolio size."""
+    return get_owner(owner_id), listings(owner_id, token, per_page, projection)
+
+
+# --- incremental maintenance, called by store.py inside its transactions -----------
+
+def _status_inc(status, n):
+    return {f"portfolio.{status}": n} if status in ("available", "sold") else {}
+
+
+def _inc(owner_id, inc, session, required=False):
+    res = owners_col.update_one({"_id": owner_id}, {"$inc": inc, "$set": {"updated_at": datetime.now(UTC)}},
+                                session=session)
+    if required and not res.matched_count:
+        raise OwnerNotFound("Owner not found")
+
+
+def _listing_inc(doc, n):
+    inc = {"portfolio.count": n, "portfolio.sum": n * (doc.get("price") or 0)}
+    inc.update(_status_inc(doc.get("status"), n))
+    return inc
+
+
+def record_insert(doc, session=None):
+    """Add a new listing to its owner's summary; raises OwnerNotFound, so call it before the insert."""
+    if doc.get("owner_id") is not None:
+        _inc(doc["owner_id"], _listing_inc(doc, 1), session, required=True)
+
+
+def record_transfer(old_doc, owner_id, session=None):
+    """Move a listing from old_doc's owner (if any) to `owner_id` (None: unassigned)."""
+    if old_doc.get("owner_id") is not None:
+        _inc(old_doc["owner_id"], _listing_inc(old_doc, -1), session)
+    if owner_id is not None:
+        _inc(owner_id, _listing_inc(old_doc, 1), session, required=True)
+
+
+def record_price_change(old_doc, new_price, session=None):
+    if old_doc.get("owner_id") is not None:
+        _inc(old_doc["owner_id"], {"portfolio.sum": new_price - (old_doc.get("price") or 0)}, session)
+
+
+def record_delete(old_doc, session=None):
+    if old_doc.get("owner_id") is not None:
+        _inc(old_doc["owner_id"], _listing_inc(old_doc, -1), session)
+
+
+def record_removals(docs, session=None, archived=False):
+    """Take listings that left `properties` in bulk out of their owners' summaries.
+
+    With `archived`, sold ones move to `sold_archived` instead of dropping out of the sales count.
+    """
+    groups = defaultdict(lambda: defaultdict(int))
+    for d in docs:
+        if d.get("owner_id") is not None:
+            for k, v in _listing_inc(d, -1).items():
+                groups[d["owner_id"]][k] += v
+            if archived and d.get("status") == "sold":
+                groups[d["owner_id"]]["portfolio.sold_archived"] += 1
+    ops = [UpdateOne({"_id": oid}, {"$inc": dict(inc)}) for oid, inc in groups.items()]
+    if ops:
+        owners_col.bulk_write(ops, ordered=False, session=session)
+    return set(groups)
+
+
+def record_sale(doc, session=None):
+    if doc.get("owner_id") is not None:
+        _inc(doc["owner_id"], {"portfolio.available": -1, "portfolio.sold": 1}, session)
+
+
+# --- recount -------------------------------------------------------------------
+
+def _recount_pipeline(owner_ids=None):
+    match = {"owner_id": {"$in": list(owner_ids)}} if owner_ids is not None else {"owner_id": {"$ne": None}}
+    return [{"$match": match}, {"$group": {
+        "_id": "$owner_id",
+        "count": {"$sum": 1},
+        "sum": {"$sum": "$price"},
+        "available": {"$sum": {"$cond": [{"$eq": ["$status", "available"]}, 1, 0]}},
+        "sold": {"$sum": {"$cond": [{"$eq": ["$status", "sold"]}, 1, 0]}},
+    }}]
+
+
+def _archived_sales(owner_ids=None):
+    """Sold listings per owner in the archive, read through its (owner_id, status) index."""
+    match = {"owner_id": {"$in": list(owner_ids)} if owner_ids is not None else {"$ne": None}, "status": "sold"}
+    return {d["_id"]: d["n"] for d in properties_archive_col.aggregate(
+        [{"$match": match}, {"$group": {"_id": "$owner_id", "n": {"$sum": 1}}}])}
+
+
+def _expected(owner_ids=None):
+    fresh = {d["_id"]: dict(d, sold_archived=0) for d in properties_col.aggregate(_recount_pipeline(owner_ids))}
+    for oid, n in _archived_sales(owner_ids).items():
+        fresh.setdefault(oid, dict(EMPTY, _id=oid))["sold_archived"] = n
+    return fresh
+
+
+def rebuild(owner_ids=None):
+    """Recount portfolios from properties and the archive, for every owner or just `owner_ids`.
+
+    Returns the number of owners written.
+    """
+    if owner_ids is None:
+        owner_ids = (o["_id"] for o in owners_col.find({}, {"_id": 1}))
+    written = 0
+    chunk = []
+    for oid in owner_ids:
+        if oid is None:
+            continue
+        chunk.append(oid)
+        if len(chunk) >= RECOUNT_CHUNK:
+            written += _rebuild_chunk(chunk)
+            chunk = []
+    if chunk:
+        written += _rebuild_chunk(chunk)
+    return written
+
+
+def _rebuild_chunk(owner_ids):
+    fresh = _expected(owner_ids)
+    ops = [UpdateOne({"_id": oid}, {"$set": {"portfolio": {f: fresh.get(oid, EMPTY)[f] for f in FIELDS}}})
+           for oid in owner_ids]
+    return owners_col.bulk_write(ops, ordered=False).matched_count
+
+
+def verify():
+    """Compare the embedded summaries with a full recount; return a list of drift descriptions."""
+    expected = _expected()
+    drift = []
+    for owner in owners_col.find({}, {"portfolio": 1}):
+        e = expected.pop(owner["_id"], EMPTY)
+        a = owner.get("portfolio") or {}
+        for f in FIELDS:
+            if e.get(f) != a.get(f):
+                drift.append(f"{owner['_id']}.{f}: expected {e.get(f)}, found {a.get(f)}")
+    for oid, e in expected.items():
+        if e["count"]:
+            drift.append(f"{oid}: {e['count']} listings point at a missing owner")
+    return drift
+
+
+def summary_line(owner):
+    p = owner["portfolio"]
+    avg = f"{p['avgPrice']:.0f}" if p.get("avgPrice") is not None else "-"
+    return (f"{owner['_id']}  {owner['name']}: {p['count']} listings, total {p['sum']}, avg {avg}, "
+            f"{p['soldTotal']} sold ({p.get('sold_archived', 0)} archived)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage owners and their portfolio summaries")
+    parser.add_argument("--verify", action="store_true", help="report summaries that drifted from a recount")
+    parser.add_argument("--rebuild", action="store_true", help="recount every portfolio from properties and the archive")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("create")
+    p.add_argument("name")
+    p.add_argument("--email")
+    p.add_argument("--phone")
+    p = sub.add_parser("find")
+    p.add_argument("prefix", nargs="?", default="")
+    p = sub.add_parser("show")
+    p.add_argument("owner_id")
+    p.add_argument("--per-page", type=int, default=20)
+    p.add_argument("--token")
+    p = sub.add_parser("assign")
+    p.add_argument("property_id")
+    p.add_argument("owner_id", nargs="?")
+    p = sub.add_parser("delete")
+    p.add_argument("owner_id")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"Rebuilt portfolios for {rebuild()} owners")
+        return
+    if args.verify:
+        drift = verify()
+        for line in drift:
+            print(line)
+        print("Owner portfolios are consistent" if not drift
+              else f"{len(drift)} differences; run with --rebuild to fix")
+        return
+    try:
+        if args.command == "create":
+            print("Created owner", create_owner(args.name, args.email, args.phone))
+        elif args.command == "find":
+            for owner in find_owners(args.prefix):
+                print(summary_line(owner))
+        elif args.command == "show":
+            owner, page = portfolio_page(parse_owner_id(args.owner_id), args.token, args.per_page)
+            print(summary_line(owner))
+            for d in page.docs:
+                print(json.dumps(d, default=str))
+            if page.next_token:
+                print("Next page token:", page.next_token)
+        elif args.command == "assign":
+            import store  # store imports this module for its write hooks
+            try:
+                property_id = ObjectId(args.property_id)
+            except InvalidId:
+                raise SystemExit("Invalid property id.")
+            owner_id = parse_owner_id(args.owner_id) if args.owner_id else None
+            try:
+                print("Modified count:", store.assign_owner(property_id, owner_id))
+            except store.PropertyNotFound as e:
+                raise SystemExit(str(e))
+        elif args.command == "delete":
+            delete_owner(parse_owner_id(args.owner_id))
+            print("Deleted")
+        else:
+            parser.error("choose a command, --verify or --rebuild")
+    except (OwnerError, OwnerNotFound) as e:
+        raise SystemExit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# pagination.py
+"""Keyset (seek) pagination over the properties collection.
+
+Pages are ordered by the unique (price, _id) seek key and backed by the
+compound "price_id" index declared in indexes.py. Instead of skip/limit, each page
+hands back opaque continuation tokens that encode where the next or previous
+page starts, so every page costs the same index seek no matter how deep it is.
+"""
+import base64
+import json
+from collections import namedtuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from raw_reads import find_list
+
+SORT_KEYS = [("price", 1), ("_id", 1)]
+
+Page = namedtuple("Page", ["docs", "next_token", "prev_token"])
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def encode_token(doc, direction):
+    """Build an opaque token that seeks past `doc` in `direction` ("next" or "prev")."""
+    _id = doc["_id"]
+    key = {"p": doc.get("price"), "i": str(_id), "o": isinstance(_id, ObjectId), "d": direction}
+    raw = json.dumps(key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token):
+    """Return (price, _id, direction) from a token produced by encode_token()."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        _id = ObjectId(key["i"]) if key["o"] else key["i"]
+        direction = key["d"]
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidToken(f"Invalid continuation token: {e}") from e
+    if direction not in ("next", "prev"):
+        raise InvalidToken("Invalid continuation token direction")
+    return key["p"], _id, direction
+
+
+def seek_filter(price, _id, direction):
+    """Filter selecting documents strictly after (next) or before (prev) the seek key."""
+    op = "$gt" if direction == "next" else "$lt"
+    return {"$or": [{"price": {op: price}}, {"price": price, "_id": {op: _id}}]}
+
+
+def page_query(query=None, token=None):
+    """Return (filter, sort, direction) for the page that `token` points at."""
+    query = query or {}
+    direction = "next"
+    if token:
+        price, _id, direction = decode_token(token)
+        seek = seek_filter(price, _id, direction)
+        query = {"$and": [query, seek]} if query else seek
+    order = 1 if direction == "next" else -1
+    return query, [(field, order) for field, _ in SORT_KEYS], direction
+
+
+def union_pipeline(query, projection, sort, limit, union_with):
+    """Aggregate running `query` on the collection and on `union_with`, merged in `sort` order.
+
+    Each side is filtered, sorted and limited on its own indexes before
+    $unionWith, then the merged rows are re-sorted and limited.
+    """
+    side = [{"$match": query}]
+    if sort:
+        side.append({"$sort": dict(sort)})
+    if limit:
+        side.append({"$limit": limit})
+    if projection:
+        side.append({"$project": projection})
+    pipeline = side + [{"$unionWith": {"coll": union_with, "pipeline": list(side)}}]
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    if limit:
+        pipeline.append({"$limit": limit})
+    return pipeline
+
+
+def find_docs(col, query, projection=None, sort=None, limit=0, union_with=None):
+    """col.find(query) as a list, optionally merged with the same query on collection `union_with`."""
+    if union_with:
+        return list(col.aggregate(union_pipeline(query, projection, sort, limit, union_with)))
+    return find_list(col, query, projection, sort, limit)
+
+
+def fetch_page(col, query=None, token=None, per_page=5, projection=None, union_with=None):
+    """Fetch one page of `col` ordered by (price, _id).
+
+    `query` is an optional extra filter (e.g. a city/title match). Pass the
+    `next_token` or `prev_token` of a previous Page as `token` to move forward
+    or backward; a token of None returns the first page. A `projection` must
+    keep the `price` field, which the tokens are built from. `union_with` names
+    a second collection (the archive) to page through together with `col`.
+    """
+    query, sort, direction = page_query(query, token)
+    # Fetch one extra row to learn whether another page exists in this direction.
+    docs = find_docs(col, query, projection, sort, per_page + 1, union_with)
+    return make_page(docs, per_page, direction, token)
+
+
+async def fetch_page_async(col, query=None, token=None, per_page=5, projection=None, union_with=None):
+    """fetch_page() for a pymongo AsyncCollection."""
+    query, sort, direction = page_query(query, token)
+    if union_with:
+        pipeline = union_pipeline(query, projection, sort, per_page + 1, union_with)
+        docs = await (await col.aggregate(pipeline)).to_list()
+    else:
+        docs = await col.find(query, projection).sort(sort).limit(per_page + 1).to_list()
+    return make_page(docs, per_page, direction, token)
+
+
+def make_page(docs, per_page, direction, token):
+    """Build a Page from up to per_page + 1 documents fetched in `direction` order."""
+    has_more = len(docs) > per_page
+    docs = docs[:per_page]
+    if direction == "prev":
+        docs.reverse()
+    if not docs:
+        return Page([], None, None)
+
+    if direction == "next":
+        has_next, has_prev = has_more, token is not None
+    else:
+        has_next, has_prev = True, has_more
+    next_token = encode_token(docs[-1], "next") if has_next else None
+    prev_token = encode_token(docs[0], "prev") if has_prev else None
+    return Page(docs, next_token, prev_token)
@@ -0,0 +1,130 @@
+# purchase.py
+"""Concurrent purchases on top of store.purchase_property().
+
+purchase_many() runs a batch of purchase requests on a thread pool and reports
+how each one ended: sold, already sold, not found, or failed. Write conflicts
+between buyers of the same property are retried inside store.run_in_transaction(),
+so exactly one buyer wins each property and the rest get AlreadySold.
+
+    python purchase.py --bench [--properties 5] [--buyers 200] [--workers 16]
+
+The contention benchmark lists a few hot properties in the city "Benchtown",
+lets many buyers race for them, checks that each property was sold once with
+exactly one transaction recorded and counted in the sales rollups, prints sales/sec and the retry counts, and
+removes everything it created.
+"""
+import argparse
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import city_stats
+import sales_stats
+import store
+from db import properties_col, transactions_col
+from store import AlreadySold, PropertyNotFound, build_property
+
+PurchaseRequest = namedtuple("PurchaseRequest", "property_id buyer price")
+# outcome is one of "sold", "already sold", "not found", "failed"
+PurchaseResult = namedtuple("PurchaseResult", "request outcome transactional seconds error")
+
+BENCH_CITY = "Benchtown"
+
+
+def purchase_one(request, require_transaction=False):
+    start = time.perf_counter()
+    transactional, outcome, error = None, "sold", None
+    try:
+        transactional = store.purchase_property(request.property_id, request.buyer, request.price,
+                                                require_transaction=require_transaction)
+    except AlreadySold:
+        outcome = "already sold"
+    except PropertyNotFound:
+        outcome = "not found"
+    except Exception as e:
+        outcome, error = "failed", e
+    return PurchaseResult(request, outcome, transactional, time.perf_counter() - start, error)
+
+
+def purchase_many(requests, workers=8, require_transaction=False):
+    """Run purchase requests concurrently; return their PurchaseResults in request order."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda r: purchase_one(r, require_transaction), requests))
+
+
+def contention_benchmark(properties=5, buyers=200, workers=16, require_transaction=False):
+    """Race `buyers` purchases over `properties` hot listings; return a report dict."""
+    docs = [build_property(f"Bench listing {i}", BENCH_CITY, 1000000 + i, "available") for i in range(properties)]
+    ids = [store.insert_property(d) for d in docs]
+    requests = [PurchaseRequest(ids[i % properties], f"buyer-{i}", 1000000) for i in range(buyers)]
+    retries_before = dict(store.retry_counts)
+    try:
+        start = time.perf_counter()
+        results = purchase_many(requests, workers, require_transaction)
+        seconds = time.perf_counter() - start
+
+        outcomes = Counter(r.outcome for r in results)
+        winners = Counter(r.request.property_id for r in results if r.outcome == "sold")
+        problems = []
+        for pid in ids:
+            sales = transactions_col.count_documents({"property_id": pid})
+            status = properties_col.find_one({"_id": pid}, {"status": 1})["status"]
+            if winners[pid] != 1 or sales != 1 or status != "sold":
+                problems.append(f"{pid}: {winners[pid]} winners, {sales} transactions, status {status!r}")
+        rolled_up = sum(r["count"] for r in sales_stats.read_sales("day", BENCH_CITY))
+        if rolled_up != properties:
+            problems.append(f"sales rollups count {rolled_up} sales for {properties} listings")
+        errors = Counter(f"{type(r.error).__name__}: {r.error}" for r in results if r.error)
+        latencies = sorted(r.seconds for r in results)
+        return {
+            "buyers": buyers,
+            "properties": properties,
+            "workers": workers,
+            "seconds": seconds,
+            "sales_per_sec": outcomes["sold"] / seconds if seconds else 0.0,
+            "purchases_per_sec": buyers / seconds if seconds else 0.0,
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "outcomes": dict(outcomes),
+            "transactional": any(r.transactional for r in results),
+            "retries": {k: v - retries_before[k] for k, v in store.retry_counts.items()},
+            "errors": dict(errors),
+            "problems": problems,
+        }
+    finally:
+        transactions_col.delete_many({"property_id": {"$in": ids}})
+        properties_col.delete_many({"_id": {"$in": ids}})
+        city_stats.rebuild([city_stats.key_of(docs[0])])
+        sales_stats.rebuild([city_stats.key_of(docs[0])])
+        store.changed(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent purchase engine")
+    parser.add_argument("--bench", action="store_true", help="run the contention benchmark")
+    parser.add_argument("--properties", type=int, default=5)
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--require-transactions", action="store_true",
+                        help="fail instead of falling back on servers without transactions")
+    args = parser.parse_args()
+    if not args.bench:
+        parser.error("nothing to do; pass --bench")
+
+    report = contention_benchmark(args.properties, args.buyers, args.workers, args.require_transactions)
+    print(f"{report['buyers']} buyers x {report['properties']} properties on {report['workers']} workers "
+          f"({'transactions' if report['transactional'] else 'no transactions'})")
+    print(f"{report['seconds']:.2f}s, {report['sales_per_sec']:.1f} sales/s, "
+          f"{report['purchases_per_sec']:.1f} attempts/s, p50 {report['p50_ms']:.1f} ms, max {report['max_ms']:.1f} ms")
+    print("outcomes:", ", ".join(f"{k}={v}" for k, v in sorted(report["outcomes"].items())))
+    print("retries:", ", ".join(f"{k}={v}" for k, v in report["retries"].items()))
+    for err, n in report["errors"].items():
+        print(f"  {n} x {err}")
+    for line in report["problems"]:
+        print("PROBLEM", line)
+    if report["problems"]:
+        raise SystemExit("Contention check failed")
+    print("OK: exactly one sale and one transaction per property")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# raw_reads.py
+"""Raw-BSON read path for bulk reads, and a benchmark against dict decoding.
+
+    python raw_reads.py --bench [--rows 200000] [--batch-size 1000] [--server]
+
+Bulk readers (CSV and delta exports, the analytics snapshot, listing pages
+and the GUI grid) fetch with find_raw_batches() and only the fields they
+emit. Each server batch arrives as one BSON buffer and is decoded in a
+single bson.decode_all() call, instead of the cursor handing out one
+decoded document at a time; unprojected reads would also decode the
+`title_grams` array of every listing. RawBSONDocument is measured as well,
+but it decodes the whole document on first field access, so it only pays
+off for documents passed on unread.
+
+RAW_READS=0 switches the bulk readers back to plain find() cursors, for
+comparison or for servers/drivers without raw batch support.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from collections import deque
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+RAW_READS = os.getenv("RAW_READS", "1") != "0"
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_batches(col, query=None, projection=None, sort=None, limit=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield lists of decoded documents, one per server batch."""
+    if not RAW_READS:
+        cursor = col.find(query or {}, projection, sort=sort, limit=limit, batch_size=batch_size)
+        try:
+            batch = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            cursor.close()
+        return
+    cursor = col.find_raw_batches(query or {}, projection, sort=sort, limit=limit, batch_size=batch_size)
+    try:
+        for data in cursor:
+            yield bson.decode_all(data)
+    finally:
+        cursor.close()
+
+
+def iter_docs(col, query=None, projection=None, sort=None, limit=0, batch_size=DEFAULT_BATCH_SIZE):
+    for batch in iter_batches(col, query, projection, sort, limit, batch_size):
+        yield from batch
+
+
+def find_list(col, query=None, projection=None, sort=None, limit=0):
+    """list(col.find(...)) through the raw path; for pages up to one batch this is one round trip."""
+    return list(iter_docs(col, query, projection, sort, limit, batch_size=limit or DEFAULT_BATCH_SIZE))
+
+
+# --- benchmark -----------------------------------------------------------------
+
+def _stored_listings(rows):
+    """Synthetic listings as stored, derived fields included."""
+    from benchmark import generate_listings
+    from search import CITY_KEY, GRAMS_FIELD, TITLE_FOLD, city_key, fold, title_grams
+    for d in generate_listings(rows):
+        d[CITY_KEY] = city_key(d["city"])
+        d[GRAMS_FIELD] = title_grams(d["title"])
+        d[TITLE_FOLD] = fold(d["title"])
+        d["updated_at"] = d["created_at"]
+        yield d
+
+
+def _measure(fn, batches, rows, batch_size):
+    """Time fn over every batch, then trace the peak memory of decoding one batch into rows."""
+    start = time.perf_counter()
+    for _ in fn(batches):
+        pass
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    next(fn(batches[:1]))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"us_per_row": seconds / rows * 1e6, "rows_per_sec": rows / seconds,
+            "bytes_per_row": peak / min(rows, batch_size)}
+
+
+def bench_decode(rows=200000, batch_size=DEFAULT_BATCH_SIZE):
+    """Decode the same CSV-export rows four ways from in-memory BSON batches; return {strategy: stats}."""
+    from export_csv import DEFAULT_FIELDS, to_row
+    full, projected = [], []
+    chunk_full, chunk_proj = [], []
+    for d in _stored_listings(rows):
+        chunk_full.append(bson.encode(d))
+        chunk_proj.append(bson.encode({f: d[f] for f in DEFAULT_FIELDS}))
+        if len(chunk_full) == batch_size:
+            full.append(b"".join(chunk_full))
+            projected.append(b"".join(chunk_proj))
+            chunk_full, chunk_proj = [], []
+    if chunk_full:
+        full.append(b"".join(chunk_full))
+        projected.append(b"".join(chunk_proj))
+
+    def cursor_like(batches):
+        # A find() cursor decodes each batch into a deque and hands out one document per next().
+        for data in batches:
+            docs = deque(bson.decode_all(data))
+            rows = []
+            while docs:
+                rows.append(to_row(docs.popleft(), DEFAULT_FIELDS))
+            yield rows
+
+    def raw_documents(batches):
+        for data in batches:
+            yield [to_row(doc, DEFAULT_FIELDS) for doc in bson.decode_all(data, RAW_OPTIONS)]
+
+    def raw_batches(batches):
+        for data in batches:
+            yield [to_row(doc, DEFAULT_FIELDS) for doc in bson.decode_all(data)]
+
+    return {
+        "find(), all fields": _measure(cursor_like, full, rows, batch_size),
+        "find(), projected": _measure(cursor_like, projected, rows, batch_size),
+        "RawBSONDocument, projected": _measure(raw_documents, projected, rows, batch_size),
+        "raw batches, projected": _measure(raw_batches, projected, rows, batch_size),
+    }
+
+
+def bench_server(batch_size=DEFAULT_BATCH_SIZE):
+    """Export the configured properties collection through find() and through raw batches."""
+    import tempfile
+    import export_csv
+    global RAW_READS
+    results = {}
+    saved = RAW_READS
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, mode in (("find() cursor", False), ("raw batches", True)):
+                RAW_READS = mode
+                stats = export_csv.export_properties(os.path.join(tmp, "export.csv"), batch_size=batch_size)
+                results[label] = {"rows": stats.rows, "seconds": stats.seconds, "rows_per_sec": stats.rows_per_sec}
+    finally:
+        RAW_READS = saved
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare dict decoding with the raw-BSON read path")
+    parser.add_argument("--bench", action="store_true", required=True)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--server", action="store_true", help="also export the real collection both ways")
+    args = parser.parse_args()
+
+    print(f"Decoding {args.rows} listings in batches of {args.batch_size} into CSV rows:")
+    print(f"{'strategy':30} {'us/row':>8} {'rows/s':>10} {'peak B/row':>10}")
+    for name, r in bench_decode(args.rows, args.batch_size).items():
+        print(f"{name:30} {r['us_per_row']:8.2f} {r['rows_per_sec']:10.0f} {r['bytes_per_row']:10.0f}")
+    if args.server:
+        print("\nExporting the properties collection:")
+        for name, r in bench_server(args.batch_size).items():
+            print(f"{name:30} {r['rows']} rows in {r['seconds']:.2f}s ({r['rows_per_sec']:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
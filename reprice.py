@@ -0,0 +1,210 @@
+# reprice.py
+"""Bulk repricing of listings.
+
+    python reprice.py file PRICES [--format csv|jsonl] [--chunk-size N] [--dry-run]
+    python reprice.py rule --percent 5 [--city Pune] [--status available] [--dry-run]
+
+`file` applies an id -> price feed (CSV with `_id,price` columns, or JSON
+Lines) in chunks of unordered UpdateOne operations, one bulk_write per chunk.
+`rule` adjusts every matching listing by a percentage in a single server-side
+pipeline update, so no documents travel to the client.
+
+Both report matched and modified counts with per-batch timing; --dry-run only
+counts what would change. Afterwards the city_stats of the affected cities and
+the portfolios of the affected owners are recomputed, and cached reads for
+those cities are invalidated, since bulk updates bypass the per-document
+bookkeeping in store.update_price().
+"""
+import argparse
+import time
+from datetime import datetime, UTC
+from pymongo import UpdateOne
+import city_stats
+import owners
+import store
+from bulk_insert import parse_object_id, read_records
+from db import properties_col
+from metrics import tagged
+from search import CITY_KEY, city_filter
+from store import PropertyError, parse_price
+
+DEFAULT_CHUNK_SIZE = 1000
+# Above this many cities, invalidate the whole cache instead of city by city.
+MAX_CITY_INVALIDATIONS = 50
+
+
+def read_prices(path, fmt):
+    """Yield (record_no, _id, price) or (record_no, None, error) for each feed record."""
+    for record_no, raw in enumerate(read_records(path, fmt), 1):
+        if isinstance(raw, Exception):
+            yield record_no, None, raw
+            continue
+        try:
+            yield record_no, parse_object_id(raw.get("_id")), parse_price(raw.get("price"))
+        except PropertyError as e:
+            yield record_no, None, e
+
+
+def _finish(keys):
+    """Recount city_stats for the cities touched and invalidate their cached reads."""
+    keys = {k for k in keys if k is not None}
+    if not keys:
+        return
+    city_stats.rebuild(keys)
+    if len(keys) > MAX_CITY_INVALIDATIONS:
+        store.changed(None)
+        return
+    for key in keys:
+        store.changed({CITY_KEY: key})
+
+
+def _apply_chunk(prices, dry_run):
+    start = time.perf_counter()
+    current = {d["_id"]: d for d in properties_col.find({"_id": {"$in": list(prices)}},
+                                                        {"price": 1, CITY_KEY: 1, "owner_id": 1})}
+    changes = {i: p for i, p in prices.items() if i in current and current[i].get("price") != p}
+    modified = 0
+    if changes and not dry_run:
+        now = datetime.now(UTC)
+        ops = [UpdateOne({"_id": i, "price": {"$ne": p}}, {"$set": {"price": p, "updated_at": now}})
+               for i, p in changes.items()]
+        modified = properties_col.bulk_write(ops, ordered=False).modified_count
+    batch = {
+        "size": len(prices),
+        "matched": len(current),
+        "missing": len(prices) - len(current),
+        "modified": len(changes) if dry_run else modified,
+        "ms": (time.perf_counter() - start) * 1000,
+    }
+    return batch, {current[i].get(CITY_KEY) for i in changes}, {current[i].get("owner_id") for i in changes}
+
+
+@tagged("reprice")
+def reprice_from_records(records, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, progress=None):
+    """Apply (record_no, _id, price-or-error) tuples in chunks; return the report dict.
+
+    Within a chunk the last price for an `_id` wins. `progress(batch)` is
+    called after each chunk.
+    """
+    report = {"batches": [], "rejected": [], "matched": 0, "modified": 0, "missing": 0, "dry_run": dry_run}
+    keys, owner_ids = set(), set()
+    chunk = {}
+
+    def flush():
+        batch, touched, touched_owners = _apply_chunk(chunk, dry_run)
+        batch["batch"] = len(report["batches"]) + 1
+        report["batches"].append(batch)
+        for k in ("matched", "modified", "missing"):
+            report[k] += batch[k]
+        keys.update(touched)
+        owner_ids.update(touched_owners)
+        if progress:
+            progress(batch)
+
+    start = time.perf_counter()
+    for record_no, _id, price in records:
+        if _id is None:
+            report["rejected"].append((record_no, str(price)))
+            continue
+        chunk[_id] = price
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk = {}
+    if chunk:
+        flush()
+    if not dry_run:
+        owners.rebuild(owner_ids)
+        _finish(keys)
+    report["cities"] = len(keys)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def rule_filter(city=None, status="available"):
+    q = {"status": status} if status else {}
+    if city:
+        q.update(city_filter(city, exact=True))
+    return q
+
+
+def _owners_stamped(q, stamp):
+    """Distinct owner ids of the listings matching `q` that a rule update stamped with `stamp`, streamed."""
+    pipeline = [{"$match": {**q, "updated_at": stamp, "owner_id": {"$ne": None}}}, {"$group": {"_id": "$owner_id"}}]
+    return (r["_id"] for r in properties_col.aggregate(pipeline))
+
+
+@tagged("reprice")
+def reprice_by_rule(percent, city=None, status="available", dry_run=False):
+    """Multiply matching prices by (1 + percent/100), rounded to whole units, in one update_many."""
+    if percent <= -100:
+        raise PropertyError("Percent must be greater than -100.")
+    q = rule_filter(city, status)
+    start = time.perf_counter()
+    if dry_run:
+        matched, modified = properties_col.count_documents(q), 0
+    else:
+        factor = 1 + percent / 100.0
+        now = datetime.now(UTC)
+        new_price = {"$toLong": {"$round": [{"$multiply": ["$price", factor]}, 0]}}
+        # Stamped with the client clock, like every other write path, for export_delta.py's watermark.
+        res = properties_col.update_many(q, [{"$set": {
+            "price": new_price,
+            "updated_at": {"$cond": [{"$eq": [new_price, "$price"]}, "$updated_at", {"$literal": now}]},
+        }}])
+        matched, modified = res.matched_count, res.modified_count
+    seconds = time.perf_counter() - start
+    if not dry_run and modified:
+        # A city rule touches one city; otherwise every city may have changed.
+        owners.rebuild(_owners_stamped(q, now))
+        if city:
+            _finish([q[CITY_KEY]])
+        else:
+            city_stats.rebuild()
+            store.changed(None)
+    return {"matched": matched, "modified": modified, "seconds": seconds, "dry_run": dry_run,
+            "batches": [{"batch": 1, "size": matched, "matched": matched, "modified": modified, "ms": seconds * 1000}]}
+
+
+def format_batch(batch):
+    return (f"  batch {batch['batch']}: {batch['matched']} matched, {batch['modified']} modified"
+            + (f", {batch['missing']} missing" if batch.get("missing") else "") + f" in {batch['ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk repricing of listings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    f = sub.add_parser("file", help="apply an id,price file")
+    f.add_argument("path")
+    f.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    f.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    f.add_argument("--dry-run", action="store_true", help="only count what would change")
+    r = sub.add_parser("rule", help="adjust prices by a percentage on the server")
+    r.add_argument("--percent", type=float, required=True, help="e.g. 5 for +5%%, -10 for -10%%")
+    r.add_argument("--city", help="only this city (default: all cities)")
+    r.add_argument("--status", default="available", help="only listings with this status ('' for any)")
+    r.add_argument("--dry-run", action="store_true", help="only count matching listings")
+    args = parser.parse_args()
+
+    if args.command == "file":
+        fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".json")) else "csv")
+        report = reprice_from_records(read_prices(args.path, fmt), args.chunk_size, args.dry_run,
+                                      progress=lambda b: print(format_batch(b)))
+        for record_no, err in report["rejected"][:20]:
+            print(f"  record {record_no} rejected: {err}")
+        print(f"{'Would modify' if args.dry_run else 'Modified'} {report['modified']} of {report['matched']} "
+              f"matched listings ({report['missing']} ids not found, {len(report['rejected'])} rejected, "
+              f"{report['cities']} cities) in {report['seconds']:.2f}s")
+        return
+    try:
+        report = reprice_by_rule(args.percent, args.city, args.status or None, args.dry_run)
+    except PropertyError as e:
+        raise SystemExit(str(e))
+    if args.dry_run:
+        print(f"{report['matched']} listings would be repriced by {args.percent:+g}%")
+    else:
+        print(f"Repriced {report['modified']} of {report['matched']} listings by {args.percent:+g}% "
+              f"in {report['seconds'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
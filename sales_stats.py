@@ -0,0 +1,213 @@
+# sales_stats.py
+"""Materialized sales rollups: volume, revenue and average price per city per day and month.
+
+`sales_daily` and `sales_monthly` hold one document per (city_key, period),
+with the number of sales, their total and min/max price. Periods are UTC
+dates as strings ("2024-05-17", "2024-05"), so a city report is one index
+range on (city_key, period) whatever the length of the history, and an
+all-cities report is one $group of the per-city buckets over the period
+range. There is no shared all-cities bucket: purchases of listings in
+different cities never write the same document, so they don't conflict.
+store.purchase_property() adds each sale to its city's buckets in the same
+transaction that records it; the sale itself carries `city` and `city_key`,
+so rollups never need a join back to `properties`. Archiving moves sales to
+`transactions_archive` without touching the rollups.
+
+    python sales_stats.py --backfill   # tag old sales with their city, then --rebuild
+    python sales_stats.py --verify     # report drift against a full recount
+    python sales_stats.py --rebuild    # recompute every bucket from the sales
+    python sales_stats.py --report month [--city Pune] [--last 12]
+"""
+import argparse
+from datetime import UTC
+from pymongo import UpdateOne
+from db import (properties_archive_col, properties_col, sales_daily_col, sales_monthly_col,
+                transactions_archive_col, transactions_col)
+from search import CITY_KEY, city_key
+
+GRANULARITIES = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+FIELDS = ("count", "revenue", "min", "max")
+UNKNOWN_CITY = ""  # sales whose listing was deleted before they were tagged
+ALL_CITIES = "*"  # city_key of the all-cities buckets older versions kept; --rebuild drops them
+
+
+def rollup_col(granularity):
+    return {"day": sales_daily_col, "month": sales_monthly_col}[granularity]
+
+
+def period_of(date, granularity):
+    if date.tzinfo is not None:
+        date = date.astimezone(UTC)
+    return date.strftime(GRANULARITIES[granularity])
+
+
+def bucket_id(key, period):
+    return f"{key}|{period}"
+
+
+def record_sale(doc, price, date, session=None):
+    """Add one sale of listing `doc` at `price` on `date` to its city's daily and monthly buckets."""
+    key = doc.get(CITY_KEY) or city_key(doc.get("city"))
+    for granularity in GRANULARITIES:
+        period = period_of(date, granularity)
+        rollup_col(granularity).bulk_write([UpdateOne(
+            {"_id": bucket_id(key, period)},
+            {"$inc": {"count": 1, "revenue": price}, "$min": {"min": price}, "$max": {"max": price},
+             "$setOnInsert": {CITY_KEY: key, "city": doc.get("city"), "period": period}},
+            upsert=True)], session=session)
+
+
+def tag_sales(chunk_size=1000):
+    """Copy city/city_key from the listing onto sales recorded before they were stored there; return the count."""
+    tagged = 0
+    for col in (transactions_col, transactions_archive_col):
+        while True:
+            sales = list(col.find({CITY_KEY: {"$exists": False}}, {"property_id": 1}).limit(chunk_size))
+            if not sales:
+                break
+            ids = list({s["property_id"] for s in sales})
+            cities = {}
+            for listings in (properties_col, properties_archive_col):
+                for d in listings.find({"_id": {"$in": ids}}, {"city": 1, CITY_KEY: 1}):
+                    cities.setdefault(d["_id"], (d.get("city"), d.get(CITY_KEY) or city_key(d.get("city"))))
+            ops = []
+            for s in sales:
+                city, key = cities.get(s["property_id"], (None, UNKNOWN_CITY))
+                ops.append(UpdateOne({"_id": s["_id"]}, {"$set": {"city": city, CITY_KEY: key}}))
+            col.bulk_write(ops, ordered=False)
+            tagged += len(ops)
+    return tagged
+
+
+def _group(col, match, group_id, city, from_buckets=False, tail=()):
+    """$group sales (or, `from_buckets`, existing buckets) into count/revenue/min/max."""
+    group = {
+        "_id": group_id,
+        "count": {"$sum": "$count" if from_buckets else 1},
+        "revenue": {"$sum": "$revenue" if from_buckets else "$price"},
+        "min": {"$min": "$min" if from_buckets else "$price"},
+        "max": {"$max": "$max" if from_buckets else "$price"},
+    }
+    if city is not None:
+        group["city"] = {"$first": city}
+    return col.aggregate(match + [{"$group": group}] + list(tail))
+
+
+def _recount(granularity, keys=None):
+    """Per-city buckets straight from the sales (both tiers), for every city or just `keys`."""
+    match = [{"$match": {CITY_KEY: {"$in": list(keys)}}}] if keys is not None else []
+    group_id = {"k": {"$ifNull": [f"${CITY_KEY}", UNKNOWN_CITY]},
+                "p": {"$dateToString": {"format": GRANULARITIES[granularity], "date": "$date"}}}
+    rows = {}
+    for col in (transactions_col, transactions_archive_col):
+        for r in _group(col, match, group_id, "$city"):
+            _id = bucket_id(r["_id"]["k"], r["_id"]["p"])
+            row = rows.get(_id)
+            if row is None:
+                rows[_id] = {"_id": _id, CITY_KEY: r["_id"]["k"], "city": r["city"], "period": r["_id"]["p"],
+                             **{f: r[f] for f in FIELDS}}
+                continue
+            row["count"] += r["count"]
+            row["revenue"] += r["revenue"]
+            row["min"] = min(row["min"], r["min"])
+            row["max"] = max(row["max"], r["max"])
+            row["city"] = row["city"] or r["city"]
+    return rows
+
+
+def _replace(granularity, rows, keys, chunk_size):
+    col = rollup_col(granularity)
+    col.delete_many({CITY_KEY: {"$in": list(keys)}} if keys is not None else {})
+    batch = list(rows.values())
+    for i in range(0, len(batch), chunk_size):
+        col.insert_many(batch[i:i + chunk_size], ordered=False)
+    return len(batch)
+
+
+def rebuild(keys=None, chunk_size=1000):
+    """Recompute the buckets of every city, or just `keys`; return buckets written."""
+    return sum(_replace(granularity, _recount(granularity, keys), keys, chunk_size) for granularity in GRANULARITIES)
+
+
+def verify():
+    """Compare the buckets with a full recount; return a list of drift descriptions."""
+    drift = []
+    for granularity in GRANULARITIES:
+        expected = _recount(granularity)
+        actual = {d["_id"]: d for d in rollup_col(granularity).find({})}
+        for _id in sorted(set(expected) | set(actual)):
+            e, a = expected.get(_id), actual.get(_id)
+            if e is None or a is None:
+                drift.append(f"{granularity} {_id!r}: {'missing bucket' if a is None else 'bucket without sales'}")
+                continue
+            for f in FIELDS:
+                if e.get(f) != a.get(f):
+                    drift.append(f"{granularity} {_id!r}.{f}: expected {e.get(f)}, found {a.get(f)}")
+    return drift
+
+
+def read_sales(granularity="month", city=None, start=None, end=None, last=None):
+    """Buckets for one city, or for all cities together, newest period first.
+
+    `start`/`end` are inclusive period strings; `last` keeps only the most
+    recent periods. Each row has period, count, revenue, min, max and avgPrice;
+    all-cities rows are the per-city buckets of each period summed in one $group.
+    """
+    q = {CITY_KEY: city_key(city) if city else {"$ne": ALL_CITIES}}
+    if start or end:
+        q["period"] = {k: v for k, v in (("$gte", start), ("$lte", end)) if v}
+    col = rollup_col(granularity)
+    if city:
+        projection = {"_id": 0, "period": 1, **{f: 1 for f in FIELDS}}
+        rows = list(col.find(q, projection).sort("period", -1).limit(last or 0))
+    else:
+        tail = [{"$sort": {"_id": -1}}] + ([{"$limit": last}] if last else [])
+        rows = [{"period": r.pop("_id"), **r} for r in _group(col, [{"$match": q}], "$period", None, True, tail)]
+    for r in rows:
+        r["avgPrice"] = r["revenue"] / r["count"] if r.get("count") else None
+    return rows
+
+
+def read_city_totals(granularity="month", period=None):
+    """Per-city buckets for one period (default: the latest one), by revenue."""
+    col = rollup_col(granularity)
+    if period is None:
+        latest = col.find_one({CITY_KEY: {"$ne": ALL_CITIES}}, {"period": 1}, sort=[("period", -1)])
+        if latest is None:
+            return []
+        period = latest["period"]
+    rows = list(col.find({"period": period, CITY_KEY: {"$ne": ALL_CITIES}}, {"_id": 0}).sort("revenue", -1))
+    for r in rows:
+        r["avgPrice"] = r["revenue"] / r["count"] if r.get("count") else None
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain or query the sales rollups")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--backfill", action="store_true")
+    group.add_argument("--verify", action="store_true")
+    group.add_argument("--rebuild", action="store_true")
+    group.add_argument("--report", choices=tuple(GRANULARITIES))
+    parser.add_argument("--city")
+    parser.add_argument("--last", type=int, default=12, help="periods to show with --report")
+    args = parser.parse_args()
+    if args.backfill:
+        print(f"Tagged {tag_sales()} sales with their city")
+        print(f"Rebuilt {rebuild()} buckets")
+        return
+    if args.rebuild:
+        print(f"Rebuilt {rebuild()} buckets")
+        return
+    if args.report:
+        for r in read_sales(args.report, args.city, last=args.last):
+            print(f"{r['period']}: {r['count']} sales, revenue {r['revenue']}, avg {r['avgPrice']:.0f}")
+        return
+    drift = verify()
+    for line in drift:
+        print(line)
+    print("sales rollups are consistent" if not drift else f"{len(drift)} differences; run with --rebuild to fix")
+
+
+if __name__ == "__main__":
+    main()
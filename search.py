@@ -0,0 +1,81 @@
+# search.py
+"""Indexed, case-insensitive partial-match title search.
+
+Every property stores `title_grams`: the distinct 1-, 2- and 3-character
+substrings of its case-folded title, covered by a multikey index, and
+`title_fold`, that folded title itself. A three-character search is then a
+single index lookup on that gram, and longer searches require all of their
+trigrams (again an index lookup) before a final check on the few candidates
+confirms the exact substring in `title_fold`. Shorter searches would match
+nearly every listing, so they don't filter on the title at all. Both steps use the
+same fold(), so titles where casefold() and a regex's case-insensitive match
+differ ("Straße" / "STRASSE") are neither dropped nor let through. This keeps
+the old "partial, case-insensitive" behaviour without scanning the collection.
+
+Cities are matched on `city_key`, a canonical form of the city name (trimmed,
+lowercased, accent-folded, single-spaced), so "Mumbai " and "mumbai" are the
+same city and a city search is an equality or anchored-prefix index range.
+"""
+import re
+import unicodedata
+
+GRAMS_FIELD = "title_grams"
+TITLE_FOLD = "title_fold"
+GRAM_SIZES = (1, 2, 3)
+MIN_TITLE_SEARCH = 3  # shorter terms don't filter on the title
+CITY_KEY = "city_key"
+
+
+def fold(text):
+    return text.strip().casefold()
+
+
+def city_key(city):
+    """Canonical, index-friendly key for a city name."""
+    decomposed = unicodedata.normalize("NFKD", city or "")
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.casefold().split())
+
+
+def prefix_range(prefix):
+    """Range bounds matching every string that starts with `prefix`."""
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+
+def city_filter(text, exact=False):
+    """Filter on `city_key` equal to, or starting with, the normalized `text`."""
+    key = city_key(text)
+    if exact or not key:
+        return {CITY_KEY: key}
+    return {CITY_KEY: prefix_range(key)}
+
+
+def title_grams(title):
+    """Return the sorted distinct n-grams stored for `title`."""
+    t = fold(title or "")
+    grams = set()
+    for n in GRAM_SIZES:
+        for i in range(len(t) - n + 1):
+            grams.add(t[i:i + n])
+    return sorted(grams)
+
+
+def title_filter(text):
+    """Filter matching titles that contain `text`, case-insensitively, via the gram index.
+
+    Returns None when `text` is shorter than MIN_TITLE_SEARCH characters.
+    """
+    t = fold(text)
+    if len(t) < MIN_TITLE_SEARCH:
+        return None
+    longest = GRAM_SIZES[-1]
+    if len(t) <= longest:
+        return {GRAMS_FIELD: t}
+    grams = sorted({t[i:i + longest] for i in range(len(t) - longest + 1)})
+    return {GRAMS_FIELD: {"$all": grams}, TITLE_FOLD: {"$regex": re.escape(t)}}
+
+
+def text_filter(text):
+    """City prefix or title substring, as typed in a filter box; only the city prefix for short text."""
+    title = title_filter(text)
+    return {"$or": [city_filter(text), title]} if title else city_filter(text)
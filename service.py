@@ -0,0 +1,382 @@
+# service.py
+"""Asyncio HTTP/JSON service over the property operations.
+
+    python service.py [--host 127.0.0.1] [--port 8080] [--workers N] [--concurrency 64]
+
+Reads (list, search, get, city stats, CSV export) use pymongo's native async
+client with one connection pool per worker process. Writes (insert, price
+update, delete, purchase, owner changes) go through store.py and owners.py
+on a thread, so they keep the same validation, city_stats and portfolio
+maintenance, transactions and cache invalidation
+as the CLI and GUI. At most --concurrency requests are served at once per
+worker; the rest wait. With --workers N, N processes share the port
+(SO_REUSEPORT, Linux/BSD), so the service can also be scaled out behind a
+load balancer by running it on several hosts.
+
+    GET    /health
+    GET    /metrics                          Prometheus text (metrics.py)
+    GET    /properties?per_page=&token=&city=&title=&include_archived=1
+    GET    /search?text=&city=&title=&min_price=&max_price=&status=&listed_from=&listed_before=
+                  &per_page=&token=&include_archived=1&facets=0   page + facet counts (facets.py)
+    GET    /properties/{id}
+    POST   /properties                       {"title", "city", "price", "status"?, "owner_id"?}
+    PUT    /properties/{id}/price            {"price"}
+    PUT    /properties/{id}/owner            {"owner_id"}   null removes the owner
+    DELETE /properties/{id}
+    POST   /properties/{id}/purchase         {"buyer", "price"}
+    GET    /stats/cities
+    GET    /owners?name=                     name prefix
+    POST   /owners                           {"name", "email"?, "phone"?}
+    GET    /owners/{id}                      owner with its portfolio summary
+    GET    /owners/{id}/properties?per_page=&token=   owner + summary + keyset page
+    DELETE /owners/{id}                      only once it has no listings
+    GET    /export.csv?include_archived=1  streamed
+
+Errors are returned as {"error": message} with a 4xx/5xx status.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from bson import ObjectId
+from bson.errors import InvalidId
+import facets
+import metrics
+import owners
+import store
+from archive import ARCHIVE_COLLECTION
+from db import DB_NAME, async_client
+from export_csv import DEFAULT_BATCH_SIZE, DEFAULT_FIELDS, projection_for, to_row
+from metrics import operation
+from pagination import InvalidToken, fetch_page_async
+from search import GRAMS_FIELD, TITLE_FOLD, city_filter, title_filter
+from store import AlreadySold, PartialWrite, PropertyError, PropertyNotFound, build_property, parse_price
+
+DEFAULT_CONCURRENCY = int(os.getenv("SERVICE_CONCURRENCY", "64"))
+MAX_PER_PAGE = 200
+HIDDEN = {GRAMS_FIELD: 0, TITLE_FOLD: 0}
+
+DB = web.AppKey("db", object)
+LIMIT = web.AppKey("limit", asyncio.Semaphore)
+CONCURRENCY = web.AppKey("concurrency", int)
+
+
+def to_json(data, status=200):
+    return web.json_response(data, status=status, dumps=lambda d: json.dumps(d, default=str))
+
+
+def error(status, message):
+    return to_json({"error": message}, status)
+
+
+def object_id(request, label="property"):
+    try:
+        return ObjectId(request.match_info["id"])
+    except InvalidId:
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"Invalid {label} id"}), content_type="application/json")
+
+
+async def json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be a JSON object"}),
+                                 content_type="application/json")
+    return body
+
+
+@web.middleware
+async def limit_and_map_errors(request, handler):
+    async with request.app[LIMIT]:
+        try:
+            return await handler(request)
+        except (PropertyError, InvalidToken, owners.OwnerError) as e:
+            return error(400, str(e))
+        except owners.OwnerNotFound as e:
+            return error(404, str(e))
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            return error(500, f"{type(e).__name__}: {e}")
+
+
+def include_archived(request):
+    return request.query.get("include_archived", "").lower() in ("1", "true", "yes")
+
+
+async def health(request):
+    with operation("health"):
+        await request.app[DB].command("ping")
+    return to_json({"ok": True})
+
+
+async def prometheus(request):
+    return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+
+def per_page_of(request):
+    try:
+        return min(MAX_PER_PAGE, max(1, int(request.query.get("per_page", 20))))
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": "per_page must be a number"}),
+                                 content_type="application/json")
+
+
+async def list_properties(request):
+    """Keyset page; `city` (prefix) and `title` (substring, 3+ characters) filters combine with AND."""
+    q = request.query
+    per_page = per_page_of(request)
+    filters = []
+    if q.get("city", "").strip():
+        filters.append(city_filter(q["city"]))
+    if title_filter(q.get("title", "")):
+        filters.append(title_filter(q["title"]))
+    query = filters[0] if len(filters) == 1 else ({"$and": filters} if filters else {})
+    union = ARCHIVE_COLLECTION if include_archived(request) else None
+    with operation("search" if filters else "list"):
+        page = await fetch_page_async(request.app[DB].properties, query, q.get("token") or None, per_page, HIDDEN,
+                                      union)
+    return to_json({"items": page.docs, "next_token": page.next_token, "prev_token": page.prev_token})
+
+
+async def search_properties(request):
+    """First page of a structured search with its facet counts, in one aggregation.
+
+    With facets=0 only the page is read, plus facets.estimated_total() when
+    that needs no scan; later pages of a search are requested that way.
+    """
+    q = request.query
+    per_page = per_page_of(request)
+    query = facets.build_filter(q.get("text"), q.get("city"), q.get("title"), q.get("min_price"), q.get("max_price"),
+                                q.get("status") or None, q.get("listed_from"), q.get("listed_before"))
+    union = ARCHIVE_COLLECTION if include_archived(request) else None
+    token = q.get("token") or None
+    db = request.app[DB]
+    with operation("search"):
+        if q.get("facets", "1").lower() in ("0", "false", "no"):
+            page = await fetch_page_async(db.properties, query, token, per_page, HIDDEN, union)
+            total = None if union else await asyncio.to_thread(facets.estimated_total, query)
+            return to_json({"items": page.docs, "next_token": page.next_token, "prev_token": page.prev_token,
+                            "estimated_total": total})
+        if not query and not union:
+            page = await fetch_page_async(db.properties, None, token, per_page, HIDDEN)
+            counts = facets.stats_facets(await db.city_stats.find({}).to_list())
+        else:
+            pipeline, direction = facets.search_pipeline(query, token, per_page, HIDDEN, union)
+            result = await (await db.properties.aggregate(pipeline)).to_list()
+            page, counts = facets.read_result(result, per_page, direction, token)
+    return to_json({"items": page.docs, "next_token": page.next_token, "prev_token": page.prev_token,
+                    "facets": counts})
+
+
+async def get_property(request):
+    with operation("get"):
+        doc = await request.app[DB].properties.find_one({"_id": object_id(request)}, HIDDEN)
+    return to_json(doc) if doc else error(404, "Property not found")
+
+
+async def insert_property(request):
+    body = await json_body(request)
+    doc = build_property(body.get("title"), body.get("city"), body.get("price"), body.get("status") or "available",
+                         owner_id=body.get("owner_id"))
+    inserted_id = await asyncio.to_thread(store.insert_property, doc)
+    return to_json({"_id": inserted_id}, 201)
+
+
+async def update_price(request):
+    obj_id = object_id(request)
+    price = parse_price((await json_body(request)).get("price"))
+    modified = await asyncio.to_thread(store.update_price, obj_id, price)
+    return to_json({"modified": modified})
+
+
+async def delete_property(request):
+    deleted = await asyncio.to_thread(store.delete_property, object_id(request))
+    return to_json({"deleted": deleted}) if deleted else error(404, "Property not found")
+
+
+async def purchase(request):
+    obj_id = object_id(request)
+    body = await json_body(request)
+    buyer = (body.get("buyer") or "").strip() if isinstance(body.get("buyer"), str) else ""
+    if not buyer:
+        return error(400, "Buyer name is required.")
+    price = parse_price(body.get("price"), "Offer price")
+    try:
+        transactional = await asyncio.to_thread(store.purchase_property, obj_id, buyer, price)
+    except AlreadySold:
+        return error(409, "Already sold")
+    except PropertyNotFound:
+        return error(404, "Property not found")
+    except PartialWrite as e:
+        return error(500, str(e))
+    return to_json({"sold": True, "transactional": transactional})
+
+
+async def assign_owner(request):
+    obj_id = object_id(request)
+    body = await json_body(request)
+    owner_id = owners.parse_owner_id(body["owner_id"]) if body.get("owner_id") else None
+    try:
+        modified = await asyncio.to_thread(store.assign_owner, obj_id, owner_id)
+    except PropertyNotFound:
+        return error(404, "Property not found")
+    return to_json({"modified": modified})
+
+
+async def find_owners(request):
+    with operation("owners"):
+        found = await request.app[DB].owners.find(owners.name_filter(request.query.get("name"))) \
+            .sort(owners.NAME_SORT).limit(owners.MAX_FOUND).to_list()
+    return to_json([owners.summary(o) for o in found])
+
+
+async def create_owner(request):
+    body = await json_body(request)
+    doc = owners.build_owner(body.get("name"), body.get("email"), body.get("phone"))
+    inserted = await request.app[DB].owners.insert_one(doc)
+    return to_json({"_id": inserted.inserted_id}, 201)
+
+
+async def get_owner(request):
+    with operation("owners"):
+        owner = await request.app[DB].owners.find_one({"_id": object_id(request, "owner")})
+    return to_json(owners.summary(owner)) if owner else error(404, "Owner not found")
+
+
+async def owner_properties(request):
+    """The owner with its summary and a keyset page of its listings: two index seeks, no $lookup."""
+    owner_id = object_id(request, "owner")
+    db = request.app[DB]
+    with operation("owners"):
+        owner = await db.owners.find_one({"_id": owner_id})
+        if owner is None:
+            return error(404, "Owner not found")
+        page = await fetch_page_async(db.properties, {"owner_id": owner_id}, request.query.get("token") or None,
+                                      per_page_of(request), HIDDEN)
+    return to_json({"owner": owners.summary(owner), "items": page.docs, "next_token": page.next_token,
+                    "prev_token": page.prev_token})
+
+
+async def delete_owner(request):
+    await asyncio.to_thread(owners.delete_owner, object_id(request, "owner"))
+    return to_json({"deleted": 1})
+
+
+async def city_stats(request):
+    with operation("stats"):
+        rows = await request.app[DB].city_stats.find({}).sort("_id", 1).to_list()
+    for r in rows:
+        r["avgPrice"] = r["sum"] / r["count"] if r.get("count") else None
+    return to_json(rows)
+
+
+async def export_csv(request):
+    """Stream every property as CSV, one cursor batch per chunk."""
+    response = web.StreamResponse(headers={"Content-Type": "text/csv; charset=utf-8",
+                                           "Content-Disposition": 'attachment; filename="properties_export.csv"'})
+    await response.prepare(request)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(DEFAULT_FIELDS)
+    sources = ["properties", ARCHIVE_COLLECTION] if include_archived(request) else ["properties"]
+    rows = 0
+    with operation("export"):
+        for name in sources:
+            cursor = request.app[DB][name].find({}, projection_for(DEFAULT_FIELDS), batch_size=DEFAULT_BATCH_SIZE)
+            try:
+                async for doc in cursor:
+                    writer.writerow(to_row(doc, DEFAULT_FIELDS))
+                    rows += 1
+                    if rows % DEFAULT_BATCH_SIZE == 0:
+                        await response.write(buf.getvalue().encode("utf-8"))
+                        buf.seek(0)
+                        buf.truncate()
+            finally:
+                await cursor.close()
+    await response.write(buf.getvalue().encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def _open(app):
+    # asyncio.to_thread() runs on the loop's default executor; size it to the
+    # request limit so writes are not queued behind a smaller pool.
+    executor = ThreadPoolExecutor(max_workers=app[CONCURRENCY], thread_name_prefix="store")
+    asyncio.get_running_loop().set_default_executor(executor)
+    client = async_client()
+    app[DB] = client[DB_NAME]
+    yield
+    await client.close()
+    executor.shutdown(wait=False)
+
+
+def make_app(concurrency=DEFAULT_CONCURRENCY):
+    app = web.Application(middlewares=[limit_and_map_errors])
+    app[LIMIT] = asyncio.Semaphore(concurrency)
+    app[CONCURRENCY] = concurrency
+    app.cleanup_ctx.append(_open)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/metrics", prometheus),
+        web.get("/properties", list_properties),
+        web.get("/search", search_properties),
+        web.post("/properties", insert_property),
+        web.get("/properties/{id}", get_property),
+        web.put("/properties/{id}/price", update_price),
+        web.delete("/properties/{id}", delete_property),
+        web.post("/properties/{id}/purchase", purchase),
+        web.put("/properties/{id}/owner", assign_owner),
+        web.get("/stats/cities", city_stats),
+        web.get("/owners", find_owners),
+        web.post("/owners", create_owner),
+        web.get("/owners/{id}", get_owner),
+        web.get("/owners/{id}/properties", owner_properties),
+        web.delete("/owners/{id}", delete_owner),
+        web.get("/export.csv", export_csv),
+    ])
+    return app
+
+
+def run_worker(host, port, concurrency, reuse_port):
+    web.run_app(make_app(concurrency), host=host, port=port, reuse_port=reuse_port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON API for the property operations")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=1, help="processes sharing the port (SO_REUSEPORT)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="requests served at once per worker")
+    args = parser.parse_args()
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers needs SO_REUSEPORT; run one process per port behind a load balancer instead")
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} worker(s)")
+    if args.workers <= 1:
+        run_worker(args.host, args.port, args.concurrency, False)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_worker, args=(args.host, args.port, args.concurrency, True), daemon=True)
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# store.py
+"""Shared rules and write paths for property documents.
+
+app.py, ui.py and bulk_insert.py validate listings with build_property() and
+change them through the functions below, which keep derived data (such as the
+city_stats collection and the owners' portfolio summaries) in step with
+`properties` inside one transaction when the server supports transactions.
+"""
+import threading
+from datetime import datetime, UTC
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+import city_stats
+import local_replica
+import owners
+import sales_stats
+from cache import bump_version, query_cache
+from db import client, owners_col, properties_col, tombstones_col, transactions_col
+from metrics import tagged
+from search import CITY_KEY, GRAMS_FIELD, TITLE_FOLD, city_key, fold, title_grams
+
+STATUSES = ("available", "sold")
+
+
+class PropertyError(ValueError):
+    """A property failed validation; the message is meant for the user."""
+
+
+class NotAvailable(Exception):
+    """The property does not exist or has already been sold."""
+
+
+class AlreadySold(NotAvailable):
+    """The property exists but is no longer available."""
+
+
+class PropertyNotFound(NotAvailable):
+    """No property has the given id."""
+
+
+class TransactionsUnsupported(Exception):
+    """The server cannot run multi-document transactions (standalone mongod)."""
+
+
+class PartialWrite(Exception):
+    """Without transactions, the first write of a multi-document change succeeded but a later one failed."""
+
+
+def parse_price(value, label="Price"):
+    """Coerce `value` to a non-negative int the way the CLI and UI prompts do."""
+    if isinstance(value, bool):
+        raise PropertyError(f"{label} must be a number.")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise PropertyError(f"{label} must be a number.")
+        value = int(value)
+    try:
+        price = int(value)
+    except (TypeError, ValueError):
+        raise PropertyError(f"{label} must be a number.") from None
+    if price < 0:
+        raise PropertyError(f"{label} cannot be negative.")
+    return price
+
+
+def build_property(title, city, price, status="available", created_at=None, owner_id=None):
+    """Validate the fields of a new listing and return the document to insert."""
+    title = (title or "").strip()
+    city = (city or "").strip()
+    if not title or not city:
+        raise PropertyError("Title and city are required.")
+    price = parse_price(price)
+    if status not in STATUSES:
+        raise PropertyError(f"Status must be one of: {', '.join(STATUSES)}.")
+    now = datetime.now(UTC)
+    doc = {
+        "title": title,
+        "city": city,
+        CITY_KEY: city_key(city),
+        "price": price,
+        "status": status,
+        "created_at": created_at or now,
+        "updated_at": now,
+        GRAMS_FIELD: title_grams(title),
+        TITLE_FOLD: fold(title),
+    }
+    if owner_id not in (None, ""):
+        try:
+            doc["owner_id"] = ObjectId(owner_id)
+        except (InvalidId, TypeError):
+            raise PropertyError("Invalid owner id.") from None
+    return doc
+
+
+def record_tombstone(obj_id, reason="deleted", session=None):
+    """Note that a listing left `properties`, so incremental exports can emit the delete."""
+    tombstones_col.replace_one({"_id": obj_id}, {"deleted_at": datetime.now(UTC), "reason": reason},
+                               upsert=True, session=session)
+
+
+# Fields the write paths need from the previous version of a document.
+_STATS_FIELDS = {"city": 1, CITY_KEY: 1, "price": 1, "status": 1, "owner_id": 1}
+
+
+_supports_transactions = None  # learned from the first attempt
+retry_counts = {"transient": 0}  # transactions re-run by with_transaction()
+_retry_lock = threading.Lock()
+
+
+def transactions_unsupported(exc):
+    """True if `exc` is the server refusing transactions, as opposed to a failure inside one."""
+    if not isinstance(exc, OperationFailure):
+        return False
+    msg = str(exc)
+    return exc.code == 20 and ("Transaction numbers" in msg or "transactions" in msg.lower())
+
+
+def run_in_transaction(callback, allow_fallback=True):
+    """Run callback(session) in a transaction; return (result, transactional).
+
+    The transaction goes through ClientSession.with_transaction(), so errors
+    labelled TransientTransactionError (e.g. a write conflict with a
+    concurrent buyer) re-run the whole callback and
+    UnknownTransactionCommitResult retries just the commit, with the driver's
+    jittered backoff, for up to its two-minute limit. Re-runs are counted in
+    retry_counts. Any other error, including the callback's own exceptions,
+    aborts and propagates.
+
+    A standalone server rejects transactions before anything is written; then
+    callback(None) runs without one, or TransactionsUnsupported is raised if
+    `allow_fallback` is False.
+    """
+    global _supports_transactions
+    if _supports_transactions is False:
+        if not allow_fallback:
+            raise TransactionsUnsupported("This server does not support transactions")
+        return callback(None), False
+    attempts = 0
+
+    def attempt(session):
+        nonlocal attempts
+        if attempts:
+            with _retry_lock:
+                retry_counts["transient"] += 1
+        attempts += 1
+        return callback(session)
+
+    with client.start_session() as session:
+        try:
+            result = session.with_transaction(attempt)
+        except OperationFailure as e:
+            if not transactions_unsupported(e):
+                raise
+            _supports_transactions = False
+            return run_in_transaction(callback, allow_fallback)
+    _supports_transactions = True
+    return result, True
+
+
+def changed(doc=None):
+    """Invalidate cached reads after a committed write to `doc` (None: unknown or many documents)."""
+    query_cache.invalidate_city(city_stats.key_of(doc) if doc else None)
+    local_replica.sync_soon()
+    try:
+        bump_version()
+    except PyMongoError:
+        pass  # other processes' caches still expire by TTL
+
+
+@tagged("insert")
+def insert_property(doc):
+    """Insert a document from build_property(); return its id. Raises owners.OwnerNotFound."""
+    def write(session):
+        owners.record_insert(doc, session)  # first: raises OwnerNotFound before anything is written
+        res = properties_col.insert_one(doc, session=session)
+        city_stats.record_insert(doc, session)
+        return res.inserted_id
+    inserted_id = run_in_transaction(write)[0]
+    changed(doc)
+    return inserted_id
+
+
+@tagged("update")
+def update_price(obj_id, price):
+    """Set the price of one property; return the modified count."""
+    def write(session):
+        old = properties_col.find_one_and_update({"_id": obj_id, "price": {"$ne": price}},
+                                                 {"$set": {"price": price, "updated_at": datetime.now(UTC)}},
+                                                 projection=_STATS_FIELDS, session=session)
+        if old is None:
+            return None
+        city_stats.record_price_change(old, price, session)
+        owners.record_price_change(old, price, session)
+        return old
+    old = run_in_transaction(write)[0]
+    if old is None:
+        return 0
+    changed(old)
+    return 1
+
+
+@tagged("delete")
+def delete_property(obj_id):
+    """Delete one property; return the deleted count."""
+    def write(session):
+        old = properties_col.find_one_and_delete({"_id": obj_id}, projection=_STATS_FIELDS, session=session)
+        if old is None:
+            return None
+        city_stats.record_delete(old, session)
+        owners.record_delete(old, session)
+        record_tombstone(obj_id, session=session)
+        return old
+    old = run_in_transaction(write)[0]
+    if old is None:
+        return 0
+    changed(old)
+    return 1
+
+
+@tagged("update")
+def assign_owner(obj_id, owner_id):
+    """Give one property to `owner_id` (None: no owner); return the modified count.
+
+    Raises PropertyNotFound, or owners.OwnerNotFound for an unknown owner.
+    """
+    def write(session):
+        if owner_id is not None and not owners_col.count_documents({"_id": owner_id}, limit=1, session=session):
+            raise owners.OwnerNotFound("Owner not found")
+        now = datetime.now(UTC)
+        update = {"$set": {"owner_id": owner_id, "updated_at": now}} if owner_id is not None \
+            else {"$unset": {"owner_id": ""}, "$set": {"updated_at": now}}
+        old = properties_col.find_one_and_update({"_id": obj_id, "owner_id": {"$ne": owner_id}}, update,
+                                                 projection=_STATS_FIELDS, session=session)
+        if old is None:
+            if not properties_col.count_documents({"_id": obj_id}, limit=1, session=session):
+                raise PropertyNotFound("Property not found")
+            return None
+        owners.record_transfer(old, owner_id, session)
+        return old
+    old = run_in_transaction(write)[0]
+    if old is None:
+        return 0
+    changed(old)
+    return 1
+
+
+@tagged("purchase")
+def purchase_property(obj_id, buyer, price, require_transaction=False):
+    """Mark an available property sold and record the sale.
+
+    Returns True when the purchase ran in a transaction. Raises AlreadySold or
+    PropertyNotFound (both NotAvailable), TransactionsUnsupported if
+    `require_transaction` is set on a server without transactions, and
+    PartialWrite if, without a transaction, the property was marked sold but
+    the sale was not recorded.
+    """
+    def write(session):
+        now = datetime.now(UTC)
+        doc = properties_col.find_one_and_update({"_id": obj_id, "status": "available"},
+                                                 {"$set": {"status": "sold", "updated_at": now}},
+                                                 projection=_STATS_FIELDS, return_document=ReturnDocument.BEFORE,
+                                                 session=session)
+        if doc is None:
+            if properties_col.count_documents({"_id": obj_id}, limit=1, session=session):
+                raise AlreadySold("Already sold")
+            raise PropertyNotFound("Property not found")
+        try:
+            transactions_col.insert_one({"property_id": obj_id, "buyer_name": buyer, "price": price, "date": now,
+                                         "city": doc.get("city"), CITY_KEY: city_stats.key_of(doc)},
+                                        session=session)
+            city_stats.record_sale(doc, session)
+            owners.record_sale(doc, session)
+            sales_stats.record_sale(doc, price, now, session)
+        except Exception as e:
+            if session is None:
+                changed(doc)
+                raise PartialWrite(f"Property marked sold but failed to record transaction: {e}") from e
+            raise
+        return doc
+    doc, transactional = run_in_transaction(write, allow_fallback=not require_transaction)
+    changed(doc)
+    return transactional
@@ -1,14 +1,37 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from db import properties_col, transactions_col, client
+from db import properties_col, properties_archive_col, mark, startup_report, STARTUP_TIMING
 from bson import ObjectId
 from bson.errors import InvalidId
-from datetime import datetime, UTC
-import csv
-import re
-from pymongo.errors import OperationFailure
+import bisect
+import queue
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from pagination import encode_token
+from cache import cached, cached_page, query_cache, start_invalidation
+from export_csv import export_properties, EXPORT_PATH
+import store
+import sales_stats
+from store import build_property, PropertyError, AlreadySold, PropertyNotFound, PartialWrite, STATUSES
+from search import MIN_TITLE_SEARCH, city_key, fold
+from indexes import ensure_indexes
+from archive import ARCHIVE_COLLECTION
+import facets
+import local_replica
+import metrics
+from metrics import operation
+
+PAGE_SIZE = 200       # rows fetched per scroll step
+MAX_ROWS = 1000       # rows kept in the grid; rows scrolled far out of view are dropped and re-fetched
+PREFETCH_AT = 0.8     # fetch the next page once the view reaches this fraction of the loaded rows
+GRID_PROJECTION = {"_id": 1, "title": 1, "city": 1, "price": 1, "status": 1}
+WORKERS = 4
+POLL_MS = 50          # how often the Tk thread collects results from the workers
+DEBOUNCE_MS = 300     # quiet period after a keystroke before the filter query runs
+EXPORT_PROGRESS_EVERY = 1000
+SALES_PERIODS = 36    # most recent days/months shown in the sales window
+FACET_CITIES = 5      # cities named in the facet line
 
 
 def stop_app_py():
@@ -49,11 +72,19 @@ def stop_app_py():
 class SimpleUI(tk.Tk):
     def __init__(self):
         super().__init__()
-        # Auto-stop any running app.py before starting the UI
-        stop_app_py()
         self.title("Real Estate — Simple UI")
         self.geometry("900x580")
 
+        # Database work runs on this pool; results come back through self.results
+        # and are applied on the Tk thread by _drain_results().
+        self.pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="db")
+        # Auto-stop any running app.py, off the startup path (it can take seconds on Windows)
+        self.pool.submit(stop_app_py)
+        self.results = queue.Queue()
+        self._latest = {}    # tag -> generation of the newest request with that tag
+        self._pending = {}   # tag -> Future of that request
+        self._debounce_id = None
+
         top = ttk.Frame(self)
         top.pack(fill=tk.X, padx=8, pady=8)
 
@@ -63,18 +94,45 @@ class SimpleUI(tk.Tk):
         self.filter_entry.pack(side=tk.LEFT, padx=(6, 4))
         self.filter_entry.bind("<Return>", lambda e: self.apply_filter())
         self.filter_entry.bind("<Escape>", lambda e: self.clear_filter())
+        self.filter_var.trace_add("write", self.on_filter_typed)
         ttk.Button(top, text="Filter", command=self.apply_filter).pack(side=tk.LEFT)
         ttk.Button(top, text="Clear", command=self.clear_filter).pack(side=tk.LEFT, padx=(6, 12))
+        self.archived_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top, text="Include archived", variable=self.archived_var,
+                        command=self.refresh).pack(side=tk.LEFT, padx=(0, 12))
 
         ttk.Button(top, text="Create Index", command=self.create_indexes).pack(side=tk.LEFT, padx=4)
 
         ttk.Button(top, text="Insert", command=self.insert_dialog).pack(side=tk.RIGHT)
-        ttk.Button(top, text="Export CSV", command=self.export_csv).pack(side=tk.RIGHT, padx=6)
+        self.export_btn = ttk.Button(top, text="Export CSV", command=self.export_csv)
+        self.export_btn.pack(side=tk.RIGHT, padx=6)
         ttk.Button(top, text="Refresh", command=self.refresh).pack(side=tk.RIGHT, padx=6)
-
-        # Main area: treeview
+        ttk.Button(top, text="Metrics", command=self.show_metrics).pack(side=tk.RIGHT, padx=6)
+        ttk.Button(top, text="Sales", command=self.show_sales).pack(side=tk.RIGHT, padx=6)
+
+        # Structured criteria, combined with the filter box; the facet line counts every match
+        crit = ttk.Frame(self)
+        crit.pack(fill=tk.X, padx=8, pady=(0, 4))
+        ttk.Label(crit, text="Price from:").pack(side=tk.LEFT)
+        self.min_price_var = tk.StringVar()
+        ttk.Entry(crit, textvariable=self.min_price_var, width=12).pack(side=tk.LEFT, padx=(6, 4))
+        ttk.Label(crit, text="to:").pack(side=tk.LEFT)
+        self.max_price_var = tk.StringVar()
+        ttk.Entry(crit, textvariable=self.max_price_var, width=12).pack(side=tk.LEFT, padx=(6, 12))
+        ttk.Label(crit, text="Status:").pack(side=tk.LEFT)
+        self.status_filter_var = tk.StringVar(value="any")
+        ttk.Combobox(crit, textvariable=self.status_filter_var, values=("any",) + STATUSES, state="readonly",
+                     width=10).pack(side=tk.LEFT, padx=(6, 12))
+        for var in (self.min_price_var, self.max_price_var, self.status_filter_var):
+            var.trace_add("write", self.on_filter_typed)
+        self.facets_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.facets_var, foreground="gray25").pack(fill=tk.X, padx=8, pady=(0, 4))
+
+        # Main area: treeview holding a sliding window of keyset pages
+        grid = ttk.Frame(self)
+        grid.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0, 8))
         cols = ("_id", "title", "city", "price", "status")
-        self.tree = ttk.Treeview(self, columns=cols, show="headings", selectmode="browse")
+        self.tree = ttk.Treeview(grid, columns=cols, show="headings", selectmode="browse")
         for c in cols:
             self.tree.heading(c, text=c)
         self.tree.column("_id", width=160)
@@ -83,7 +141,10 @@ class SimpleUI(tk.Tk):
         self.tree.column("price", width=90, anchor=tk.E)
         self.tree.column("status", width=100)
 
-        self.tree.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0, 8))
+        self.vsb = ttk.Scrollbar(grid, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
+        self.vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
 
         # Bottom controls
@@ -105,48 +166,312 @@ class SimpleUI(tk.Tk):
         self.purchase_btn = ttk.Button(bot, text="Purchase", command=self.purchase_property, state=tk.DISABLED)
         self.purchase_btn.pack(side=tk.RIGHT, padx=6)
 
-        # Status bar at bottom
+        # Status bar at bottom, with a progress bar shown during exports
+        status = ttk.Frame(self)
+        status.pack(fill=tk.X, side=tk.BOTTOM)
         self.status_var = tk.StringVar(value="Ready")
-        ttk.Label(self, textvariable=self.status_var, relief=tk.SUNKEN).pack(fill=tk.X, side=tk.BOTTOM)
+        ttk.Label(status, textvariable=self.status_var, relief=tk.SUNKEN).pack(fill=tk.X, side=tk.LEFT, expand=True)
+        self.progress = ttk.Progressbar(status, length=200, mode="determinate")
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        start_invalidation()
+        local_replica.start_sync()
+        metrics.serve_from_env()
+        self.after(POLL_MS, self._drain_results)
 
         # initial load
         self.current_filter = None
+        self.current_query = {}
+        self.current_price = (None, None)
+        self.current_status = None
+        self.facets = None
+        self.rows = {}            # iid (str _id) -> projected document shown in that row
+        self.next_token = None    # continuation below the last loaded row
+        self.prev_token = None    # continuation above the first loaded row (set once rows are dropped)
+        self._fetching = False
+        self._first_page_shown = False
         self.load_items()
+        mark("window built")
+        self.after_idle(lambda: mark("window drawn"))
 
     def set_status(self, text):
         # small transient status using window title
         self.title(f"Real Estate — Simple UI    {text}")
+        self.status_var.set(text)
+
+    def run_in_background(self, work, on_done, on_error=None, tag=None, op=None):
+        """Run work() on the worker pool, then on_done(result) or on_error(exc) on the Tk thread.
+
+        Requests sharing a `tag` supersede each other: an older one that has not
+        started is cancelled, and one already running has its result dropped.
+        `op` names the operation its MongoDB commands are counted under in metrics.
+        """
+        gen = None
+        if tag:
+            gen = self._latest.get(tag, 0) + 1
+            self._latest[tag] = gen
+            older = self._pending.get(tag)
+            if older:
+                older.cancel()
+        on_error = on_error or (lambda e: messagebox.showerror("Error", str(e)))
+
+        def task():
+            try:
+                with operation(op or "other"):
+                    result = work()
+                self.results.put((tag, gen, on_done, result))
+            except Exception as e:
+                self.results.put((tag, gen, on_error, e))
+
+        future = self.pool.submit(task)
+        if tag:
+            self._pending[tag] = future
+
+    def post(self, callback, value):
+        """Called from a worker thread: run callback(value) on the Tk thread."""
+        self.results.put((None, None, callback, value))
+
+    def _drain_results(self):
+        try:
+            while True:
+                tag, gen, callback, value = self.results.get_nowait()
+                if tag and gen != self._latest.get(tag):
+                    continue  # superseded by a newer request
+                try:
+                    callback(value)
+                except Exception as e:
+                    messagebox.showerror("Error", str(e))
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self._drain_results)
+
+    def on_close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
     def load_items(self, filter_text=None):
-        """Load up to 200 items (to keep UI responsive). Case-insensitive partial match on city."""
-        self.tree.delete(*self.tree.get_children())
-        q = {}
-        if filter_text:
-            pat = re.escape(filter_text)
-            # match either city or title (case-insensitive partial match)
-            q = {"$or": [{"city": {"$regex": pat, "$options": "i"}}, {"title": {"$regex": pat, "$options": "i"}}]}
+        """Load the first page and its facet counts for the filter box and the price/status criteria.
+
+        The filter text is a case-insensitive city prefix or title substring match.
+        """
+        status = self.status_filter_var.get()
+        status = None if status == "any" else status
         try:
-            docs = list(properties_col.find(q).sort("price", 1).limit(200))
-            for d in docs:
-                self.tree.insert("", tk.END, values=(str(d.get("_id")), d.get("title"), d.get("city"), d.get("price"), d.get("status")))
-            self.current_filter = filter_text
-            self.set_status(f"Loaded {len(docs)} items")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load items: {e}")
+            # city (prefix of the normalized key) or title (partial, via the gram index), plus the criteria
+            q = facets.build_filter(filter_text, min_price=self.min_price_var.get().strip(),
+                                    max_price=self.max_price_var.get().strip(), status=status)
+        except PropertyError as e:
+            self.set_status(str(e))
+            return
+        price = q.get("price", {})
+        criteria = ((price.get("$gte"), price.get("$lte")), status)
+        self.set_status("Loading…")
+        self._latest["more"] = self._latest.get("more", 0) + 1  # drop scroll fetches for the old filter
+        self._fetching = True
+        union = self._union()
+        self.run_in_background(
+            lambda: facets.search(q, None, PAGE_SIZE, GRID_PROJECTION, union),
+            lambda result: self.show_page(result[0], filter_text, q, criteria, result[1]),
+            self._fetch_failed,
+            tag="load",
+            op="search" if q else "list",
+        )
+
+    def _union(self):
+        return ARCHIVE_COLLECTION if self.archived_var.get() else None
+
+    def _fetch_failed(self, e):
+        self._fetching = False
+        messagebox.showerror("Error", f"Failed to load items: {e}")
+
+    def show_page(self, page, filter_text, query, criteria, counts):
+        self.tree.delete(*self.tree.get_children())
+        self.rows = {}
+        for d in page.docs:
+            self._insert_row(d, tk.END)
+        self.current_filter = filter_text
+        self.current_query = query
+        self.current_price, self.current_status = criteria
+        self.facets = counts
+        self.facets_var.set(self._facet_text(counts))
+        self.next_token = page.next_token
+        self.prev_token = None
+        self._fetching = False
+        self.tree.yview_moveto(0)
+        self._show_count()
+        if not self._first_page_shown:
+            self._first_page_shown = True
+            mark("first page shown")
+            if STARTUP_TIMING:
+                print("\n".join(["Startup timing:"] + startup_report()), file=sys.stderr)
+
+    @staticmethod
+    def _facet_text(counts):
+        parts = [", ".join(f"{s or 'other'} {n:,}" for s, n in counts["statuses"].items())]
+        cities = ", ".join(f"{c['city'] or c['city_key']} {c['count']:,}" for c in counts["cities"][:FACET_CITIES])
+        if len(counts["cities"]) > FACET_CITIES:
+            cities += ", …"
+        parts.append(cities)
+        if counts["price_bands"] is not None:
+            parts.append(", ".join(f"{b['band']}: {b['count']:,}" for b in counts["price_bands"] if b["count"]))
+        return f"{counts['total']:,} matches — " + " — ".join(p for p in parts if p)
+
+    def _show_count(self):
+        more = " (scroll for more)" if self.next_token else ""
+        if self.facets and self.facets["total"] > len(self.rows):
+            more = f" of {self.facets['total']:,}{more}"
+        hit_ratio = query_cache.stats()["hit_ratio"]
+        commands, p95 = metrics.totals()
+        db_stats = f" — db p95 {p95:.0f} ms over {commands} cmds" if commands else ""
+        local = " — local copy" if local_replica.ready() else ""
+        self.set_status(f"Showing {len(self.rows)} items{more}{local} — cache hits {hit_ratio:.0%}{db_stats}")
+
+    def _insert_row(self, doc, index):
+        iid = str(doc["_id"])
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+        self.rows[iid] = doc
+        self.tree.insert("", index, iid=iid, values=(iid, doc.get("title"), doc.get("city"), doc.get("price"), doc.get("status")))
+
+    def _remove_rows(self, iids):
+        self.tree.delete(*iids)
+        for iid in iids:
+            self.rows.pop(iid, None)
+
+    def on_tree_scroll(self, first, last):
+        """Scrollbar callback: page more rows in as the view nears either end of the loaded window."""
+        self.vsb.set(first, last)
+        if self._fetching:
+            return
+        if float(last) >= PREFETCH_AT and self.next_token:
+            self.fetch_more("next")
+        elif float(first) <= 1 - PREFETCH_AT and self.prev_token:
+            self.fetch_more("prev")
+
+    def fetch_more(self, direction):
+        token = self.next_token if direction == "next" else self.prev_token
+        q = self.current_query
+        self._fetching = True
+        union = self._union()
+        self.run_in_background(
+            lambda: cached_page(properties_col, query=q, token=token, per_page=PAGE_SIZE, projection=GRID_PROJECTION,
+                                union_with=union),
+            lambda page: self.add_page(page, direction),
+            self._fetch_failed,
+            tag="more",
+            op="search" if q else "list",
+        )
+
+    def add_page(self, page, direction):
+        """Extend the window by one page and trim the far end so at most MAX_ROWS stay loaded."""
+        self._fetching = False
+        if direction == "next":
+            for d in page.docs:
+                self._insert_row(d, tk.END)
+            self.next_token = page.next_token
+            children = self.tree.get_children()
+            overflow = len(children) - MAX_ROWS
+            if overflow > 0:
+                self._remove_rows(children[:overflow])
+                self.prev_token = encode_token(self.rows[children[overflow]], "prev")
+                self.tree.yview_scroll(-overflow, "units")
+        else:
+            for d in reversed(page.docs):
+                self._insert_row(d, 0)
+            self.prev_token = page.prev_token
+            self.tree.yview_scroll(len(page.docs), "units")
+            children = self.tree.get_children()
+            overflow = len(children) - MAX_ROWS
+            if overflow > 0:
+                self._remove_rows(children[-overflow:])
+                self.next_token = encode_token(self.rows[children[-overflow - 1]], "next")
+        self._show_count()
+
+    @staticmethod
+    def _sort_key(doc):
+        return (doc.get("price", -1), doc["_id"])
+
+    def _matches_filter(self, doc):
+        low, high = self.current_price
+        price = doc.get("price") or 0
+        if (low is not None and price < low) or (high is not None and price > high):
+            return False
+        if self.current_status and doc.get("status") != self.current_status:
+            return False
+        text = self.current_filter
+        if not text:
+            return True
+        if city_key(doc.get("city")).startswith(city_key(text)):
+            return True
+        return len(fold(text)) >= MIN_TITLE_SEARCH and fold(text) in fold(doc.get("title") or "")
+
+    def apply_row(self, doc):
+        """Insert, move or redraw one row after a write, instead of reloading the grid."""
+        iid = str(doc["_id"])
+        selected = iid in self.tree.selection()
+        if self.tree.exists(iid):
+            self._remove_rows([iid])
+        if not self._matches_filter(doc):
+            self._show_count()
+            return
+        children = self.tree.get_children()
+        keys = [self._sort_key(self.rows[c]) for c in children]
+        key = self._sort_key(doc)
+        # Rows beyond a loaded edge belong to a page that is not in the window.
+        if children and ((self.prev_token and key < keys[0]) or (self.next_token and key > keys[-1])):
+            self._show_count()
+            return
+        if not children and (self.prev_token or self.next_token):
+            return
+        self._insert_row(doc, bisect.bisect_left(keys, key))
+        if selected:
+            self.tree.selection_set(iid)
+        self._show_count()
+
+    def mark_sold(self, iid):
+        if iid in self.rows:
+            self.apply_row(dict(self.rows[iid], status="sold"))
+
+    def remove_row(self, iid):
+        if self.tree.exists(iid):
+            self._remove_rows([iid])
+        self.on_select(None)
+        self._show_count()
+
+    def _cancel_debounce(self):
+        if self._debounce_id:
+            self.after_cancel(self._debounce_id)
+            self._debounce_id = None
+
+    def on_filter_typed(self, *_):
+        """Filter as the user types, once they pause for DEBOUNCE_MS."""
+        self._cancel_debounce()
+        self._debounce_id = self.after(DEBOUNCE_MS, self._filter_now)
+
+    def _filter_now(self):
+        self._debounce_id = None
+        self.load_items(filter_text=self.filter_var.get().strip() or None)
 
     def apply_filter(self):
+        self._cancel_debounce()
         txt = self.filter_var.get().strip()
-        if not txt:
-            messagebox.showinfo("Info", "Enter a city to filter")
+        criteria = (self.min_price_var.get().strip(), self.max_price_var.get().strip(),
+                    self.status_filter_var.get() != "any")
+        if not txt and not any(criteria):
+            messagebox.showinfo("Info", "Enter a city, a title or a price/status criterion to filter")
             return
-        self.load_items(filter_text=txt)
+        self.load_items(filter_text=txt or None)
 
     def clear_filter(self):
         self.filter_var.set("")
+        self.min_price_var.set("")
+        self.max_price_var.set("")
+        self.status_filter_var.set("any")
+        self._cancel_debounce()
         self.load_items(filter_text=None)
 
     def refresh(self):
-        """Reload the current items with existing filter."""
+        """Reload the grid from the top with the existing filter."""
         self.load_items(filter_text=self.current_filter)
 
     def on_select(self, event):
@@ -194,28 +519,19 @@ class SimpleUI(tk.Tk):
                 return
 
             try:
-                price = int(price_str)
-                if price < 0:
-                    messagebox.showerror("Error", "Price cannot be negative")
-                    return
-            except ValueError:
-                messagebox.showerror("Error", "Price must be a valid number")
+                doc = build_property(title, city, price_str)
+            except PropertyError as e:
+                messagebox.showerror("Error", str(e))
                 return
 
-            doc = {
-                "title": title,
-                "city": city,
-                "price": price,
-                "status": "available",
-                "created_at": datetime.now(UTC)
-            }
-            try:
-                res = properties_col.insert_one(doc)
-                messagebox.showinfo("Inserted", f"Inserted id: {res.inserted_id}")
-                dlg.destroy()
-                self.refresh()
-            except Exception as e:
-                messagebox.showerror("Error", f"Insert failed: {e}")
+            def done(inserted_id):
+                messagebox.showinfo("Inserted", f"Inserted id: {inserted_id}")
+                if dlg.winfo_exists():
+                    dlg.destroy()
+                self.apply_row({k: doc.get(k) for k in GRID_PROJECTION})
+
+            self.run_in_background(lambda: store.insert_property(doc), done,
+                                   lambda e: messagebox.showerror("Error", f"Insert failed: {e}"))
 
         ttk.Button(dlg, text="Insert", command=do_insert).pack(pady=12)
 
@@ -237,13 +553,15 @@ class SimpleUI(tk.Tk):
         except InvalidId:
             messagebox.showerror("Error", "Invalid property id")
             return
-        try:
-            r = properties_col.update_one({"_id": obj_id}, {"$set": {"price": newp}})
-            messagebox.showinfo("Updated", f"Modified: {r.modified_count}")
+
+        def done(modified):
+            messagebox.showinfo("Updated", f"Modified: {modified}")
             self.new_price_var.set("")  # Clear the input after successful update
-            self.refresh()
-        except Exception as e:
-            messagebox.showerror("Error", f"Update failed: {e}")
+            if modified and _id in self.rows:
+                self.apply_row(dict(self.rows[_id], price=newp))
+
+        self.run_in_background(lambda: store.update_price(obj_id, newp), done,
+                               lambda e: messagebox.showerror("Error", f"Update failed: {e}"))
 
     def delete_property(self):
         _id = self.sel_id_var.get().strip()
@@ -252,38 +570,59 @@ class SimpleUI(tk.Tk):
             return
         if not messagebox.askyesno("Confirm", "Delete selected property?"):
             return
-        try:
-            r = properties_col.delete_one({"_id": ObjectId(_id)})
-            messagebox.showinfo("Deleted", f"Deleted count: {r.deleted_count}")
-            self.load_items(filter_text=self.current_filter)
-        except Exception as e:
-            messagebox.showerror("Error", f"Delete failed: {e}")
+
+        def done(deleted):
+            messagebox.showinfo("Deleted", f"Deleted count: {deleted}")
+            self.remove_row(_id)
+
+        self.run_in_background(lambda: store.delete_property(ObjectId(_id)), done,
+                               lambda e: messagebox.showerror("Error", f"Delete failed: {e}"))
 
     def export_csv(self):
-        try:
-            docs = list(properties_col.find({}))
-            if not docs:
+        """Export in the background, with progress against the estimated document count."""
+        self.export_btn.config(state=tk.DISABLED)
+        self.progress.config(value=0, maximum=1)
+        self.progress.pack(side=tk.RIGHT, padx=4)
+
+        include_archived = self.archived_var.get()
+
+        def work():
+            total = properties_col.estimated_document_count()
+            if include_archived:
+                total += properties_archive_col.estimated_document_count()
+            self.post(self._export_started, total)
+            return export_properties(EXPORT_PATH, progress=lambda rows, secs: self.post(self._export_progress, (rows, secs)),
+                                     progress_every=EXPORT_PROGRESS_EVERY, include_archived=include_archived)
+
+        def finish():
+            self.progress.pack_forget()
+            self.export_btn.config(state=tk.NORMAL)
+
+        def done(stats):
+            finish()
+            if not stats.rows:
                 messagebox.showinfo("Info", "No documents to export")
                 return
-            fieldnames = set()
-            rows = []
-            for d in docs:
-                row = {}
-                for k, v in d.items():
-                    row[k] = str(v) if k == "_id" else v
-                    fieldnames.add(k)
-                rows.append(row)
-            fieldnames = list(fieldnames)
-            path = "properties_export.csv"
-            with open(path, "w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                for r in rows:
-                    writer.writerow(r)
-            messagebox.showinfo("Exported", f"Exported to {path}")
-        except Exception as e:
+            self.set_status(f"Exported {stats.rows} rows")
+            messagebox.showinfo("Exported", f"Exported {stats.rows} rows to {stats.path} ({stats.rows_per_sec:.0f} rows/s)")
+
+        def failed(e):
+            finish()
             messagebox.showerror("Error", f"Export failed: {e}")
 
+        self.run_in_background(work, done, failed, op="export")
+
+    def _export_started(self, total):
+        self.progress.config(maximum=max(total, 1))
+        self.set_status(f"Exporting ~{total} rows…")
+
+    def _export_progress(self, update):
+        rows, secs = update
+        if rows > float(self.progress.cget("maximum")):
+            self.progress.config(maximum=rows)
+        self.progress.config(value=rows)
+        self.set_status(f"Exporting: {rows} rows ({rows / secs:.0f} rows/s)")
+
     def purchase_property(self):
         _id = self.sel_id_var.get().strip()
         if not _id:
@@ -297,46 +636,116 @@ class SimpleUI(tk.Tk):
         except Exception:
             messagebox.showerror("Error", "Offer price must be a number")
             return
-        try:
-            # Try transactional path first
-            try:
-                with client.start_session() as session:
-                    with session.start_transaction():
-                        r = properties_col.update_one({"_id": ObjectId(_id), "status": "available"}, {"$set": {"status": "sold"}}, session=session)
-                        if r.modified_count == 0:
-                            raise Exception("Property not available")
-                        transactions_col.insert_one({"property_id": ObjectId(_id), "buyer_name": buyer, "price": price, "date": datetime.now(UTC)}, session=session)
+
+        def done(transactional):
+            if transactional:
                 messagebox.showinfo("Success", "Purchase recorded (transaction)")
-                self.load_items(filter_text=self.current_filter)
-                return
-            except OperationFailure:
-                # fallback to non-transactional flow for standalone MongoDB
-                pass
-
-            # Non-transactional fallback: perform conditional update then insert
-            r = properties_col.update_one({"_id": ObjectId(_id), "status": "available"}, {"$set": {"status": "sold"}})
-            if r.modified_count == 0:
-                raise Exception("Property not available")
-            try:
-                transactions_col.insert_one({"property_id": ObjectId(_id), "buyer_name": buyer, "price": price, "date": datetime.now(UTC)})
+            else:
                 messagebox.showinfo("Success", "Purchase recorded (no transactions available on this server)")
-            except Exception as ie:
-                messagebox.showwarning("Partial Success", f"Property marked sold but failed to record transaction: {ie}")
-            self.load_items(filter_text=self.current_filter)
-        except Exception as e:
-            messagebox.showerror("Transaction failed", f"{e}\n(Transactions require a replica set or Atlas for full atomicity)")
+            self.mark_sold(_id)
+
+        def failed(e):
+            if isinstance(e, AlreadySold):
+                messagebox.showerror("Transaction failed", "Property already sold")
+                self.mark_sold(_id)
+            elif isinstance(e, PropertyNotFound):
+                messagebox.showerror("Transaction failed", "Property not found")
+                self.remove_row(_id)
+            elif isinstance(e, PartialWrite):
+                messagebox.showwarning("Partial Success", str(e))
+                self.mark_sold(_id)
+            else:
+                messagebox.showerror("Transaction failed", f"{e}\n(Transactions require a replica set or Atlas for full atomicity)")
+
+        # Transactional when the server supports it, conditional update + insert otherwise
+        self.run_in_background(lambda: store.purchase_property(ObjectId(_id), buyer, price), done, failed)
 
     def create_indexes(self):
-        """Create database indexes on city and price for faster queries."""
-        try:
-            idx_city = properties_col.create_index([("city", 1)])
-            idx_price = properties_col.create_index([("price", 1)])
-            messagebox.showinfo("Indexes Created", f"Created indexes:\n• city: {idx_city}\n• price: {idx_price}")
-            self.set_status("Indexes created successfully")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to create indexes: {e}")
+        """Ensure the declared indexes from indexes.py (idempotent)."""
+
+        def done(changes):
+            lines = [f"• {coll}: {', '.join(made) if made else 'up to date'}" for coll, made in changes.items()]
+            messagebox.showinfo("Indexes", "Indexes ensured:\n" + "\n".join(lines))
+            self.set_status("Indexes ensured")
+
+        self.run_in_background(ensure_indexes, done,
+                               lambda e: messagebox.showerror("Error", f"Failed to create indexes: {e}"))
+
+    def show_metrics(self):
+        """Per-operation MongoDB command metrics, with a button to write the Prometheus dump."""
+        win = tk.Toplevel(self)
+        win.title("MongoDB metrics")
+        text = tk.Text(win, width=110, height=24, font="TkFixedFont", wrap=tk.NONE)
+        text.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
+
+        def fill():
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            text.insert(tk.END, "\n".join(metrics.summary_lines()))
+            text.config(state=tk.DISABLED)
+
+        def dump():
+            try:
+                path = metrics.write_prometheus()
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not write metrics: {e}", parent=win)
+                return
+            messagebox.showinfo("Metrics", f"Wrote {path}", parent=win)
+
+        buttons = ttk.Frame(win)
+        buttons.pack(fill=tk.X, padx=8, pady=(0, 8))
+        ttk.Button(buttons, text="Refresh", command=fill).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Write Prometheus file", command=dump).pack(side=tk.LEFT, padx=6)
+        ttk.Button(buttons, text="Close", command=win.destroy).pack(side=tk.RIGHT)
+        fill()
+
+    def show_sales(self):
+        """Sales per day or month, for one city or all, read from the sales rollups."""
+        win = tk.Toplevel(self)
+        win.title("Sales")
+        controls = ttk.Frame(win)
+        controls.pack(fill=tk.X, padx=8, pady=8)
+        by_var = tk.StringVar(value="month")
+        city_var = tk.StringVar()
+        ttk.Label(controls, text="By:").pack(side=tk.LEFT)
+        ttk.Combobox(controls, textvariable=by_var, values=tuple(sales_stats.GRANULARITIES), width=7,
+                     state="readonly").pack(side=tk.LEFT, padx=(4, 12))
+        ttk.Label(controls, text="City (blank for all):").pack(side=tk.LEFT)
+        city_entry = ttk.Entry(controls, textvariable=city_var, width=20)
+        city_entry.pack(side=tk.LEFT, padx=4)
+        cols = ("period", "sales", "revenue", "avg", "min", "max")
+        tree = ttk.Treeview(win, columns=cols, show="headings", height=18)
+        for c in cols:
+            tree.heading(c, text=c)
+            tree.column(c, width=110, anchor=tk.E if c != "period" else tk.W)
+        tree.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0, 8))
+
+        def show(rows):
+            if not win.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for r in rows:
+                tree.insert("", tk.END, values=(r["period"], r["count"], r["revenue"], f"{r['avgPrice']:.0f}",
+                                                r["min"], r["max"]))
+
+        def load():
+            by, city = by_var.get(), city_var.get().strip()
+            key = city_key(city) if city else None
+            self.run_in_background(
+                lambda: cached("sales", {"by": by, "k": key, "n": SALES_PERIODS},
+                               lambda: sales_stats.read_sales(by, city or None, last=SALES_PERIODS), scope=key),
+                show,
+                tag="sales",
+                op="stats",
+            )
+
+        city_entry.bind("<Return>", lambda e: load())
+        ttk.Button(controls, text="Show", command=load).pack(side=tk.LEFT, padx=4)
+        ttk.Button(controls, text="Close", command=win.destroy).pack(side=tk.RIGHT)
+        load()
 
 
 if __name__ == "__main__":
+    mark("imports")
     app = SimpleUI()
     app.mainloop()